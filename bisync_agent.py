@@ -0,0 +1,259 @@
+"""BiSync+ agent: serve a folder over a socket so scans and hashes run next to the data.
+
+Run it on the machine that owns the files (NAS, server) and map its network mount
+to it with the ``agents`` setting of the app::
+
+    python bisync_agent.py --root /srv/share --port 8765 [--token SEGRETO]
+
+Protocol: one JSON line per request/response; a ``"n"`` field announces that many
+raw bytes right after the line. Requests on one connection are answered in order,
+so clients may pipeline them.
+
+- ``hello {token}``                       -> ``{ok, version}``
+- ``scan {path, skip}``                   -> ``{d, m, f: [[name, size, mtime]]}`` per directory, then ``{end}``
+- ``hash {paths, io}``                    -> ``{i, h}`` per file (completion order), then ``{end}``
+- ``read {path, offset, length, io}``     -> ``{ok, n}`` + data
+- ``write {path, offset, n}`` + data      -> ``{ok}``
+- ``close {path, mtime, atime, mode}``    -> ``{ok}`` (creates the file if nothing was written)
+
+Errors come back as ``{ok: false, error, errno}``. Standard library only.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import posixpath
+import socket
+import socketserver
+import stat
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+PROTOCOL_VERSION = 1
+DEFAULT_PORT = 8765
+HASH_CHUNK = 1024 * 1024
+MAX_READ = 16 * 1024 * 1024        # limite per singola richiesta read
+NOCACHE_MIN = 1024 * 1024          # come in bisync_plus: sotto non conviene fadvise
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def _dontneed(fd: int, offset: int = 0, length: int = 0):
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+def file_digest(path: str, io_mode: str = "cached") -> str:
+    """MD5 of ``path``; ``nocache``/``direct`` drop the pages read, ``reread`` flushes first."""
+    try:
+        with open(path, "rb") as f:
+            fd = f.fileno()
+            if io_mode == "reread":
+                os.fsync(fd)
+                _dontneed(fd)
+            nocache = io_mode != "cached" and os.fstat(fd).st_size >= NOCACHE_MIN
+            if nocache and hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            h = hashlib.md5()
+            while True:
+                buf = f.read(HASH_CHUNK)
+                if not buf:
+                    break
+                h.update(buf)
+            if nocache:
+                _dontneed(fd)
+            return h.hexdigest()
+    except OSError:
+        return ""
+
+
+class AgentServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root: str, token: str = ""):
+        self.root = os.path.realpath(root)
+        self.token = token
+        super().__init__(address, AgentHandler)
+
+    def resolve(self, rel: str) -> str:
+        """Absolute path of ``rel`` (posix, relative to the root); never outside the root."""
+        norm = posixpath.normpath("/" + (rel or "")).lstrip("/")
+        path = os.path.join(self.root, *norm.split("/")) if norm else self.root
+        real = os.path.realpath(path)
+        if real != self.root and not real.startswith(self.root.rstrip(os.sep) + os.sep):
+            raise PermissionError(f"fuori dalla radice: {rel}")
+        return path
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    wbufsize = 1 << 16
+    server: AgentServer
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.writing: dict[str, object] = {}    # path -> file aperto in scrittura
+        self.reading: tuple[str, object] | None = None
+
+    def finish(self):
+        for f in self.writing.values():
+            f.close()
+        if self.reading:
+            self.reading[1].close()
+        super().finish()
+
+    def reply(self, msg: dict, payload: bytes = b"", flush: bool = True):
+        if payload:
+            msg["n"] = len(payload)
+        self.wfile.write(json.dumps(msg).encode("utf-8") + b"\n")
+        if payload:
+            self.wfile.write(payload)
+        if flush:
+            self.wfile.flush()
+
+    def handle(self):
+        authed = not self.server.token
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                req = json.loads(line)
+                payload = self.rfile.read(req.get("n", 0)) if req.get("n") else b""
+            except ValueError:
+                return
+            op = req.get("op")
+            try:
+                if op == "hello":
+                    if self.server.token and not hmac.compare_digest(str(req.get("token", "")), self.server.token):
+                        self.reply({"ok": False, "error": "token non valido", "errno": 13})
+                        return
+                    authed = True
+                    self.reply({"ok": True, "version": PROTOCOL_VERSION})
+                elif not authed:
+                    self.reply({"ok": False, "error": "autenticazione richiesta", "errno": 13})
+                    return
+                elif op == "scan":
+                    self.op_scan(req)
+                elif op == "hash":
+                    self.op_hash(req)
+                elif op == "read":
+                    self.op_read(req)
+                elif op == "write":
+                    self.op_write(req, payload)
+                elif op == "close":
+                    self.op_close(req)
+                else:
+                    self.reply({"ok": False, "error": f"operazione sconosciuta: {op}", "errno": 22})
+            except ConnectionError:
+                return
+            except OSError as e:
+                self.reply({"ok": False, "error": str(e), "errno": e.errno or 5})
+
+    def op_scan(self, req: dict):
+        top = self.server.resolve(req.get("path", ""))
+        skip = set(req.get("skip") or [])
+        for base, dirs, files in os.walk(top):
+            dirs[:] = [d for d in dirs if d not in skip]
+            rel_dir = os.path.relpath(base, top).replace(os.sep, "/")
+            rel_dir = "" if rel_dir == "." else rel_dir
+            try:
+                dir_mtime = os.stat(base).st_mtime
+            except OSError:
+                continue
+            entries = []
+            for name in files:
+                try:
+                    st = os.lstat(os.path.join(base, name))
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    entries.append([name, st.st_size, st.st_mtime])
+            self.reply({"d": rel_dir, "m": dir_mtime, "f": entries}, flush=False)
+        self.reply({"end": True})
+
+    def op_hash(self, req: dict):
+        paths = req.get("paths") or []
+        io_mode = req.get("io", "cached")
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            futures = {pool.submit(file_digest, self.server.resolve(p), io_mode): i for i, p in enumerate(paths)}
+            for fut in as_completed(futures):
+                self.reply({"i": futures[fut], "h": fut.result()})
+        self.reply({"end": True})
+
+    def op_read(self, req: dict):
+        path = req["path"]
+        if self.reading is None or self.reading[0] != path:
+            if self.reading:
+                self.reading[1].close()
+            self.reading = None
+            self.reading = (path, open(self.server.resolve(path), "rb"))
+        f = self.reading[1]
+        offset = int(req.get("offset", 0))
+        f.seek(offset)
+        data = f.read(min(int(req.get("length", HASH_CHUNK)), MAX_READ))
+        if req.get("io", "cached") != "cached" and data:
+            _dontneed(f.fileno(), offset, len(data))
+        if len(data) < int(req.get("length", 0)):  # fine file: niente più letture su questo
+            f.close()
+            self.reading = None
+        self.reply({"ok": True}, data)
+
+    def op_write(self, req: dict, payload: bytes):
+        path = req["path"]
+        f = self.writing.get(path)
+        if f is None:
+            f = self.writing[path] = open(self.server.resolve(path), "wb")
+        offset = int(req.get("offset", 0))
+        if f.tell() != offset:
+            f.seek(offset)
+        f.write(payload)
+        self.reply({"ok": True})
+
+    def op_close(self, req: dict):
+        path = req["path"]
+        f = self.writing.pop(path, None)
+        if f is None:
+            f = open(self.server.resolve(path), "wb")
+        try:
+            # le pagine sporche non si possono scartare: prima su disco, poi DONTNEED
+            if f.tell() >= NOCACHE_MIN and hasattr(os, "posix_fadvise"):
+                f.flush()
+                os.fdatasync(f.fileno())
+                _dontneed(f.fileno())
+        finally:
+            f.close()
+        full = self.server.resolve(path)
+        if req.get("mode") is not None:
+            os.chmod(full, int(req["mode"]) & 0o7777)
+        if req.get("mtime") is not None:
+            os.utime(full, (float(req.get("atime", req["mtime"])), float(req["mtime"])))
+        self.reply({"ok": True})
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="BiSync+ agent: serve una cartella per scansioni e copie remote")
+    parser.add_argument("--root", required=True, help="cartella servita")
+    parser.add_argument("--host", default="127.0.0.1", help="indirizzo di ascolto (default solo locale)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--token", default=os.environ.get("BISYNC_AGENT_TOKEN", ""),
+                        help="segreto condiviso richiesto ai client (o BISYNC_AGENT_TOKEN)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    with AgentServer((args.host, args.port), args.root, args.token) as server:
+        logging.info("Agent su %s:%d per %s", args.host, server.server_address[1], server.root)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,359 @@
+"""BiSync+ churn harness: sync two folders while they keep changing, then measure convergence.
+
+A generator mutates both roots at a fixed rate (edits, new files, deletions,
+renames, whole directories appearing/vanishing, large files rewritten while they
+may be copied) while ``SyncEngine`` runs like the monitor, one sync every
+``--interval`` seconds. When the churn stops the syncs continue until a run has
+nothing to do and the two trees are identical. Reported:
+
+- convergence latency (end of churn -> converged), number of runs and actions;
+- repeated work: the same source version copied to the same destination more than once
+  (conservative pairs count restores of deleted files here too);
+- consistency of the final snapshot with the files on disk.
+
+With a fixed ``--seed`` the mutation sequence is repeatable, so the thresholds
+(``--max-converge``, ``--max-repeated``, ``--max-errors``) make it a regression
+gate: exit code 1 when one is exceeded or the final state is inconsistent::
+
+    python bisync_churn.py --files 2000 --rate 50 --duration 30 --json churn.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import bisync_plus as bp
+
+BIG_FILE = 4 * 1024 * 1024         # file "grandi": riscritti a blocchi, spesso durante la copia
+BIG_SHARE = 0.02                   # quota di file grandi nell'albero iniziale
+WRITE_BLOCK = 256 * 1024
+# pesi delle mutazioni: modifica, nuovo, elimina, rinomina, nuova cartella, cartella sparita, file grande
+OPS = {"modify": 40, "create": 20, "delete": 15, "rename": 10, "mkdir": 5, "rmdir": 5, "rewrite_big": 5}
+
+
+def _visible(root: Path) -> dict[str, os.stat_result]:
+    """Files the engine syncs, as ``{rel: stat}`` (metadata, archive and temp files excluded)."""
+    out = {}
+    for base, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.startswith("."):
+                continue
+            path = os.path.join(base, name)
+            try:
+                out[os.path.relpath(path, root).replace(os.sep, "/")] = os.stat(path)
+            except OSError:
+                continue
+    return out
+
+
+def _write(path: Path, size: int, rnd: random.Random):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        while size > 0:
+            n = min(size, WRITE_BLOCK)
+            f.write(rnd.randbytes(n))
+            f.flush()
+            size -= n
+
+
+def _file_size(rnd: random.Random) -> int:
+    return rnd.randint(BIG_FILE, 2 * BIG_FILE) if rnd.random() < BIG_SHARE else rnd.randint(100, 64 * 1024)
+
+
+class Churner(threading.Thread):
+    """Mutates both roots at ``rate`` operations per second until stopped."""
+
+    def __init__(self, roots: list[Path], rate: float, seed: int):
+        super().__init__(name="bisync-churn", daemon=True)
+        self.roots = roots
+        self.rate = rate
+        self.rnd = random.Random(seed)
+        self.stop_event = threading.Event()
+        self.counts: Counter = Counter()
+        self.failed = 0          # mutazioni non riuscite (file appena spostato dalla sync, ecc.)
+        self._serial = 0
+        self._listing: dict[Path, tuple[float, list, list]] = {}
+
+    def _list(self, root: Path) -> tuple[list, list]:
+        # elenco rinfrescato al massimo ogni mezzo secondo: un walk per mutazione costerebbe troppo
+        cached = self._listing.get(root)
+        if cached is None or time.monotonic() - cached[0] > 0.5:
+            files = [(root / rel, st.st_size) for rel, st in _visible(root).items()]
+            dirs = sorted({path.parent for path, _ in files if path.parent != root})
+            cached = self._listing[root] = (time.monotonic(), sorted(files), dirs)
+        return cached[1], cached[2]
+
+    def _pick_file(self, root: Path, big: bool = False) -> Path | None:
+        files = [path for path, size in self._list(root)[0] if not big or size >= BIG_FILE]
+        return self.rnd.choice(files) if files else None
+
+    def _pick_dir(self, root: Path) -> Path | None:
+        dirs = self._list(root)[1]
+        return self.rnd.choice(dirs) if dirs else None
+
+    def _new_name(self, folder: Path) -> Path:
+        self._serial += 1
+        return folder / f"churn_{self._serial:06d}.dat"
+
+    def mutate(self):
+        rnd = self.rnd
+        root = rnd.choice(self.roots)
+        op = rnd.choices(list(OPS), weights=list(OPS.values()))[0]
+        if op == "modify":
+            path = self._pick_file(root)
+            if path:
+                _write(path, _file_size(rnd), rnd)
+        elif op == "create":
+            _write(self._new_name(self._pick_dir(root) or root), _file_size(rnd), rnd)
+        elif op == "delete":
+            path = self._pick_file(root)
+            if path:
+                path.unlink()
+        elif op == "rename":
+            path = self._pick_file(root)
+            if path:
+                path.rename(self._new_name(self._pick_dir(root) or root))
+        elif op == "mkdir":
+            folder = root / f"dir_churn_{self._serial:06d}"
+            for _ in range(rnd.randint(1, 20)):
+                _write(self._new_name(folder), rnd.randint(100, 16 * 1024), rnd)
+        elif op == "rmdir":
+            folder = self._pick_dir(root)
+            if folder:
+                shutil.rmtree(folder)
+        elif op == "rewrite_big":
+            path = self._pick_file(root, big=True) or self._new_name(root)
+            _write(path, rnd.randint(BIG_FILE, 2 * BIG_FILE), rnd)
+        self.counts[op] += 1
+
+    def run(self):
+        next_at = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                self.mutate()
+            except OSError:
+                self.failed += 1
+            next_at += 1.0 / self.rate
+            self.stop_event.wait(max(0.0, next_at - time.monotonic()))
+
+
+def counting_engine(base: type, copies: Counter, lock: threading.Lock) -> type:
+    """``base`` engine that records every copy as (destination, source size, source mtime)."""
+    class ChurnEngine(base):
+        def _safe_fanout(self, src_abs, targets, preallocate=None):
+            try:
+                st = os.stat(src_abs)
+            except OSError:
+                st = None
+            super()._safe_fanout(src_abs, targets, preallocate)
+            if st is not None:
+                with lock:
+                    for dst_abs, _, _, _ in targets:
+                        copies[(os.path.normpath(str(dst_abs)), st.st_size, st.st_mtime_ns)] += 1
+    return ChurnEngine
+
+
+def compare_trees(left: Path, right: Path) -> list[str]:
+    """Differences between the two roots (missing files, size or content)."""
+    a, b = _visible(left), _visible(right)
+    problems = [f"solo in A: {rel}" for rel in sorted(a.keys() - b.keys())]
+    problems += [f"solo in B: {rel}" for rel in sorted(b.keys() - a.keys())]
+    for rel in sorted(a.keys() & b.keys()):
+        if a[rel].st_size != b[rel].st_size or bp.file_digest(left / rel) != bp.file_digest(right / rel):
+            problems.append(f"contenuto diverso: {rel}")
+    return problems
+
+
+def check_snapshot(pair: bp.Pair) -> list[str]:
+    """Snapshot entries that do not describe the files on disk."""
+    snap = bp.Snapshot(pair)
+    snap.load()
+    if not snap.loaded_from:
+        return ["snapshot assente o illeggibile"]
+    problems = []
+    for side, root in (("A", Path(pair.left)), ("B", Path(pair.right))):
+        files = _visible(root)
+        for rel, st in files.items():
+            entry = snap.data.get(rel)
+            if entry is None or entry.get(side) is None:
+                problems.append(f"{side}: {rel} manca nello snapshot")
+            elif abs(entry[side] - st.st_mtime) > bp.MTIME_FUZZ or entry.get("size" + side) != st.st_size:
+                problems.append(f"{side}: {rel} diverso dallo snapshot")
+        for rel, entry in snap.data.items():
+            if entry.get(side) is not None and rel not in files and not any(p.startswith(".") for p in rel.split("/")):
+                problems.append(f"{side}: {rel} nello snapshot ma non su disco")
+    return problems
+
+
+def run_harness(args) -> dict:
+    work = Path(args.workdir or tempfile.mkdtemp(prefix="bisync_churn_"))
+    left = Path(args.left) if args.left else work / "A"
+    right = Path(args.right) if args.right else work / "B"
+    rnd = random.Random(args.seed)
+    for root in (left, right):
+        if root.exists() and any(root.iterdir()):
+            raise SystemExit(f"{root} non è vuota")
+        root.mkdir(parents=True, exist_ok=True)
+    for i in range(args.files):
+        _write(left / f"d{i % max(1, args.files // 50):03d}" / f"f{i:06d}.dat", _file_size(rnd), rnd)
+
+    pair = bp.Pair(left=str(left), right=str(right), conservative=not args.propagate)
+    settings = {"durability": "none", **args.settings}
+    copies: Counter = Counter()
+    lock = threading.Lock()
+    engine_cls = counting_engine(bp.AsyncSyncEngine if args.engine == "async" else bp.SyncEngine, copies, lock)
+    errors: list[str] = []
+
+    def log(msg: str):
+        if msg.startswith("❌"):
+            errors.append(msg)
+        if args.verbose:
+            print(msg)
+
+    def sync() -> int:
+        engine = engine_cls([pair], log, lambda *a: None, lambda *a: None,
+                            threading.Event(), threading.Event(), settings)
+        engine.run()
+        return engine.pair_stats.get(pair.id_hash(), (0, 0.0))[0]
+
+    t0 = time.monotonic()
+    sync()  # allineamento iniziale, fuori dalle misure
+    initial = time.monotonic() - t0
+    copies.clear()
+
+    churner = Churner([left, right], args.rate, args.seed + 1)
+    runs = actions = 0
+    churner.start()
+    churn_end = time.monotonic() + args.duration
+    while time.monotonic() < churn_end:
+        actions += sync()
+        runs += 1
+        time.sleep(max(0.0, min(args.interval, churn_end - time.monotonic())))
+    churner.stop_event.set()
+    churner.join()
+    stopped = time.monotonic()
+
+    # dopo la churn: sync finché una passata non ha niente da fare e gli alberi coincidono
+    converged = None
+    settle_runs = 0
+    while time.monotonic() - stopped < args.settle_timeout:
+        n = sync()
+        runs += 1
+        settle_runs += 1
+        actions += n
+        if n == 0 and not compare_trees(left, right):
+            converged = time.monotonic() - stopped
+            break
+        time.sleep(args.interval)
+
+    total_copies = sum(copies.values())
+    repeated = sum(n - 1 for n in copies.values())
+    result = {
+        "seed": args.seed,
+        "files": args.files,
+        "rate": args.rate,
+        "duration": args.duration,
+        "engine": args.engine,
+        "initial_sync_s": round(initial, 3),
+        "mutations": dict(churner.counts),
+        "mutations_failed": churner.failed,
+        "runs": runs,
+        "settle_runs": settle_runs,
+        "actions": actions,
+        "copies": total_copies,
+        "repeated_copies": repeated,
+        "repeated_ratio": round(repeated / total_copies, 4) if total_copies else 0.0,
+        "converge_s": None if converged is None else round(converged, 3),
+        "errors": len(errors),
+        "tree_problems": compare_trees(left, right),
+        "snapshot_problems": check_snapshot(pair),
+    }
+    if not args.keep and not args.workdir and not args.left and not args.right:
+        shutil.rmtree(work, ignore_errors=True)
+    return result
+
+
+def gate(result: dict, args) -> list[str]:
+    """Threshold violations of ``result`` (empty list = passed)."""
+    failures = []
+    if result["converge_s"] is None:
+        failures.append(f"nessuna convergenza entro {args.settle_timeout}s")
+    elif args.max_converge is not None and result["converge_s"] > args.max_converge:
+        failures.append(f"convergenza {result['converge_s']}s > {args.max_converge}s")
+    if args.max_repeated is not None and result["repeated_ratio"] > args.max_repeated:
+        failures.append(f"copie ripetute {result['repeated_ratio']:.1%} > {args.max_repeated:.1%}")
+    if args.max_errors is not None and result["errors"] > args.max_errors:
+        failures.append(f"errori {result['errors']} > {args.max_errors}")
+    if result["tree_problems"]:
+        failures.append(f"{len(result['tree_problems'])} differenze tra A e B")
+    if result["snapshot_problems"]:
+        failures.append(f"{len(result['snapshot_problems'])} voci di snapshot incoerenti")
+    return failures
+
+
+def _setting(text: str) -> tuple[str, object]:
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="BiSync+: sync sotto modifiche continue, misura della convergenza")
+    parser.add_argument("--files", type=int, default=2000, help="file iniziali in A")
+    parser.add_argument("--rate", type=float, default=50.0, help="mutazioni al secondo (su entrambe le radici)")
+    parser.add_argument("--duration", type=float, default=30.0, help="secondi di churn")
+    parser.add_argument("--interval", type=float, default=1.0, help="pausa tra due sync, come il monitor")
+    parser.add_argument("--settle-timeout", type=float, default=120.0, help="attesa massima della convergenza")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--engine", choices=("thread", "async"), default="thread")
+    parser.add_argument("--propagate", action="store_true", help="coppia con propagazione eliminazioni")
+    parser.add_argument("--setting", dest="settings", type=_setting, action="append", default=[],
+                        metavar="KEY=VALUE", help="impostazione del motore (valore JSON), ripetibile")
+    parser.add_argument("--workdir", help="cartella di lavoro (default temporanea, rimossa alla fine)")
+    parser.add_argument("--left", help="radice A (es. su un altro disco); deve essere vuota")
+    parser.add_argument("--right", help="radice B; deve essere vuota")
+    parser.add_argument("--keep", action="store_true", help="non rimuovere la cartella temporanea")
+    parser.add_argument("--max-converge", type=float, help="soglia: secondi per convergere")
+    parser.add_argument("--max-repeated", type=float, help="soglia: quota di copie ripetute (0-1)")
+    parser.add_argument("--max-errors", type=int, help="soglia: azioni fallite")
+    parser.add_argument("--json", help="scrive il risultato in questo file")
+    parser.add_argument("--verbose", action="store_true", help="mostra il log del motore")
+    args = parser.parse_args(argv)
+    args.settings = dict(args.settings)
+
+    result = run_harness(args)
+    failures = gate(result, args)
+    result["failures"] = failures
+    print(f"Mutazioni: {sum(result['mutations'].values())} {result['mutations']} (fallite {result['mutations_failed']})")
+    print(f"Sync: {result['runs']} ({result['settle_runs']} dopo la churn), azioni {result['actions']}, "
+          f"copie {result['copies']}, ripetute {result['repeated_copies']} ({result['repeated_ratio']:.1%}), "
+          f"errori {result['errors']}")
+    converge = "mai" if result["converge_s"] is None else f"{result['converge_s']}s"
+    print(f"Convergenza: {converge}; differenze A/B {len(result['tree_problems'])}, "
+          f"snapshot incoerente {len(result['snapshot_problems'])}")
+    for problem in (result["tree_problems"] + result["snapshot_problems"])[:20]:
+        print(f"  - {problem}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    for failure in failures:
+        print(f"❌ {failure}")
+    print("✅ Gate superato" if not failures else "❌ Gate non superato")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
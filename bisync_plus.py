@@ -4,14 +4,27 @@
 import os
 import sys
 import re
+import errno
 import json
 import time
 import math
 import glob
+import posixpath
 import queue
 import shutil
+import stat
+import socket
+import heapq
+import itertools
+import operator
 import hashlib
+import mmap
+import uuid
+import asyncio
 import threading
+import multiprocessing
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from dataclasses import dataclass, asdict, field
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -25,14 +38,57 @@ import pystray
 from pystray import MenuItem as tray_item
 from plyer import notification
 
+try:
+    import numpy as np  # opzionale: planner vettoriale per alberi molto grandi
+except ImportError:
+    np = None
+
 APP_NAME = "BiSync+"
 CONFIG_NAME = "bisync_config.json"
 LOG_NAME = "bisync_log.txt"
 STATE_PREFIX = ".bisync_state_"
+JOURNAL_PREFIX = ".bisync_journal_"
 MTIME_FUZZ = 1.0  # secondi di tolleranza su mtime
 DEFAULT_EXCLUDES = ["*.tmp", "*.temp", "*.swp", "Thumbs.db", ".DS_Store", "desktop.ini"]
 ARCHIVE_DIRNAME = ".sync_archive"
 TRASH_DIRNAME = ".sync_trash"
+ARCHIVE_INDEX_NAME = "index.json"
+ARCHIVE_OBJECTS_DIRNAME = "objects"
+FICLONE = 0x40049409  # ioctl Linux per i reflink (btrfs/xfs)
+TMP_SUFFIX = ".bisync-tmp"
+DURABILITY_MODES = ("none", "batch", "strict")
+VERIFY_MODES = ("off", "trust", "reread")  # verifica copie: nessuna | digest in streaming | rilettura
+IO_MODES = ("cached", "nocache", "direct")  # page cache: normale | fadvise | O_DIRECT sui file grandi
+NOCACHE_MIN = 1024 * 1024              # sotto questa dimensione le hint non valgono la syscall
+NOCACHE_WINDOW = 8 * 1024 * 1024       # DONTNEED ogni N byte letti
+DIRECT_IO_MIN = 64 * 1024 * 1024       # O_DIRECT solo oltre questa dimensione
+HASH_CACHE_NAME = ".bisync_hashes.json"
+HASH_CHUNK = 1024 * 1024
+COPY_CHUNK = 1024 * 1024
+PIPELINE_BUFFERS = 4                   # buffer del ring lettore -> scrittore nelle copie tra dispositivi
+PIPELINE_MIN = 4 * COPY_CHUNK          # sotto, il thread lettore costa più di quanto fa guadagnare
+PREFETCH_BYTES = PIPELINE_BUFFERS * COPY_CHUNK  # readahead chiesto per la prossima copia
+SMALL_FILE_LIMIT = 256 * 1024          # copie fino a questa dimensione vanno nella corsia a lotti
+SMALL_BATCH_MAX = 512                  # file per lotto (una riga di log, un aggiornamento progress)
+HASH_LARGE_FILE = 64 * 1024 * 1024     # oltre: hash in thread invece che nel pool di processi
+HASH_BATCH_FILES = 256                 # file piccoli per task del pool
+HASH_BATCH_BYTES = 32 * 1024 * 1024
+HASH_POOL_MIN_FILES = 512              # sotto queste soglie il pool non conviene
+HASH_POOL_MIN_BYTES = 256 * 1024 * 1024
+PRIORITY_ORDER = "flagged,size,recent"  # criteri di ordinamento delle copie (impostazione priority_order)
+LARGE_COPY = 64 * 1024 * 1024          # copie "grandi": intercalate con le altre
+INTERLEAVE_BYTES = 64 * 1024 * 1024    # byte di copie piccole/medie tra due copie grandi
+VOLUME_ID_NAME = ".bisync_volume"      # id del volume rimovibile, per il fast-attach
+REMOVABLE_PREFIXES = ("/media/", "/run/media/", "/Volumes/")
+SNAPSHOT_META_KEY = "//meta"           # non può essere un percorso relativo valido
+DEFAULT_THROUGHPUT = 20 * 1024 * 1024  # stima di copia (byte/s) finché non c'è una misura
+RATE_MIN_BYTES = 8 * 1024 * 1024       # byte copiati prima di fidarsi della velocità misurata
+NUMPY_PLAN_MIN = 20000                 # percorsi da confrontare oltre cui il planner NumPy conviene
+ACTION_OVERHEAD = 0.01                 # secondi stimati per azione oltre ai byte (open, rename, log)
+AGENT_WINDOW = 8                       # richieste read/write in volo per connessione agent
+AGENT_TIMEOUT = 60.0
+ADAPT_HISTORY = 4                      # sync recenti senza azioni prima di allungare l'intervallo
+ADAPT_SCAN_SHARE = 4                   # intervallo >= 4x la durata della sync (scansione <= ~25% del tempo)
 
 def app_dir() -> Path:
     return Path(__file__).resolve().parent
@@ -67,6 +123,799 @@ def format_eta(seconds: float) -> str:
         return f"{m}m {s}s"
     return f"{s}s"
 
+
+def _advise(fd: int, offset: int, length: int, advice: str):
+    # posix_fadvise è solo un suggerimento: assente (Windows) o rifiutato non è un errore
+    value = getattr(os, advice, None)
+    if value is None:
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, value)
+    except OSError:
+        pass
+
+
+class SourceReader:
+    """
+    Sequential reader for hashing and copying that keeps bulk reads out of the
+    page cache: ``nocache`` advises SEQUENTIAL and drops consumed ranges with
+    DONTNEED, ``direct`` additionally reads large files with O_DIRECT.
+    """
+    def __init__(self, path: Path, io_mode: str = "cached", chunk: int = COPY_CHUNK):
+        self.chunk = chunk
+        self._buf: Optional[mmap.mmap] = None
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self.size = os.fstat(self.fd).st_size
+        if io_mode == "direct" and hasattr(os, "O_DIRECT") and self.size >= DIRECT_IO_MIN:
+            try:
+                direct = os.open(path, os.O_RDONLY | os.O_DIRECT)
+            except OSError:
+                pass  # filesystem senza O_DIRECT (tmpfs, alcuni FUSE)
+            else:
+                os.close(self.fd)
+                self.fd = direct
+                self._buf = mmap.mmap(-1, chunk)  # buffer allineato alla pagina, come vuole O_DIRECT
+        self.nocache = io_mode != "cached" and self._buf is None and self.size >= NOCACHE_MIN
+        self._dropped = 0
+        self._pos = 0
+        if self.nocache:
+            _advise(self.fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+
+    @property
+    def aligned(self) -> bool:
+        """True when reads need page-aligned buffers (O_DIRECT)."""
+        return self._buf is not None
+
+    def __enter__(self) -> "SourceReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        if self._buf is not None:
+            try:
+                self._buf.close()
+            except BufferError:
+                pass  # un chunk è ancora referenziato (uscita per eccezione): lo libera il GC
+            self._buf = None
+
+    def chunks(self, offset: int = 0, length: Optional[int] = None):
+        """Yield the data from ``offset`` (to EOF or for ``length`` bytes); each chunk is valid until the next."""
+        os.lseek(self.fd, offset, os.SEEK_SET)
+        pos = offset
+        end = None if length is None else offset + length
+        while end is None or pos < end:
+            if self._buf is not None and end is None:
+                n = os.readv(self.fd, [self._buf])
+                data = memoryview(self._buf)[:n]
+            else:
+                data = os.read(self.fd, self.chunk if end is None else min(self.chunk, end - pos))
+                n = len(data)
+            if not n:
+                break
+            try:
+                yield data
+            finally:
+                if isinstance(data, memoryview):
+                    data.release()
+            pos += n
+            self._consumed(pos)
+        self._consumed(pos, final=True)
+
+    def readinto(self, buf) -> int:
+        """Read the next chunk (sequentially from offset 0) into ``buf``; 0 at EOF."""
+        n = os.readv(self.fd, [buf])
+        self._pos += n
+        self._consumed(self._pos, final=not n)
+        return n
+
+    def _consumed(self, pos: int, final: bool = False):
+        if self.nocache and (pos - self._dropped >= NOCACHE_WINDOW or (final and pos > self._dropped)):
+            _advise(self.fd, self._dropped, pos - self._dropped, "POSIX_FADV_DONTNEED")
+            self._dropped = pos
+
+
+def file_digest(path: Path, io_mode: str = "cached") -> str:
+    """Return the MD5 hex digest of ``path`` or ``""`` if it cannot be read."""
+    h = hashlib.md5()
+    try:
+        with SourceReader(path, io_mode, HASH_CHUNK) as reader:
+            for chunk in reader.chunks():
+                h.update(chunk)
+    except Exception:
+        return ""
+    return h.hexdigest()
+
+def _fsync_path(path: Path):
+    # su Windows fsync richiede un handle in scrittura e le directory non si possono aprire
+    if path.is_dir():
+        if os.name == "nt":
+            return
+        fd = os.open(str(path), os.O_RDONLY)
+    else:
+        fd = os.open(str(path), os.O_RDWR if os.name == "nt" else os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+_FALLOCATE = None
+
+def _preallocate(fd: int, size: int) -> bool:
+    """Reserve ``size`` bytes for ``fd`` without writing them (Linux ``fallocate``).
+
+    ``os.posix_fallocate`` is avoided on purpose: glibc emulates it by writing
+    zeros when the filesystem (e.g. some exFAT/FAT drivers) lacks support.
+    """
+    global _FALLOCATE
+    if not sys.platform.startswith("linux") or size <= 0:
+        return False
+    if _FALLOCATE is None:
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fn = libc.fallocate
+            fn.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+            fn.restype = ctypes.c_int
+            _FALLOCATE = fn
+        except Exception:
+            _FALLOCATE = False
+    if not _FALLOCATE:
+        return False
+    return _FALLOCATE(fd, 0, 0, size) == 0
+
+
+def _data_segments(fd: int, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Return the ``(offset, length)`` data extents of ``fd`` or None if holes can't be detected."""
+    if not hasattr(os, "SEEK_DATA"):
+        return None
+    segments = []
+    pos = 0
+    try:
+        while pos < size:
+            try:
+                start = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:  # solo buco fino alla fine
+                    break
+                raise
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+            segments.append((start, end - start))
+            pos = end
+    except OSError:
+        return None
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+    return segments
+
+
+_SYNC_FILE_RANGE = None
+
+def _start_writeback(fd: int):
+    """Start writing the dirty pages of ``fd`` to disk without waiting (Linux ``sync_file_range``)."""
+    global _SYNC_FILE_RANGE
+    if not sys.platform.startswith("linux"):
+        return
+    if _SYNC_FILE_RANGE is None:
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fn = libc.sync_file_range
+            fn.argtypes = [ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong, ctypes.c_uint]
+            fn.restype = ctypes.c_int
+            _SYNC_FILE_RANGE = fn
+        except Exception:
+            _SYNC_FILE_RANGE = False
+    if _SYNC_FILE_RANGE:
+        _SYNC_FILE_RANGE(fd, 0, 0, 2)  # SYNC_FILE_RANGE_WRITE
+
+
+def _drop_written(fdst, size: int):
+    # le pagine sporche non si possono scartare: qui si avvia solo la scrittura (senza fsync,
+    # che resta alla politica di durabilità); DONTNEED lo fa DurableWriter al commit/fsync
+    if size < NOCACHE_MIN or not hasattr(os, "posix_fadvise"):
+        return
+    fdst.flush()
+    _start_writeback(fdst.fileno())
+
+
+def _drop_cached(path: Path):
+    """Drop the clean cached pages of ``path`` (POSIX_FADV_DONTNEED)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        _advise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+    finally:
+        os.close(fd)
+
+
+def _hash_zeros(digest, length: int):
+    # i buchi di un file sparso si leggono come zeri: entrano nel digest così
+    zeros = bytes(min(COPY_CHUNK, length))
+    while length > 0:
+        digest.update(zeros[:min(len(zeros), length)])
+        length -= len(zeros)
+
+
+def _pipelined_copy(fsrc: SourceReader, outs: list, h=None):
+    """
+    Copy ``fsrc`` to ``outs`` with a reader thread and the caller as writer, joined
+    by a ring of ``PIPELINE_BUFFERS`` reusable buffers: while a chunk is written
+    the next ones are already being read, so both devices stay busy.
+    """
+    ring = [mmap.mmap(-1, fsrc.chunk) if fsrc.aligned else bytearray(fsrc.chunk)
+            for _ in range(PIPELINE_BUFFERS)]
+    free: queue.Queue = queue.Queue()
+    filled: queue.Queue = queue.Queue()
+    for i in range(len(ring)):
+        free.put(i)
+
+    def reader():
+        try:
+            while True:
+                i = free.get()
+                if i is None:  # lo scrittore ha finito o ha fallito
+                    return
+                with memoryview(ring[i]) as view:
+                    n = fsrc.readinto(view)
+                filled.put((i, n))
+                if not n:
+                    return
+        except BaseException as e:
+            filled.put(e)
+
+    thread = threading.Thread(target=reader, name="bisync-copy-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = filled.get()
+            if isinstance(item, BaseException):
+                raise item
+            i, n = item
+            if not n:
+                break
+            with memoryview(ring[i]) as view, view[:n] as data:
+                for fdst in outs:
+                    fdst.write(data)
+                if h is not None:
+                    h.update(data)
+            free.put(i)
+    finally:
+        free.put(None)
+        thread.join()
+        for buf in ring:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+
+def _other_device(fsrc: SourceReader, outs: list) -> bool:
+    try:
+        dev = os.fstat(fsrc.fd).st_dev
+        return any(os.fstat(fdst.fileno()).st_dev != dev for fdst in outs)
+    except OSError:
+        return False
+
+
+def prefetch(path: Path, length: int = PREFETCH_BYTES):
+    """Ask the kernel to start reading the head of ``path`` in the background (WILLNEED)."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        _advise(fd, 0, length, "POSIX_FADV_WILLNEED")
+    finally:
+        os.close(fd)
+
+
+def copy_file_data(src: Path, dst: Path, preallocate: bool = True, digest: bool = False,
+                   io_mode: str = "cached", pipeline: bool = True) -> str:
+    """Copy the content of ``src`` into ``dst`` keeping holes of sparse files.
+
+    Non-sparse files are preallocated first (when supported) so the destination
+    is not grown chunk by chunk, which fragments it on USB/exFAT media. With
+    ``digest`` the MD5 of the data is computed while streaming and returned;
+    ``io_mode`` is the page-cache policy of ``SourceReader``. With ``pipeline``
+    large files going to another device are read and written concurrently.
+    """
+    return copy_file_data_multi(src, [dst], preallocate, digest, io_mode, pipeline)
+
+
+def copy_file_data_multi(src: Path, dsts: List[Path], preallocate: bool = True, digest: bool = False,
+                         io_mode: str = "cached", pipeline: bool = True) -> str:
+    """Like ``copy_file_data`` but writes every chunk to all ``dsts``: the source is read once."""
+    h = hashlib.md5() if digest else None
+    st = os.stat(src)
+    size = st.st_size
+    # st_blocks più piccolo della dimensione: probabile file sparso (letto senza O_DIRECT)
+    sparse = getattr(st, "st_blocks", None) is not None and st.st_blocks * 512 < size
+    src_mode = "nocache" if sparse and io_mode == "direct" else io_mode
+    with contextlib.ExitStack() as stack:
+        fsrc = stack.enter_context(SourceReader(src, src_mode))
+        outs = [stack.enter_context(open(dst, "wb")) for dst in dsts]
+        segments = _data_segments(fsrc.fd, size) if sparse else None
+        if segments is not None and sum(length for _, length in segments) < size:
+            pos = 0
+            for offset, length in segments:
+                if h is not None:
+                    _hash_zeros(h, offset - pos)
+                for fdst in outs:
+                    fdst.seek(offset)
+                for buf in fsrc.chunks(offset, length):
+                    for fdst in outs:
+                        fdst.write(buf)
+                    if h is not None:
+                        h.update(buf)
+                pos = offset + length
+            # eventuale buco finale, ma non oltre la sorgente se si è accorciata durante la copia
+            end = min(size, os.fstat(fsrc.fd).st_size)
+            if h is not None:
+                _hash_zeros(h, end - pos)
+            for fdst in outs:
+                fdst.truncate(end)
+        else:
+            if preallocate:
+                for fdst in outs:
+                    _preallocate(fdst.fileno(), size)
+            if pipeline and size >= PIPELINE_MIN and _other_device(fsrc, outs):
+                _pipelined_copy(fsrc, outs, h)
+            else:
+                for buf in fsrc.chunks():
+                    for fdst in outs:
+                        fdst.write(buf)
+                    if h is not None:
+                        h.update(buf)
+            if preallocate:
+                # fallocate ha già fissato la dimensione: se la sorgente si è accorciata
+                # durante la copia la destinazione non deve restare allungata con zeri
+                for fdst in outs:
+                    fdst.truncate(fdst.tell())
+        if io_mode != "cached":
+            for fdst in outs:
+                _drop_written(fdst, size)
+    return h.hexdigest() if h is not None else ""
+
+
+def copy_file(src: Path, dst: Path, preallocate: bool = True, digest: bool = False,
+              io_mode: str = "cached", pipeline: bool = True) -> str:
+    """Sparse-aware replacement for ``shutil.copy2`` (data + metadata); returns the digest if asked."""
+    return copy_file_multi(src, [dst], preallocate, digest, io_mode, pipeline)
+
+
+def copy_file_multi(src: Path, dsts: List[Path], preallocate: bool = True, digest: bool = False,
+                    io_mode: str = "cached", pipeline: bool = True) -> str:
+    """Fan-out ``copy_file``: one read of ``src``, data + metadata to every destination."""
+    result = copy_file_data_multi(src, dsts, preallocate, digest, io_mode, pipeline)
+    for dst in dsts:
+        shutil.copystat(str(src), str(dst))
+    return result
+
+
+def reread_digest(path: Path) -> str:
+    """Digest of ``path`` as stored on the device: flush it and drop its cached pages first."""
+    try:
+        with open(path, "rb+") as f:
+            fd = f.fileno()
+            os.fsync(fd)
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        return ""
+    return file_digest(path, "nocache")
+
+def temp_path_for(dst: Path) -> Path:
+    """Hidden temporary sibling of ``dst`` used for atomic replacement."""
+    return dst.with_name(f".{dst.name}.{os.getpid()}{TMP_SUFFIX}")
+
+
+def atomic_write_bytes(dst: Path, data: bytes, durability: str = "batch"):
+    """Write ``data`` to ``dst`` through a temp file + rename; fsync unless ``durability`` is "none"."""
+    tmp = temp_path_for(dst)
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            if durability != "none":
+                os.fsync(f.fileno())
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+    if durability != "none":
+        _fsync_path(dst.parent)
+
+
+def is_removable(path: Path) -> bool:
+    """Best-effort removable-media check: drive type on Windows, mount prefix elsewhere."""
+    try:
+        resolved = Path(path).resolve()
+        if os.name == "nt":
+            import ctypes
+            return ctypes.windll.kernel32.GetDriveTypeW(resolved.anchor) == 2  # DRIVE_REMOVABLE
+        return (str(resolved) + "/").startswith(REMOVABLE_PREFIXES)
+    except Exception:
+        return False
+
+
+def volume_id(root: Path, create: bool = False) -> str:
+    """Id stored in ``root/.bisync_volume``; a new one is written if missing and ``create``."""
+    marker = Path(root) / VOLUME_ID_NAME
+    try:
+        return marker.read_text(encoding="utf-8").strip()
+    except OSError:
+        pass
+    if not create:
+        return ""
+    vid = uuid.uuid4().hex
+    try:
+        atomic_write_bytes(marker, vid.encode("ascii"))
+    except OSError:
+        return ""
+    return vid
+
+
+def dir_digests(mapping: Dict[str, dict]) -> Dict[str, str]:
+    """
+    Merkle digest per directory ("" = root) over child names, sizes, whole-second
+    mtimes and hashes: equal digests on both sides mean the subtree needs no action.
+    """
+    children: Dict[str, List[str]] = {}
+    for rel, info in mapping.items():
+        d, name = posixpath.split(rel)
+        children.setdefault(d, []).append(f"f/{name}/{info['size']}/{int(info['mtime'])}/{info.get('hash', '')}")
+    for d in list(children):
+        while d:
+            d = posixpath.dirname(d)
+            if d in children:
+                break
+            children[d] = []
+    digests: Dict[str, str] = {}
+    for d in sorted(children, key=lambda d: d.count("/") + 1 if d else 0, reverse=True):
+        h = hashlib.md5("\n".join(sorted(children[d])).encode("utf-8", "surrogateescape")).hexdigest()
+        digests[d] = h
+        if d:
+            children[posixpath.dirname(d)].append(f"d/{posixpath.basename(d)}/{h}")
+    return digests
+
+
+class DurableWriter:
+    """
+    Commit atomico dei file copiati (temp + rename) con fsync raggruppati.
+    Modalità:
+      - "none":   solo rename atomico, nessun fsync
+      - "batch":  fsync di file e directory toccati ogni ``batch_size`` file e a fine piano
+                  (sempre prima che lo snapshot venga salvato)
+      - "strict": fsync del file prima del rename e della directory subito dopo
+    Con ``drop`` le pagine del file escono dalla page cache dopo il suo fsync
+    (in "none" subito: si scartano solo quelle già scritte).
+    """
+    def __init__(self, mode: str = "batch", batch_size: int = 256):
+        self.mode = mode if mode in DURABILITY_MODES else "batch"
+        self.batch_size = max(1, batch_size)
+        self._files: List[Path] = []
+        self._drop: set = set()
+        self._dirs: set = set()
+        self._lock = threading.Lock()
+        self._link_ok = True
+
+    def commit(self, tmp: Path, dst: Path, overwrite: bool = True, drop: bool = False) -> bool:
+        """Atomically move the fully written ``tmp`` onto ``dst``.
+
+        With ``overwrite=False`` an existing ``dst`` is left alone and False is returned.
+        """
+        if self.mode == "strict":
+            _fsync_path(tmp)
+        if overwrite:
+            os.replace(tmp, dst)
+        elif not self._rename_noreplace(tmp, dst):
+            return False
+        if self.mode == "strict":
+            _fsync_path(dst.parent)
+        elif self.mode == "batch":
+            with self._lock:
+                self._files.append(dst)
+                if drop:
+                    self._drop.add(dst)
+                self._dirs.add(dst.parent)
+                full = len(self._files) >= self.batch_size
+            if full:
+                self.sync()
+            return True
+        if drop:
+            _drop_cached(dst)
+        return True
+
+    def _rename_noreplace(self, tmp: Path, dst: Path) -> bool:
+        # verifica atomica "dst non esiste" senza un exists() in più
+        if os.name == "nt":
+            try:
+                os.rename(tmp, dst)  # su Windows rename fallisce se dst esiste
+                return True
+            except FileExistsError:
+                return False
+        if self._link_ok:
+            try:
+                os.link(tmp, dst)
+                os.unlink(tmp)
+                return True
+            except FileExistsError:
+                return False
+            except OSError:
+                self._link_ok = False  # filesystem senza hardlink (FAT/exFAT)
+        if os.path.lexists(dst):
+            return False
+        os.replace(tmp, dst)
+        return True
+
+    def note_dirs(self, *dirs: Path):
+        """Record directories whose entries changed (renames, deletions)."""
+        if self.mode == "strict":
+            for d in dirs:
+                _fsync_path(d)
+        elif self.mode == "batch":
+            with self._lock:
+                self._dirs.update(dirs)
+
+    def sync(self):
+        """Flush the pending batch: one fsync per file, then one per directory."""
+        with self._lock:
+            files, dirs, drop = self._files, self._dirs, self._drop
+            self._files, self._dirs, self._drop = [], set(), set()
+        for p in files:
+            try:
+                _fsync_path(p)
+            except OSError:
+                pass
+            if p in drop:
+                _drop_cached(p)
+        for d in dirs:
+            try:
+                _fsync_path(d)
+            except OSError:
+                pass
+
+def _hash_batch(paths: List[str], io_mode: str = "cached") -> List[str]:
+    """Worker entry point for the hashing process pool (must stay top-level/picklable)."""
+    return [file_digest(Path(p), io_mode) for p in paths]
+
+
+_HASH_POOL: Optional[Tuple[int, ProcessPoolExecutor]] = None
+_HASH_POOL_LOCK = threading.Lock()
+
+def _hash_pool(workers: int) -> ProcessPoolExecutor:
+    # pool condiviso e riusato tra scansioni; "spawn" evita fork di un processo con thread Tk
+    global _HASH_POOL
+    with _HASH_POOL_LOCK:
+        if _HASH_POOL is None or _HASH_POOL[0] != workers:
+            if _HASH_POOL is not None:
+                _HASH_POOL[1].shutdown(wait=False, cancel_futures=True)
+            ctx = multiprocessing.get_context("spawn")
+            _HASH_POOL = (workers, ProcessPoolExecutor(max_workers=workers, mp_context=ctx))
+        return _HASH_POOL[1]
+
+
+class _AgentConn:
+    """One socket to a ``bisync_agent.py``: JSON lines, optional raw payload after each."""
+    def __init__(self, address: str, token: str = ""):
+        host, _, port = address.rpartition(":")
+        self.sock = socket.create_connection((host or "127.0.0.1", int(port)), timeout=AGENT_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+        self.pending = 0  # write in attesa di conferma
+        if token:
+            self.send({"op": "hello", "token": token})
+            self.recv()
+
+    def send(self, header: dict, payload=b""):
+        if payload:
+            header["n"] = len(payload)
+        self.sock.sendall(json.dumps(header).encode("utf-8") + b"\n")
+        if payload:
+            self.sock.sendall(payload)
+
+    def recv(self) -> Tuple[dict, bytes]:
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("agent: connessione chiusa")
+        msg = json.loads(line)
+        if msg.get("ok") is False:
+            raise OSError(msg.get("errno") or errno.EIO, f"agent: {msg.get('error', '')}")
+        n = msg.get("n", 0)
+        data = self.rfile.read(n) if n else b""
+        if len(data) < n:
+            raise ConnectionError("agent: risposta troncata")
+        return msg, data
+
+    def close(self):
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class AgentClient:
+    """
+    Client of a ``bisync_agent.py`` serving the directory mounted locally at ``mount``.
+    The engine keeps using the mount for renames, archive and snapshots; scans, hashes
+    and file data go through the agent. One connection per thread and role, so
+    pipelined replies never interleave; a connection left mid-stream is discarded.
+    """
+    def __init__(self, mount: str, address: str, token: str = ""):
+        self.mount = os.path.normcase(os.path.abspath(mount))
+        self.address = address
+        self.token = token
+        self.failed = False
+        self._local = threading.local()
+        self._all: List[_AgentConn] = []
+        self._lock = threading.Lock()
+
+    def covers(self, path) -> bool:
+        s = os.path.normcase(os.path.abspath(str(path)))
+        return s == self.mount or s.startswith(self.mount.rstrip(os.sep) + os.sep)
+
+    def remote(self, path) -> str:
+        rel = os.path.relpath(os.path.normcase(os.path.abspath(str(path))), self.mount)
+        return "" if rel == "." else rel.replace(os.sep, "/")
+
+    def _conn(self, role: str) -> _AgentConn:
+        conns = self._local.__dict__.setdefault("conns", {})
+        conn = conns.get(role)
+        if conn is None:
+            conn = conns[role] = _AgentConn(self.address, self.token)
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def _discard(self, role: str):
+        conn = self._local.__dict__.get("conns", {}).pop(role, None)
+        if conn is not None:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _session(self, role: str):
+        # risposte non consumate (stop, errore) renderebbero la connessione inutilizzabile
+        conn = self._conn(role)
+        try:
+            yield conn
+        except BaseException:
+            self._discard(role)
+            raise
+
+    def scan(self, path: str, skip: List[str]):
+        """Yield ``(rel_dir, dir_mtime, [[name, size, mtime], ...])`` per directory."""
+        with self._session("meta") as conn:
+            conn.send({"op": "scan", "path": path, "skip": skip})
+            while True:
+                msg, _ = conn.recv()
+                if msg.get("end"):
+                    return
+                yield msg["d"], msg["m"], msg["f"]
+
+    def hash_many(self, paths: List[str], io_mode: str = "cached"):
+        """Yield ``(index, md5)`` as the agent finishes each file ("" if unreadable)."""
+        with self._session("meta") as conn:
+            conn.send({"op": "hash", "paths": paths, "io": io_mode})
+            while True:
+                msg, _ = conn.recv()
+                if msg.get("end"):
+                    return
+                yield msg["i"], msg["h"]
+
+    def read_chunks(self, path: str, size: int, io_mode: str = "cached", chunk: int = COPY_CHUNK):
+        """Yield the data of ``path`` keeping up to ``AGENT_WINDOW`` reads in flight."""
+        with self._session("get") as conn:
+            offsets = iter(range(0, size, chunk))
+            inflight = 0
+            for offset in itertools.islice(offsets, AGENT_WINDOW):
+                conn.send({"op": "read", "path": path, "offset": offset, "length": chunk, "io": io_mode})
+                inflight += 1
+            while inflight:
+                _, data = conn.recv()
+                inflight -= 1
+                offset = next(offsets, None)
+                if offset is not None:
+                    conn.send({"op": "read", "path": path, "offset": offset, "length": chunk, "io": io_mode})
+                    inflight += 1
+                yield data
+
+    @contextlib.contextmanager
+    def writer(self, path: str):
+        """Pipelined upload of ``path``; call ``finish(stat)`` on the yielded writer to commit it."""
+        with self._session("put") as conn:
+            yield AgentWriter(conn, path)
+
+    def close(self):
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+class AgentWriter:
+    def __init__(self, conn: _AgentConn, path: str):
+        self.conn = conn
+        self.path = path
+        self.offset = 0
+
+    def write(self, buf):
+        self.conn.send({"op": "write", "path": self.path, "offset": self.offset}, buf)
+        self.offset += len(buf)
+        self.conn.pending += 1
+        while self.conn.pending > AGENT_WINDOW:
+            self.conn.recv()
+            self.conn.pending -= 1
+
+    def finish(self, st: os.stat_result):
+        while self.conn.pending:
+            self.conn.recv()
+            self.conn.pending -= 1
+        self.conn.send({"op": "close", "path": self.path, "mtime": st.st_mtime, "atime": st.st_atime,
+                        "mode": st.st_mode & 0o7777})
+        self.conn.recv()
+
+
+class HashCache:
+    """
+    Cache persistente degli hash di una radice (``.bisync_hashes.json``):
+    ``{"rel/path": [size, mtime, hash]}``. Un file con stessa dimensione e mtime
+    non viene riletto; ``verify_all`` nelle impostazioni forza la verifica completa.
+    """
+    def __init__(self, root: Path):
+        self.path = Path(root) / HASH_CACHE_NAME
+        self.data: Dict[str, list] = {}
+        self._dirty = False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            if isinstance(d, dict):
+                self.data = d
+        except Exception:
+            pass
+
+    def get(self, rel: str, size: int, mtime: float) -> str:
+        rec = self.data.get(rel)
+        if rec and rec[0] == size and rec[1] == mtime:
+            return rec[2]
+        return ""
+
+    def put(self, rel: str, size: int, mtime: float, file_hash: str):
+        if file_hash:
+            self.data[rel] = [size, mtime, file_hash]
+            self._dirty = True
+
+    def prune(self, stale):
+        """Drop entries for which ``stale(rel)`` is true."""
+        for rel in [r for r in self.data if stale(r)]:
+            del self.data[rel]
+            self._dirty = True
+
+    def save(self, durability: str = "batch"):
+        if not self._dirty:
+            return
+        try:
+            atomic_write_bytes(self.path, json.dumps(self.data, ensure_ascii=False).encode("utf-8"), durability)
+            self._dirty = False
+        except Exception:
+            pass
+
 @dataclass
 class Pair:
     left: str
@@ -79,6 +928,9 @@ class Pair:
     notes: str = ""
     sync_interval: int = 0              # intervallo specifico (s), 0 = usa globale
     silent_hours: str = ""             # "HH:MM-HH:MM" finestra silenziosa
+    touch_identical: bool = True       # stesso contenuto ma mtime diverso -> allinea solo mtime
+    io_mode: str = ""                  # "" = globale | "cached" | "nocache" | "direct"
+    priority_globs: List[str] = field(default_factory=list)  # es: ["*.xlsx"] copiati per primi
 
     def normalized(self) -> "Pair":
         # normalizza slash per consistenza
@@ -90,6 +942,216 @@ class Pair:
         key = (str(Path(self.left)).lower() + "|" + str(Path(self.right)).lower()).encode("utf-8")
         return hashlib.md5(key).hexdigest()[:10]
 
+@dataclass
+class SyncGroup:
+    """
+    N cartelle tenute allineate tra loro (es. PC, chiavetta, NAS): ogni radice è
+    scansionata una volta per ciclo e lo snapshot è unico per il gruppo.
+    """
+    roots: List[str]
+    name: str = ""
+    conservative: bool = True
+    use_trash: bool = True
+    conflict_policy: str = "newest"      # "newest" | "prefer_first" (vince la prima radice in elenco)
+    include_globs: List[str] = field(default_factory=list)
+    exclude_globs: List[str] = field(default_factory=lambda: DEFAULT_EXCLUDES.copy())
+    notes: str = ""
+    sync_interval: int = 0
+    silent_hours: str = ""
+    touch_identical: bool = True
+    io_mode: str = ""
+
+    def normalized(self) -> "SyncGroup":
+        self.roots = [str(Path(r)) for r in self.roots]
+        return self
+
+    def id_hash(self) -> str:
+        key = "|".join(sorted(str(Path(r)).lower() for r in self.roots)).encode("utf-8")
+        return hashlib.md5(key).hexdigest()[:10]
+
+    def root_key(self, index: int) -> str:
+        """Stable key of a root inside the group snapshot (independent of list order)."""
+        return hashlib.md5(str(Path(self.roots[index])).lower().encode("utf-8")).hexdigest()[:8]
+
+    def label(self) -> str:
+        return self.name or " ↔ ".join(self.roots)
+
+
+def parse_silent_hours(spec: str) -> Optional[Tuple[int, int]]:
+    """Parse ``"HH:MM-HH:MM"`` into minutes since midnight, None if empty or invalid."""
+    if not spec:
+        return None
+    try:
+        start_s, end_s = spec.split("-")
+        bounds = []
+        for part in (start_s, end_s):
+            hh, mm = part.strip().split(":")
+            h, m = int(hh), int(mm)
+            if not (0 <= h < 24 and 0 <= m < 60):
+                return None
+            bounds.append(h * 60 + m)
+        return bounds[0], bounds[1]
+    except ValueError:
+        return None
+
+
+class PairEntry:
+    """Coppia (o gruppo) della config già validata, con id e finestra silenziosa precalcolati."""
+    __slots__ = ("pair", "pid", "silent")
+
+    def __init__(self, pair: "Pair | SyncGroup"):
+        self.pair = pair.normalized()
+        self.pid = pair.id_hash()
+        self.silent = parse_silent_hours(pair.silent_hours)
+
+    def is_silent(self, now: datetime) -> bool:
+        if self.silent is None:
+            return False
+        t0, t1 = self.silent
+        minute = now.hour * 60 + now.minute
+        if t0 < t1:
+            return t0 <= minute < t1
+        return minute >= t0 or minute < t1
+
+    def silent_starts(self, now: datetime) -> float:
+        """Timestamp at which the next silent window begins."""
+        start = now.replace(hour=self.silent[0] // 60, minute=self.silent[0] % 60, second=0, microsecond=0)
+        if start <= now:
+            start += timedelta(days=1)
+        return start.timestamp()
+
+    def silent_until(self, now: datetime) -> float:
+        """Timestamp at which the current silent window ends."""
+        end = now.replace(hour=self.silent[1] // 60, minute=self.silent[1] % 60, second=0, microsecond=0)
+        if end <= now:
+            end += timedelta(days=1)
+        return end.timestamp()
+
+
+class ConfigModel:
+    """
+    Coppie della configurazione convertite una sola volta in ``PairEntry``.
+    Va ricaricato (``load``) solo quando la config cambia, da UI o su disco.
+    """
+    def __init__(self):
+        self.entries: List[PairEntry] = []
+        self.by_pid: Dict[str, PairEntry] = {}
+        self._by_obj: Dict[int, str] = {}
+
+    def load(self, pair_dicts: List[dict], group_dicts: Optional[List[dict]] = None):
+        entries = []
+        for cls, dicts in ((Pair, pair_dicts), (SyncGroup, group_dicts or [])):
+            for d in dicts:
+                try:
+                    entries.append(PairEntry(cls(**d)))
+                except Exception:
+                    pass
+        self.entries = entries
+        self.by_pid = {e.pid: e for e in entries}
+        self._by_obj = {id(e.pair): e.pid for e in entries}
+
+    @property
+    def pairs(self) -> List[Pair]:
+        return [e.pair for e in self.entries if isinstance(e.pair, Pair)]
+
+    @property
+    def groups(self) -> List[SyncGroup]:
+        return [e.pair for e in self.entries if isinstance(e.pair, SyncGroup)]
+
+    def pair_id(self, pair: Pair) -> str:
+        pid = self._by_obj.get(id(pair))
+        return pid if pid is not None else pair.id_hash()
+
+
+class PairScheduler:
+    """
+    Prossima esecuzione di ogni coppia in un heap: il monitor guarda solo la cima
+    invece di riscorrere tutte le coppie a ogni tick. Le coppie in esecuzione
+    vengono ripianificate al termine della sync.
+    Con l'intervallo adattivo ogni coppia ha il suo intervallo corrente, che
+    ``adapt`` raddoppia quando le ultime sync non hanno trovato nulla da fare e
+    dimezza quando trovano modifiche.
+    """
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._due: Dict[str, float] = {}
+        self._running: set = set()
+        self._interval: Dict[str, float] = {}
+        self._recent: Dict[str, List[int]] = {}   # azioni delle ultime ADAPT_HISTORY sync
+        self._lock = threading.Lock()
+
+    def rebuild(self, entries: List[PairEntry], default_interval: int, last_run: Dict[str, float],
+                adaptive: bool = False):
+        with self._lock:
+            if not adaptive:
+                self._interval.clear()
+                self._recent.clear()
+            self._due = {e.pid: last_run.get(e.pid, 0) + self._interval.get(e.pid, e.pair.sync_interval or default_interval)
+                         for e in entries if e.pid not in self._running}
+            self._heap = [(t, pid) for pid, t in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def schedule(self, pid: str, when: float):
+        with self._lock:
+            self._due[pid] = when
+            heapq.heappush(self._heap, (when, pid))
+
+    def pop_due(self, now: float) -> List[str]:
+        out = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                when, pid = heapq.heappop(self._heap)
+                if self._due.get(pid) == when:  # voci superate da una ripianificazione: scartate
+                    del self._due[pid]
+                    out.append(pid)
+        return out
+
+    def next_due(self) -> Optional[float]:
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def started(self, pids: List[str]):
+        with self._lock:
+            self._running.update(pids)
+            for pid in pids:
+                self._due.pop(pid, None)
+
+    def finished(self, pids: List[str]):
+        with self._lock:
+            self._running.difference_update(pids)
+
+    def adapt(self, pid: str, base: float, actions: int, seconds: float, lo: float, hi: float) -> float:
+        """Next interval of ``pid`` after a run that did ``actions`` in ``seconds``."""
+        with self._lock:
+            recent = self._recent.setdefault(pid, [])
+            recent.append(actions)
+            del recent[:-ADAPT_HISTORY]
+            cur = self._interval.get(pid, base)
+            if actions:  # modifiche dopo una pausa lunga: si riparte subito dall'intervallo base
+                cur = min(cur, base) / 2
+            elif not any(recent):
+                cur *= 2
+            # un intervallo esplicito più lungo/corto dei limiti resta raggiungibile
+            cur = min(max(hi, base), max(min(lo, base), ADAPT_SCAN_SHARE * seconds, cur))
+            self._interval[pid] = cur
+            return cur
+
+    def interval(self, pid: str, base: float) -> float:
+        with self._lock:
+            return self._interval.get(pid, base)
+
+    def due_at(self, pid: str) -> Optional[float]:
+        """Scheduled time of ``pid``; None while it runs or when it is not scheduled."""
+        with self._lock:
+            return None if pid in self._running else self._due.get(pid)
+
+    def is_running(self, pid: str) -> bool:
+        with self._lock:
+            return pid in self._running
+
+
 class Snapshot:
     """
     Memorizza l'ultimo stato visto per discernere:
@@ -110,6 +1172,8 @@ class Snapshot:
         self.pair = pair
         self.data: Dict[str, dict] = {}
         self.loaded_from: List[Path] = []
+        self.corrupt: List[Path] = []
+        self.meta: dict = {}
 
     def _paths(self) -> List[Path]:
         hid = self.pair.id_hash()
@@ -123,14 +1187,27 @@ class Snapshot:
                     with open(p, "r", encoding="utf-8") as f:
                         d = json.load(f)
                     if isinstance(d, dict) and d:
+                        meta = d.pop(SNAPSHOT_META_KEY, {})
+                        self.meta = meta if isinstance(meta, dict) else {}
                         self.data = d
                         self.loaded_from.append(p)
                         return
             except Exception:
+                # copia illeggibile: prova l'altra radice
+                self.corrupt.append(p)
                 continue
 
-    def save(self, mappingA: Dict[str, dict], mappingB: Dict[str, dict]):
-        out: Dict[str, dict] = {}
+    def side_entries(self, side: str) -> Dict[str, dict]:
+        """Files remembered on ``side`` ("A"/"B") as ``{rel: {mtime, size, hash}}``."""
+        return {rel: {"mtime": e[side], "size": e.get("size" + side, 0), "hash": e.get("hash" + side, "")}
+                for rel, e in self.data.items() if e.get(side) is not None}
+
+    def dir_mtimes(self, side: str) -> Dict[str, float]:
+        return {d: v[0] for d, v in (self.meta.get("dirs") or {}).get(side, {}).items()}
+
+    def save(self, mappingA: Dict[str, dict], mappingB: Dict[str, dict], durability: str = "batch",
+             meta: Optional[dict] = None):
+        out: Dict[str, dict] = {SNAPSHOT_META_KEY: meta} if meta else {}
         rels = set(mappingA.keys()) | set(mappingB.keys())
         for rel in rels:
             a = mappingA.get(rel)
@@ -143,16 +1220,702 @@ class Snapshot:
                 "hashA": a.get("hash", "") if a else "",
                 "hashB": b.get("hash", "") if b else "",
             }
-        payload = json.dumps(out, ensure_ascii=False, indent=0)
+        payload = json.dumps(out, ensure_ascii=False, indent=0).encode("utf-8")
         for p in self._paths():
             try:
-                with open(p, "w", encoding="utf-8") as f:
-                    f.write(payload)
+                atomic_write_bytes(p, payload, durability)
             except Exception:
                 pass
 
+class GroupSnapshot:
+    """
+    Stato dell'ultimo ciclo di un SyncGroup, una copia per radice:
+    ``{rel: {root_key: [mtime, size, hash]}}`` (radice assente = file assente).
+    """
+    def __init__(self, group: SyncGroup):
+        self.group = group
+        self.data: Dict[str, Dict[str, list]] = {}
+        self.corrupt: List[Path] = []
+
+    def _paths(self) -> List[Path]:
+        fname = f"{STATE_PREFIX}{self.group.id_hash()}.json"
+        return [Path(r) / fname for r in self.group.roots]
+
+    def load(self):
+        for p in self._paths():
+            try:
+                if p.exists():
+                    with open(p, "r", encoding="utf-8") as f:
+                        d = json.load(f)
+                    if isinstance(d, dict) and d:
+                        self.data = d
+                        return
+            except Exception:
+                self.corrupt.append(p)
+
+    def save(self, maps: List[Dict[str, dict]], durability: str = "batch"):
+        out: Dict[str, Dict[str, list]] = {}
+        for i, mapping in enumerate(maps):
+            key = self.group.root_key(i)
+            for rel, info in mapping.items():
+                out.setdefault(rel, {})[key] = [info["mtime"], info["size"], info.get("hash", "")]
+        payload = json.dumps(out, ensure_ascii=False, indent=0).encode("utf-8")
+        for p in self._paths():
+            try:
+                atomic_write_bytes(p, payload, durability)
+            except Exception:
+                pass
+
+
+def _reflink(src: Path, dst: Path) -> bool:
+    """Try a copy-on-write clone of ``src`` into ``dst`` (btrfs/xfs on Linux)."""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        import fcntl
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except Exception:
+        try:
+            dst.unlink()
+        except OSError:
+            pass
+        return False
+
+def _make_readonly(path: Path):
+    """Drop the write bits of ``path`` (shared by all its hardlinks)."""
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+        os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    except OSError:
+        pass
+
+def _unlink_readonly(path: Path):
+    """Unlink ``path``; on Windows a read-only file must be made writable first."""
+    try:
+        path.unlink()
+    except PermissionError:
+        if os.name != "nt":
+            raise
+        os.chmod(path, stat.S_IWRITE)
+        path.unlink()
+
+# protegge indice e oggetti condivisi tra sync e manutenzione in background
+_ARCHIVE_LOCK = threading.RLock()
+# hash referenziati da sync in corso ma non ancora scritti nell'indice: {base: {hash: n}}
+_ARCHIVE_PINS: Dict[str, Dict[str, int]] = {}
+# contatore di scritture dell'indice per radice, per accorgersi di run aggiunte nel frattempo
+_ARCHIVE_GEN: Dict[str, int] = {}
+
+class ArchiveStore:
+    """
+    Archivio versionato deduplicato per contenuto (usato per .sync_archive e .sync_trash).
+    Struttura in ``<root>/<dirname>``:
+        objects/ab/abcdef…      una sola copia per hash di contenuto, in sola lettura
+        <run_id>/rel/path.txt   vista della sync (hardlink/reflink all'oggetto, se supportati)
+        index.json              {"objects": {hash: size},
+                                 "runs": {run_id: {"time": ts, "files": n, "bytes": n, "entries": [...]}}}
+    Ogni sync usa un solo ``run_id``; restore e retention lavorano sull'indice
+    (``files``/``bytes``/``time`` di ogni run fanno da manifest per le quote).
+    """
+    def __init__(self, root: Path, dirname: str, run_id: str = ""):
+        self.base = Path(root) / dirname
+        self.run_id = run_id
+        self.objects: Dict[str, int] = {}
+        self.runs: Dict[str, dict] = {}
+        self._added_objects: Dict[str, int] = {}
+        self._removed_objects: set = set()
+        self._removed_runs: set = set()
+        self._touched_runs: set = set()
+        self._pins: Dict[str, int] = {}
+        self._dirty = False
+        self.objects, self.runs = self._read_index()
+
+    @property
+    def index_path(self) -> Path:
+        return self.base / ARCHIVE_INDEX_NAME
+
+    def _read_index(self) -> Tuple[Dict[str, int], Dict[str, dict]]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            if isinstance(d, dict):
+                return dict(d.get("objects", {})), dict(d.get("runs", {}))
+        except Exception:
+            pass
+        return {}, {}
+
+    def _object_path(self, key: str) -> Path:
+        return self.base / ARCHIVE_OBJECTS_DIRNAME / key[:2] / key
+
+    def _link_view(self, obj: Path, view: Path) -> bool:
+        view.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(obj, view)
+            return True
+        except OSError:
+            return _reflink(obj, view)
+
+    def _pin(self, key: str):
+        pins = _ARCHIVE_PINS.setdefault(str(self.base), {})
+        pins[key] = pins.get(key, 0) + 1
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def _unpin_all(self):
+        pins = _ARCHIVE_PINS.get(str(self.base), {})
+        for key, n in self._pins.items():
+            left = pins.get(key, 0) - n
+            if left > 0:
+                pins[key] = left
+            else:
+                pins.pop(key, None)
+        self._pins = {}
+
+    def put(self, src: Path, rel: str, file_hash: str = "", scanned: Optional[Tuple[int, float]] = None) -> bool:
+        """
+        Move ``src`` into the store as version ``rel`` of the current run.
+        ``file_hash`` is trusted only if ``src`` still has the ``scanned`` (size, mtime).
+        """
+        st = src.stat()
+        if file_hash and (scanned is None or (st.st_size, st.st_mtime) != tuple(scanned)):
+            file_hash = ""  # modificato dopo la scansione: l'hash non descrive più il contenuto
+        key = file_hash or file_digest(src)
+        view = self.base / self.run_id / rel
+        with _ARCHIVE_LOCK:
+            if key:
+                obj = self._object_path(key)
+                if key in self.objects and obj.exists():
+                    src.unlink()  # contenuto già archiviato: nessuna copia in più
+                else:
+                    obj.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.move(str(src), str(obj))
+                    # le viste hardlink condividono i dati: modificarne una cambierebbe ogni run
+                    _make_readonly(obj)
+                    self.objects[key] = st.st_size
+                    self._added_objects[key] = st.st_size
+                self._pin(key)
+                has_view = view.exists() or self._link_view(obj, view)
+            else:
+                # hash non disponibile: sposta direttamente nella vista della run
+                view.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(src), str(view))
+                has_view = True
+            run = self.runs.setdefault(self.run_id, {"time": time.time(), "files": 0, "bytes": 0, "entries": []})
+            run["entries"].append({"rel": rel, "hash": key, "size": st.st_size, "mtime": st.st_mtime, "view": has_view})
+            run["files"] = len(run["entries"])
+            run["bytes"] = run.get("bytes", 0) + st.st_size
+            self._dirty = True
+        return has_view
+
+    def flush(self):
+        """Write the index, merging with what other syncs stored in the meantime."""
+        if not self._dirty:
+            return
+        with _ARCHIVE_LOCK:
+            objects, runs = self._read_index()
+            for rid in self._removed_runs:
+                runs.pop(rid, None)
+            for key in self._removed_objects:
+                objects.pop(key, None)
+            objects.update(self._added_objects)
+            for rid in self._touched_runs | {self.run_id}:
+                if rid in self.runs:
+                    runs[rid] = self.runs[rid]
+            payload = json.dumps({"version": 1, "objects": objects, "runs": runs}, ensure_ascii=False)
+            try:
+                self.base.mkdir(parents=True, exist_ok=True)
+                atomic_write_bytes(self.index_path, payload.encode("utf-8"))
+            except Exception:
+                return
+            self.objects, self.runs = objects, runs
+            self._added_objects, self._removed_objects = {}, set()
+            self._removed_runs, self._touched_runs = set(), set()
+            _ARCHIVE_GEN[str(self.base)] = _ARCHIVE_GEN.get(str(self.base), 0) + 1
+            self._dirty = False
+            self._unpin_all()
+
+    def versions(self, rel: str) -> List[Tuple[str, dict]]:
+        """Return ``(run_id, entry)`` pairs for ``rel``, newest first."""
+        out = []
+        for run_id, run in self.runs.items():
+            for e in run.get("entries", []):
+                if e.get("rel") == rel:
+                    out.append((run_id, e))
+        out.sort(key=lambda x: x[0], reverse=True)
+        return out
+
+    def restore(self, rel: str, dest: Path, run_id: Optional[str] = None) -> bool:
+        """Copy a stored version of ``rel`` to ``dest`` (latest one if ``run_id`` is None)."""
+        for rid, e in self.versions(rel):
+            if run_id and rid != run_id:
+                continue
+            src = self._object_path(e["hash"]) if e.get("hash") else self.base / rid / rel
+            if not src.exists():
+                continue
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(str(src), str(dest))
+            os.chmod(dest, stat.S_IMODE(os.stat(dest).st_mode) | stat.S_IWUSR)  # l'oggetto è in sola lettura
+            if e.get("mtime"):
+                os.utime(dest, (e["mtime"], e["mtime"]))
+            return True
+        return False
+
+    def disk_usage(self) -> int:
+        """Physical bytes held by the store (deduplicated objects + unhashed entries)."""
+        raw = sum(e.get("size", 0) for run in self.runs.values()
+                  for e in run.get("entries", []) if not e.get("hash"))
+        return sum(self.objects.values()) + raw
+
+    def select_expired(self, cutoff: float = 0.0, max_bytes: int = 0) -> List[str]:
+        """Return run ids to purge: older than ``cutoff``, then oldest first until under ``max_bytes``."""
+        ordered = sorted(self.runs.items(), key=lambda kv: kv[1].get("time", 0))
+        expired = [rid for rid, run in ordered if cutoff and run.get("time", 0) < cutoff]
+        if max_bytes <= 0:
+            return expired
+        refs: Dict[str, int] = {}
+        for run in self.runs.values():
+            for e in run.get("entries", []):
+                if e.get("hash"):
+                    refs[e["hash"]] = refs.get(e["hash"], 0) + 1
+        usage = self.disk_usage()
+        chosen: List[str] = []
+        for rid, run in ordered:
+            if rid == self.run_id:
+                continue
+            if rid not in expired and usage <= max_bytes:
+                break
+            chosen.append(rid)
+            for e in run.get("entries", []):
+                key = e.get("hash")
+                if not key:
+                    usage -= e.get("size", 0)
+                    continue
+                refs[key] -= 1
+                if refs[key] == 0:
+                    usage -= self.objects.get(key, 0)
+        return chosen
+
+    @staticmethod
+    def _used_hashes(runs: Dict[str, dict]) -> set:
+        return {e.get("hash") for run in runs.values() for e in run.get("entries", []) if e.get("hash")}
+
+    def purge_runs(self, run_ids: List[str], throttle=None) -> int:
+        """Delete the given runs using the index, then drop unreferenced objects.
+
+        ``throttle`` is called before every unlink and may return ``False`` to stop early.
+        Returns the number of files removed.
+        """
+        removed = 0
+        dirs: set = set()
+
+        def _unlink(p: Path) -> bool:
+            nonlocal removed
+            if throttle and throttle() is False:
+                return False
+            try:
+                _unlink_readonly(p)
+                removed += 1
+            except OSError:
+                pass
+            dirs.add(p.parent)
+            return True
+
+        stopped = False
+        for run_id in run_ids:
+            run = self.runs.get(run_id)
+            if not run:
+                continue
+            entries = run.get("entries", [])
+            while entries:
+                e = entries[-1]
+                if e.get("view") or not e.get("hash"):
+                    if not _unlink(self.base / run_id / e["rel"]):
+                        stopped = True
+                        break
+                    if os.name == "nt" and e.get("hash"):
+                        # su Windows l'attributo è condiviso con la vista appena resa scrivibile
+                        _make_readonly(self._object_path(e["hash"]))
+                entries.pop()
+                run["files"] = len(entries)
+                run["bytes"] = max(0, run.get("bytes", 0) - e.get("size", 0))
+                self._touched_runs.add(run_id)
+                self._dirty = True
+            if stopped:
+                break
+            del self.runs[run_id]
+            self._removed_runs.add(run_id)
+            dirs.add(self.base / run_id)
+            self._dirty = True
+        if not stopped:
+            used = self._used_hashes(self.runs)
+            gen = _ARCHIVE_GEN.get(str(self.base), 0)
+            for key in [k for k in self.objects if k not in used]:
+                if throttle and throttle() is False:
+                    break
+                with _ARCHIVE_LOCK:
+                    if _ARCHIVE_GEN.get(str(self.base), 0) != gen:
+                        # l'indice è cambiato (una sync ha scritto nuove run): ricalcola i riferimenti
+                        gen = _ARCHIVE_GEN.get(str(self.base), 0)
+                        _, disk_runs = self._read_index()
+                        for rid in self._removed_runs:
+                            disk_runs.pop(rid, None)
+                        used = self._used_hashes(self.runs) | self._used_hashes(disk_runs)
+                    # una sync in corso può aver appena deduplicato su questo oggetto
+                    if key in used or key in _ARCHIVE_PINS.get(str(self.base), {}):
+                        continue
+                    obj = self._object_path(key)
+                    try:
+                        _unlink_readonly(obj)
+                        removed += 1
+                    except OSError:
+                        pass
+                    dirs.add(obj.parent)
+                    del self.objects[key]
+                    self._removed_objects.add(key)
+                    self._dirty = True
+        # rimuove le cartelle rimaste vuote (solo quelle toccate, niente rmtree)
+        for d in sorted(dirs, key=lambda p: len(p.parts), reverse=True):
+            while d != self.base and self.base in d.parents:
+                try:
+                    d.rmdir()
+                except OSError:
+                    break
+                d = d.parent
+        self.flush()
+        return removed
+
+class RetentionWorker:
+    """
+    Manutenzione di .sync_archive/.sync_trash in un thread separato, fuori dal percorso
+    critico della sync. Applica la retention in giorni e la quota in byte leggendo il
+    manifest dell'indice, ed elimina al massimo ``retention_rate`` file al secondo.
+    """
+    def __init__(self, log_cb):
+        self.log = log_cb
+        self.jobs: "queue.Queue[Tuple[str, dict]]" = queue.Queue()
+        self.stop = threading.Event()
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        self.stop.set()
+
+    def schedule(self, roots: List[str], settings: dict):
+        """Queue ``roots`` for cleanup with a snapshot of the retention ``settings``."""
+        with self._lock:
+            for root in roots:
+                if root in self._pending:
+                    continue
+                self._pending.add(root)
+                self.jobs.put((root, dict(settings)))
+
+    def _loop(self):
+        while not self.stop.is_set():
+            try:
+                root, settings = self.jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._pending.discard(root)
+            for dirname in (ARCHIVE_DIRNAME, TRASH_DIRNAME):
+                if self.stop.is_set():
+                    break
+                try:
+                    self.clean(Path(root), dirname, settings)
+                except Exception as e:
+                    self.log(f"⚠️  Pulizia {Path(root) / dirname} fallita: {e}")
+
+    def _throttle_cb(self, rate: float):
+        delay = 1.0 / rate if rate > 0 else 0.0
+        def _throttle() -> bool:
+            if delay:
+                return not self.stop.wait(delay)
+            return not self.stop.is_set()
+        return _throttle
+
+    def clean(self, root: Path, dirname: str, settings: dict) -> int:
+        days = int(settings.get("retention_days", 30))
+        max_bytes = int(settings.get("retention_max_mb", 0)) * 1024 * 1024
+        throttle = self._throttle_cb(float(settings.get("retention_rate", 200)))
+        base = root / dirname
+        if (days <= 0 and max_bytes <= 0) or not base.exists():
+            return 0
+        cutoff = (datetime.now() - timedelta(days=days)).timestamp() if days > 0 else 0.0
+        store = ArchiveStore(root, dirname)
+        expired = store.select_expired(cutoff, max_bytes)
+        removed = store.purge_runs(expired, throttle) if expired else 0
+        if cutoff:
+            removed += self._clean_legacy(store, cutoff, throttle)
+        if removed:
+            self.log(f"🧹 {base}: rimossi {removed} file (retention), occupazione {human_bytes(store.disk_usage())}")
+        return removed
+
+    def _clean_legacy(self, store: ArchiveStore, cutoff: float, throttle) -> int:
+        # cartelle "YYYYmmdd_HHMMSS" create prima dell'indice
+        removed = 0
+        for sub in store.base.iterdir():
+            if sub.name in store.runs or sub.name == ARCHIVE_OBJECTS_DIRNAME or not sub.is_dir():
+                continue
+            try:
+                m = re.match(r"(\d{8})_(\d{6})", sub.name)
+                if m:
+                    dt = datetime.strptime(m.group(1)+"_"+m.group(2), "%Y%m%d_%H%M%S")
+                else:
+                    dt = datetime.fromtimestamp(sub.stat().st_mtime)
+                if dt.timestamp() >= cutoff:
+                    continue
+                for base, dirs, files in os.walk(sub, topdown=False):
+                    for name in files:
+                        if not throttle():
+                            return removed
+                        try:
+                            os.unlink(os.path.join(base, name))
+                            removed += 1
+                        except OSError:
+                            pass
+                    try:
+                        os.rmdir(base)
+                    except OSError:
+                        pass
+            except Exception:
+                pass
+        return removed
+
+class ExistenceIndex:
+    """
+    Indice in memoria di file e cartelle presenti nelle radici in sincronizzazione.
+    Nasce dalle mappe di scansione e viene aggiornato dalle azioni eseguite, così
+    l'esecuzione evita exists()/mkdir() ridondanti (su SMB ognuno è un round trip).
+    Per percorsi fuori dalle radici registrate ``exists`` restituisce None.
+    """
+    def __init__(self):
+        self._roots: Dict[str, str] = {}   # radice -> prefisso "radice/"
+        self._files: set = set()
+        self._dirs: set = set()
+        self._lock = threading.Lock()
+
+    def add_root(self, root: Path, mapping: Dict[str, dict]):
+        root_s = str(root)
+        with self._lock:
+            self._roots[root_s] = os.path.join(root_s, "")
+            self._dirs.add(root_s)
+            for rel in mapping:
+                p = root / rel
+                self._files.add(str(p))
+                self._add_dirs(p.parent)
+
+    def drop_root(self, root: Path):
+        root_s = str(root)
+        with self._lock:
+            prefix = self._roots.pop(root_s, None)
+            if prefix is None:
+                return
+            self._files = {f for f in self._files if not f.startswith(prefix)}
+            self._dirs = {d for d in self._dirs if d != root_s and not d.startswith(prefix)}
+
+    def _covered(self, s: str) -> bool:
+        return any(s == r or s.startswith(prefix) for r, prefix in self._roots.items())
+
+    def _add_dirs(self, d: Path):
+        # risale finché trova una cartella già nota
+        while str(d) not in self._dirs:
+            self._dirs.add(str(d))
+            if d.parent == d:
+                break
+            d = d.parent
+
+    def exists(self, path: Path) -> Optional[bool]:
+        s = str(path)
+        with self._lock:
+            if not self._covered(s):
+                return None
+            return s in self._files
+
+    def has_dir(self, path: Path) -> bool:
+        with self._lock:
+            return str(path) in self._dirs
+
+    def added(self, path: Path):
+        with self._lock:
+            self._files.add(str(path))
+            self._add_dirs(path.parent)
+
+    def removed(self, path: Path):
+        with self._lock:
+            self._files.discard(str(path))
+
+    def dir_created(self, path: Path):
+        with self._lock:
+            self._add_dirs(path)
+
+class PlanJournal:
+    """
+    Append-only journal of the plan a pair is executing, kept in the left root
+    (``.bisync_journal_<id>.jsonl``): a header with the plan and the scanned state of
+    every path it touches, then one ``{"done": i}`` line per completed action.
+    Deleted when the plan completes; a stop, a crash or a closed app leave it behind
+    and the next run resumes the pending actions instead of rescanning.
+    """
+    def __init__(self, pair: Pair):
+        self.pair = pair
+        self.path = Path(pair.left) / f"{JOURNAL_PREFIX}{pair.id_hash()}.jsonl"
+        self._positions: Dict[int, int] = {}  # id(item) -> indice nel piano del journal
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _config(self) -> str:
+        return json.dumps(asdict(self.pair), sort_keys=True)
+
+    @staticmethod
+    def _state(mapping: Optional[Dict[str, dict]], rel: str) -> Optional[list]:
+        info = (mapping or {}).get(rel)
+        return [info["size"], info["mtime"], info.get("hash", "")] if info else None
+
+    def start(self, plan: List[tuple], mapA: Optional[Dict[str, dict]], mapB: Optional[Dict[str, dict]],
+              durability: str = "batch"):
+        state: Dict[str, list] = {}
+        for item in plan:
+            for rel in (item[4], item[5].get("from")):
+                if rel and rel not in state:
+                    state[rel] = [self._state(mapA, rel), self._state(mapB, rel)]
+        header = {
+            "config": self._config(),
+            "plan": [[action, str(src) if src else None, str(dst) if dst else None, size, rel, extra]
+                     for action, src, dst, size, rel, extra in plan],
+            "state": state,
+        }
+        payload = (json.dumps(header, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+        atomic_write_bytes(self.path, payload, durability)
+        self._positions = {id(item): i for i, item in enumerate(plan)}
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def load(self) -> Optional[Tuple[List[tuple], Dict[str, dict], Dict[str, dict]]]:
+        """Pending actions plus the recorded state as partial maps; None without a usable journal."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                done = set()
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["done"])
+                    except (ValueError, KeyError):
+                        break  # ultima riga troncata da un crash
+        except (OSError, ValueError):
+            return None
+        if not isinstance(header, dict) or header.get("config") != self._config():
+            return None
+        pending = []
+        for i, (action, src, dst, size, rel, extra) in enumerate(header.get("plan", [])):
+            if i in done:
+                continue
+            item = (action, Path(src) if src else None, Path(dst) if dst else None, size, rel, extra)
+            self._positions[id(item)] = i
+            pending.append(item)
+        maps: Tuple[Dict[str, dict], Dict[str, dict]] = ({}, {})
+        for rel, sides in header.get("state", {}).items():
+            for mapping, root, st in zip(maps, (self.pair.left, self.pair.right), sides):
+                if st:
+                    mapping[rel] = {"abs": os.path.join(root, *rel.split("/")), "size": st[0], "mtime": st[1], "hash": st[2]}
+        return pending, maps[0], maps[1]
+
+    def reopen(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def done(self, item: tuple):
+        i = self._positions.get(id(item))
+        if i is None:
+            return
+        with self._lock:
+            if self._file is not None:
+                # niente fsync: una riga persa fa solo riverificare (e scartare) un'azione già fatta
+                self._file.write(f'{{"done": {i}}}\n')
+                self._file.flush()
+
+    def close(self, finished: bool):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if finished:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+
+class PlanCache:
+    """
+    Ultimo piano (e scansioni) calcolato per ogni coppia, ad es. dall'anteprima.
+    Una sync avviata poco dopo può riusarlo se l'impronta della coppia non è cambiata:
+    configurazione, mtime delle due radici e versione dello snapshot; anche le
+    sottocartelle scansionate devono avere ancora lo stesso mtime. Le voci scadono
+    dopo ``ttl`` secondi e vengono consumate al primo uso.
+    """
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(pair: Pair) -> tuple:
+        parts: list = [json.dumps(asdict(pair), sort_keys=True)]
+        for p in [Path(pair.left), Path(pair.right)] + Snapshot(pair)._paths():
+            try:
+                st = p.stat()
+                parts.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                parts.append(None)
+        return tuple(parts)
+
+    @staticmethod
+    def _dirs_unchanged(dirs: Dict[str, Dict[str, float]]) -> bool:
+        # file creati, eliminati o rinominati cambiano l'mtime della loro cartella
+        for root, mtimes in dirs.items():
+            for rel_dir, mtime in mtimes.items():
+                if not rel_dir:
+                    continue  # la radice è nell'impronta (presa dopo la cache hash)
+                try:
+                    if os.stat(os.path.join(root, *rel_dir.split("/"))).st_mtime != mtime:
+                        return False
+                except OSError:
+                    return False
+        return True
+
+    def store(self, pair: Pair, plan: List[tuple], mapA: Dict[str, dict], mapB: Dict[str, dict],
+              dirs: Optional[Dict[str, Dict[str, float]]] = None):
+        """Cache ``plan``; ``dirs`` are the scanned ``{root: {rel_dir: mtime}}`` checked on reuse."""
+        entry = {"time": time.time(), "fp": self.fingerprint(pair), "plan": plan, "mapA": mapA, "mapB": mapB,
+                 "dirs": dirs or {}}
+        with self._lock:
+            self._entries[pair.id_hash()] = entry
+
+    def invalidate(self, pair: Optional[Pair] = None):
+        with self._lock:
+            if pair is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(pair.id_hash(), None)
+
+    def take(self, pair: Pair) -> Optional[Tuple[List[tuple], Dict[str, dict], Dict[str, dict]]]:
+        """Pop the cached plan for ``pair`` if it is still fresh and its fingerprint matches."""
+        with self._lock:
+            entry = self._entries.pop(pair.id_hash(), None)
+        if not entry or time.time() - entry["time"] > self.ttl:
+            return None
+        if entry["fp"] != self.fingerprint(pair) or not self._dirs_unchanged(entry["dirs"]):
+            return None
+        return entry["plan"], entry["mapA"], entry["mapB"]
+
 class SyncEngine:
-    def __init__(self, pairs: List[Pair], log_cb, progress_cb, status_cb, stop_event, pause_event, settings):
+    def __init__(self, pairs: List[Pair], log_cb, progress_cb, status_cb, stop_event, pause_event, settings,
+                 plan_cache: Optional[PlanCache] = None):
         self.pairs = [p.normalized() for p in pairs]
         self.log = log_cb
         self.progress = progress_cb
@@ -165,6 +1928,32 @@ class SyncEngine:
         self.bytes_total = 0
         self.bytes_done = 0
         self._t0 = time.time()
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._stores: Dict[Tuple[str, str], ArchiveStore] = {}
+        self._stores_lock = threading.Lock()
+        self._scanned: Dict[str, Tuple[int, float]] = {}  # file da archiviare/eliminare -> (size, mtime) della scansione
+        self.durability = settings.get("durability", "batch")
+        self.durable = DurableWriter(self.durability)
+        self.plan_cache = plan_cache
+        self._index = ExistenceIndex()
+        self._dir_mtimes: Dict[str, Dict[str, float]] = {}   # radice -> {dir rel: mtime} dell'ultima scansione
+        self._snapshots: Dict[str, Snapshot] = {}            # snapshot usato per pianificare, per coppia
+        self._digest_memo: Dict[int, Tuple[dict, Dict[str, str]]] = {}
+        self.verify = settings.get("verify", "off")
+        self._verified: Dict[str, Tuple[int, float, str]] = {}  # destinazione -> (size, mtime, digest) verificato
+        self._io_modes: Dict[str, str] = {}   # radice -> politica page cache della sua coppia
+        self._journals: Dict[str, PlanJournal] = {}  # coppia -> journal del piano in esecuzione
+        self.deadline: Optional[float] = None          # da time_budget, fissata a inizio run
+        self._deadlines: Dict[str, Optional[float]] = {}
+        self._deferred: Dict[str, List[tuple]] = {}    # coppia -> azioni rimandate per tempo esaurito
+        self._measured = [0, 0.0]                      # byte copiati, secondi spesi a copiarli
+        self._measured_lock = threading.Lock()
+        self.pair_stats: Dict[str, Tuple[int, float]] = {}  # coppia -> (azioni, secondi) delle sync completate
+        # radice montata -> agent che la serve (scansioni, hash e dati lato server)
+        self._agents = [AgentClient(mount, address, settings.get("agent_token", ""))
+                        for mount, address in (settings.get("agents") or {}).items()]
+        self.groups: List[SyncGroup] = [p for p in self.pairs if isinstance(p, SyncGroup)]
+        self.pairs = [p for p in self.pairs if not isinstance(p, SyncGroup)]
 
     def _matches_filters(self, rel: str, includes: List[str], excludes: List[str]) -> bool:
         # include: se presente e nessuno match -> escludi
@@ -178,12 +1967,29 @@ class SyncEngine:
         # esclude sempre i nostri metadata
         base = rel.lower()
         if base.endswith(".json") and base.startswith(STATE_PREFIX): return False
+        if base.startswith(JOURNAL_PREFIX): return False
+        if base.endswith(TMP_SUFFIX): return False
+        if base == HASH_CACHE_NAME: return False
+        if base == VOLUME_ID_NAME: return False
         if ARCHIVE_DIRNAME in rel.split("/") or TRASH_DIRNAME in rel.split("/"):
             return False
         return True
 
-    def _rel_map(self, root: Path, includes: List[str], excludes: List[str]) -> Dict[str, dict]:
+    def _rel_map(self, root: Path, includes: List[str], excludes: List[str],
+                 reuse: Optional[Tuple[Dict[str, float], Dict[str, dict]]] = None) -> Dict[str, dict]:
+        """
+        Scan ``root``. With ``reuse`` = (dir mtimes, file entries) from the snapshot,
+        files in a directory whose mtime has not moved are taken from the snapshot
+        without stat/hash (see ``trust_dir_mtime``).
+        """
+        agent = self._agent_for(root)
+        if agent is not None:
+            result = self._agent_rel_map(agent, root, includes, excludes, reuse)
+            if result is not None:
+                return result
         result: Dict[str, dict] = {}
+        dir_mtimes: Dict[str, float] = {}
+        prev_dirs, prev_files = reuse or ({}, {})
         for base, dirs, files in os.walk(root):
             if self.stop.is_set():
                 break
@@ -191,140 +1997,388 @@ class SyncEngine:
             parts = Path(base).parts
             if ARCHIVE_DIRNAME in parts or TRASH_DIRNAME in parts:
                 continue
+            rel_dir = Path(base).relative_to(root).as_posix()
+            rel_dir = "" if rel_dir == "." else rel_dir
+            try:
+                dir_mtimes[rel_dir] = os.stat(base).st_mtime
+            except OSError:
+                pass
+            trusted = rel_dir in dir_mtimes and prev_dirs.get(rel_dir) == dir_mtimes[rel_dir]
             for name in files:
-                p = Path(base) / name
                 try:
-                    if p.is_symlink():
-                        continue
-                    rel = p.relative_to(root).as_posix()
+                    rel = posixpath.join(rel_dir, name) if rel_dir else name
                     if not self._matches_filters(rel, includes, excludes):
                         continue
+                    prev = prev_files.get(rel) if trusted else None
+                    if prev is not None:
+                        result[rel] = {"abs": os.path.join(base, name), "mtime": prev["mtime"],
+                                       "size": prev["size"], "hash": prev["hash"]}
+                        continue
+                    p = Path(base) / name
+                    if p.is_symlink():
+                        continue
                     st = p.stat()
-                    file_hash = self._file_hash(p)
                     result[rel] = {
                         "abs": str(p),
                         "mtime": st.st_mtime,
                         "size": st.st_size,
-                        "hash": file_hash,
+                        "hash": "",
                     }
                 except Exception:
                     continue
+        if not self.stop.is_set():
+            self._dir_mtimes[str(root)] = dir_mtimes
+        self._fill_hashes(root, result, includes, excludes)
         return result
 
-    def _file_hash(self, path: Path) -> str:
-        h = hashlib.md5()
+    def _agent_for(self, path) -> Optional[AgentClient]:
+        for client in self._agents:
+            if not client.failed and client.covers(path):
+                return client
+        return None
+
+    def _close_agents(self):
+        for client in self._agents:
+            client.close()
+
+    def _agent_down(self, client: AgentClient, err: Exception):
+        client.failed = True
+        self.log(f"⚠️  Agent {client.address} non raggiungibile ({err}): uso il percorso locale {client.mount}")
+
+    def _agent_rel_map(self, client: AgentClient, root: Path, includes: List[str], excludes: List[str],
+                       reuse: Optional[Tuple[Dict[str, float], Dict[str, dict]]] = None) -> Optional[Dict[str, dict]]:
+        """``_rel_map`` through the agent: one streamed scan instead of a stat per file.
+        Returns None if the agent is unreachable (the caller scans the mount)."""
+        result: Dict[str, dict] = {}
+        dir_mtimes: Dict[str, float] = {}
+        prev_dirs, prev_files = reuse or ({}, {})
         try:
-            with open(path, "rb") as f:
-                for chunk in iter(lambda: f.read(8192), b""):
-                    h.update(chunk)
-        except Exception:
-            return ""
-        return h.hexdigest()
+            for rel_dir, dir_mtime, files in client.scan(client.remote(root), [ARCHIVE_DIRNAME, TRASH_DIRNAME]):
+                if self.stop.is_set():
+                    break
+                dir_mtimes[rel_dir] = dir_mtime
+                trusted = prev_dirs.get(rel_dir) == dir_mtime
+                base = os.path.join(str(root), *rel_dir.split("/")) if rel_dir else str(root)
+                for name, size, mtime in files:
+                    rel = posixpath.join(rel_dir, name) if rel_dir else name
+                    if not self._matches_filters(rel, includes, excludes):
+                        continue
+                    prev = prev_files.get(rel) if trusted else None
+                    same = prev is not None and prev["size"] == size and prev["mtime"] == mtime
+                    result[rel] = {"abs": os.path.join(base, name), "mtime": mtime, "size": size,
+                                   "hash": prev["hash"] if same else ""}
+        except OSError as e:
+            self._agent_down(client, e)
+            return None
+        if not self.stop.is_set():
+            self._dir_mtimes[str(root)] = dir_mtimes
+        self._fill_hashes(root, result, includes, excludes)
+        return result
+
+    def _agent_hash_many(self, client: AgentClient, items: List[Tuple[str, str, int]], io_mode: str):
+        try:
+            for i, h in client.hash_many([client.remote(abs_path) for _, abs_path, _ in items], io_mode):
+                if self.stop.is_set():
+                    return
+                yield items[i][0], h
+        except OSError as e:
+            self._agent_down(client, e)
+            # i file non ancora ricevuti si rileggono dal mount
+            yield from self._hash_many(items, io_mode)
+
+    def _fill_hashes(self, root: Path, result: Dict[str, dict], includes: List[str], excludes: List[str]):
+        # hash dalla cache per i file invariati, gli altri in parallelo
+        verify_all = bool(self.settings.get("verify_all", False))
+        cache = HashCache(root)
+        todo = []
+        for rel, info in result.items():
+            if info["hash"] and not verify_all:
+                continue  # preso dallo snapshot (directory invariata)
+            known = self._verified.pop(os.path.normpath(info["abs"]), None) if self._verified else None
+            if known is not None and known[:2] == (info["size"], info["mtime"]):
+                # appena copiato e verificato: niente seconda lettura
+                info["hash"] = known[2]
+                cache.put(rel, info["size"], info["mtime"], known[2])
+                continue
+            h = "" if verify_all else cache.get(rel, info["size"], info["mtime"])
+            if h:
+                info["hash"] = h
+            else:
+                todo.append((rel, info["abs"], info["size"]))
+        for rel, h in self._hash_many(todo, self._io_mode(root)):
+            info = result[rel]
+            info["hash"] = h
+            cache.put(rel, info["size"], info["mtime"], h)
+        if self.stop.is_set():
+            return
+        cache.prune(lambda r: r not in result and self._matches_filters(r, includes, excludes))
+        cache.save(self.durability)
+
+    def _hash_many(self, items: List[Tuple[str, str, int]], io_mode: str = "cached"):
+        """Yield ``(rel, hash)`` for ``items`` = ``[(rel, abs, size)]``, as results arrive.
+
+        Small files are batched per process-pool task to amortise IPC; large ones
+        go to threads (hashlib releases the GIL on big buffers).
+        """
+        agent = self._agent_for(items[0][1]) if items else None
+        if agent is not None:
+            yield from self._agent_hash_many(agent, items, io_mode)
+            return
+        workers = int(self.settings.get("hash_workers", 0)) or (os.cpu_count() or 1)
+        total = sum(size for _, _, size in items)
+        if workers <= 1 or (len(items) < HASH_POOL_MIN_FILES and total < HASH_POOL_MIN_BYTES):
+            for rel, abs_path, _ in items:
+                if self.stop.is_set():
+                    return
+                yield rel, self._file_hash(Path(abs_path), io_mode)
+            return
+        abs_of = {rel: abs_path for rel, abs_path, _ in items}
+        futures: Dict[object, List[str]] = {}
+        threads = ThreadPoolExecutor(max_workers=min(4, workers))
+        try:
+            pool = _hash_pool(workers)
+            batch: List[Tuple[str, str]] = []
+            batch_bytes = 0
+            for rel, abs_path, size in items:
+                if size >= HASH_LARGE_FILE:
+                    futures[threads.submit(file_digest, Path(abs_path), io_mode)] = [rel]
+                    continue
+                batch.append((rel, abs_path))
+                batch_bytes += size
+                if len(batch) >= HASH_BATCH_FILES or batch_bytes >= HASH_BATCH_BYTES:
+                    futures[pool.submit(_hash_batch, [a for _, a in batch], io_mode)] = [r for r, _ in batch]
+                    batch, batch_bytes = [], 0
+            if batch:
+                futures[pool.submit(_hash_batch, [a for _, a in batch], io_mode)] = [r for r, _ in batch]
+            for fut in as_completed(futures):
+                if self.stop.is_set():
+                    break
+                rels = futures.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception:
+                    # pool non disponibile/rotto: ripiega sull'hash locale
+                    res = [self._file_hash(Path(abs_of[r]), io_mode) for r in rels]
+                if isinstance(res, str):
+                    res = [res]
+                for rel, h in zip(rels, res):
+                    yield rel, h
+        finally:
+            for fut in futures:
+                fut.cancel()
+            threads.shutdown(wait=False, cancel_futures=True)
+
+    def _file_hash(self, path: Path, io_mode: str = "cached") -> str:
+        agent = self._agent_for(path)
+        if agent is not None:
+            try:
+                return dict(agent.hash_many([agent.remote(path)], io_mode)).get(0, "")
+            except OSError:
+                pass
+        return file_digest(path, io_mode)
+
+    def _reread_digest(self, path: Path) -> str:
+        agent = self._agent_for(path)
+        if agent is not None:
+            try:
+                return dict(agent.hash_many([agent.remote(path)], "reread")).get(0, "")
+            except OSError:
+                pass
+        return reread_digest(path)
+
+    def _agent_copy(self, src: Path, dsts: List[Path], digest: bool, io_mode: str) -> str:
+        """
+        ``copy_file_multi`` when the source or a destination is served by an agent:
+        reads and writes are pipelined (``AGENT_WINDOW`` requests in flight) instead
+        of one round trip per block. No sparse/preallocation handling on this path.
+        """
+        h = hashlib.md5() if digest else None
+        st = os.stat(src)
+        src_agent = self._agent_for(src)
+        with contextlib.ExitStack() as stack:
+            if src_agent is not None:
+                chunks = stack.enter_context(contextlib.closing(
+                    src_agent.read_chunks(src_agent.remote(src), st.st_size, io_mode)))
+            else:
+                chunks = stack.enter_context(SourceReader(src, io_mode)).chunks()
+            outs = []
+            for dst in dsts:
+                agent = self._agent_for(dst)
+                outs.append(stack.enter_context(agent.writer(agent.remote(dst)) if agent else open(dst, "wb")))
+            for buf in chunks:
+                for out in outs:
+                    out.write(buf)
+                if h is not None:
+                    h.update(buf)
+            for out in outs:
+                if isinstance(out, AgentWriter):
+                    out.finish(st)
+        for dst, out in zip(dsts, outs):
+            if not isinstance(out, AgentWriter):
+                shutil.copystat(str(src), str(dst))
+        return h.hexdigest() if h is not None else ""
+
+    def _register_io(self, pair: "Pair | SyncGroup"):
+        mode = pair.io_mode or self.settings.get("io_mode", "nocache")
+        for root in (pair.roots if isinstance(pair, SyncGroup) else (pair.left, pair.right)):
+            self._io_modes[str(Path(root))] = mode if mode in IO_MODES else "nocache"
+
+    def _io_mode(self, root: Path) -> str:
+        return self._io_modes.get(str(Path(root)), "cached")
+
+    def _store(self, pair_root: Path, dirname: str) -> ArchiveStore:
+        # un solo ArchiveStore (e una sola cartella <run_id>) per radice durante la sync
+        key = (str(pair_root), dirname)
+        with self._stores_lock:
+            store = self._stores.get(key)
+            if store is None:
+                store = self._stores[key] = ArchiveStore(pair_root, dirname, self.run_id)
+        return store
 
-    def _archive_existing(self, pair_root: Path, dst_rel: str):
+    def _flush_stores(self):
+        for store in self._stores.values():
+            store.flush()
+
+    def _exists(self, path: Path) -> bool:
+        known = self._index.exists(path)
+        return path.exists() if known is None else known
+
+    def _ensure_dir(self, path: Path):
+        if not self._index.has_dir(path):
+            path.mkdir(parents=True, exist_ok=True)
+            self._index.dir_created(path)
+
+    def _scanned_stat(self, path: Path) -> Optional[Tuple[int, float]]:
+        with self._stores_lock:
+            return self._scanned.pop(os.path.normpath(str(path)), None)
+
+    def _archive_existing(self, pair_root: Path, dst_rel: str, file_hash: str = ""):
         dst = pair_root / dst_rel
-        if not dst.exists(): 
+        if not self._exists(dst):
             return
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        archive_root = pair_root / ARCHIVE_DIRNAME / ts
-        archive_path = archive_root / dst_rel
-        archive_path.parent.mkdir(parents=True, exist_ok=True)
         try:
-            shutil.move(str(dst), str(archive_path))
+            self._store(pair_root, ARCHIVE_DIRNAME).put(dst, dst_rel, file_hash, self._scanned_stat(dst))
+            self._index.removed(dst)
+        except FileNotFoundError:
+            self._index.removed(dst)
         except Exception as e:
             self.log(f"⚠️  Impossibile archiviare {dst}: {e}")
 
-    def _to_trash(self, pair_root: Path, rel: str, use_trash: bool):
+    def _to_trash(self, pair_root: Path, rel: str, use_trash: bool, file_hash: str = ""):
         target = pair_root / rel
-        if not target.exists():
+        if not self._exists(target):
             return
         if use_trash:
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            trash_root = pair_root / TRASH_DIRNAME / ts
-            trash_path = trash_root / rel
-            trash_path.parent.mkdir(parents=True, exist_ok=True)
             try:
-                shutil.move(str(target), str(trash_path))
+                self._store(pair_root, TRASH_DIRNAME).put(target, rel, file_hash, self._scanned_stat(target))
+                self._index.removed(target)
+                self.durable.note_dirs(target.parent)
+                return
+            except FileNotFoundError:
+                self._index.removed(target)
                 return
             except Exception as e:
                 self.log(f"⚠️  Spostamento nel cestino fallito {target}: {e}; provo cancellazione.")
         try:
             target.unlink()
+            self._index.removed(target)
+            self.durable.note_dirs(target.parent)
+        except FileNotFoundError:
+            self._index.removed(target)
         except Exception as e:
-            self.log(f"❌ Eliminazione fallita {target}: {e}")
-
-    def _safe_copy(self, src_abs: Path, dst_abs: Path, dst_pair_root: Path, dst_rel: str):
-        dst_abs.parent.mkdir(parents=True, exist_ok=True)
-        if dst_abs.exists():
-            self._archive_existing(dst_pair_root, dst_rel)
-        shutil.copy2(str(src_abs), str(dst_abs))
-
-    def _safe_move(self, src_abs: Path, dst_abs: Path, pair_root: Path, dst_rel: str):
-        dst_abs.parent.mkdir(parents=True, exist_ok=True)
-        if dst_abs.exists():
-            self._archive_existing(pair_root, dst_rel)
-        shutil.move(str(src_abs), str(dst_abs))
-
-    def _cleanup_retention(self, root: Path, dirname: str, days: int):
-        if days <= 0: 
-            return
-        base = root / dirname
-        if not base.exists():
-            return
-        cutoff = datetime.now() - timedelta(days=days)
-        for sub in base.iterdir():
-            try:
-                if sub.is_dir():
-                    # directory timestamp "YYYYmmdd_HHMMSS"
-                    m = re.match(r"(\d{8})_(\d{6})", sub.name)
-                    if m:
-                        dt = datetime.strptime(m.group(1)+"_"+m.group(2), "%Y%m%d_%H%M%S")
-                    else:
-                        dt = datetime.fromtimestamp(sub.stat().st_mtime)
-                    if dt < cutoff:
-                        shutil.rmtree(sub, ignore_errors=True)
-            except Exception:
-                pass
-
-    def _plan_pair(self, pair: Pair, mappingA: Dict[str, dict], mappingB: Dict[str, dict], snap: Snapshot):
-        rels = set(mappingA.keys()) | set(mappingB.keys())
-        plan = []  # list of tuples: (action, src_abs, dst_abs, size, human, info)
-
-        # rileva rinomini confrontando hash
-        onlyA = {r: mappingA[r] for r in mappingA.keys() - mappingB.keys()}
-        onlyB = {r: mappingB[r] for r in mappingB.keys() - mappingA.keys()}
-        hashA = {info["hash"]: rel for rel, info in onlyA.items() if info.get("hash")}
-        hashB = {info["hash"]: rel for rel, info in onlyB.items() if info.get("hash")}
-        handled: set = set()
-        for h in set(hashA.keys()) & set(hashB.keys()):
-            relA = hashA[h]
-            relB = hashB[h]
-            prevA = snap.data.get(relA)
-            prevB = snap.data.get(relB)
-            if prevB and not prevA:
-                # rinomina in B per allinearsi ad A
-                plan.append((
-                    "RENAME_B",
-                    Path(pair.right) / relB,
-                    Path(pair.right) / relA,
-                    0,
-                    relA,
-                    {"from": relB},
-                ))
-                handled.update({relA, relB})
-            elif prevA and not prevB:
-                # rinomina in A per allinearsi a B
-                plan.append((
-                    "RENAME_A",
-                    Path(pair.left) / relA,
-                    Path(pair.left) / relB,
-                    0,
-                    relB,
-                    {"from": relA},
-                ))
-                handled.update({relA, relB})
+            self.log(f"❌ Eliminazione fallita {target}: {e}")
+
+    def _safe_copy(self, src_abs: Path, dst_abs: Path, dst_pair_root: Path, dst_rel: str, dst_hash: str = "",
+                   preallocate: Optional[bool] = None):
+        self._safe_fanout(src_abs, [(dst_abs, dst_pair_root, dst_rel, dst_hash)], preallocate)
+
+    def _safe_fanout(self, src_abs: Path, targets: List[Tuple[Path, Path, str, str]],
+                     preallocate: Optional[bool] = None):
+        """Copy ``src_abs`` to every ``(dst_abs, dst_root, dst_rel, dst_hash)`` reading it once."""
+        for dst_abs, _, _, _ in targets:
+            self._ensure_dir(dst_abs.parent)
+        if preallocate is None:
+            preallocate = bool(self.settings.get("preallocate", True))
+        # copia su nomi temporanei: i file finali compaiono solo completi
+        tmps = [temp_path_for(dst_abs) for dst_abs, _, _, _ in targets]
+        try:
+            want = self.verify in ("trust", "reread")
+            io_mode = self._io_mode(targets[0][1])
+            if self._agents and (self._agent_for(src_abs) or any(self._agent_for(t) for t in tmps)):
+                digest = self._agent_copy(src_abs, tmps, want, io_mode)
+            else:
+                digest = copy_file_multi(src_abs, tmps, preallocate, digest=want, io_mode=io_mode,
+                                         pipeline=bool(self.settings.get("copy_pipeline", True)))
+            for tmp, (dst_abs, dst_root, dst_rel, dst_hash) in zip(tmps, targets):
+                self._commit_copy(tmp, dst_abs, dst_root, dst_rel, dst_hash, digest)
+        except BaseException:
+            for tmp in tmps:
+                try:
+                    tmp.unlink()
+                except OSError:
+                    pass
+            raise
+
+    def _commit_copy(self, tmp: Path, dst_abs: Path, dst_pair_root: Path, dst_rel: str, dst_hash: str, digest: str):
+        if self.verify == "reread" and self._reread_digest(tmp) != digest:
+            raise OSError(errno.EIO, f"verifica fallita: {dst_rel} differisce dall'originale")
+        nocache = self._io_mode(dst_pair_root) != "cached"
+        st = tmp.stat() if digest or nocache else None
+        if digest:
+            self._verified[os.path.normpath(str(dst_abs))] = (st.st_size, st.st_mtime, digest)
+        drop = nocache and st.st_size >= NOCACHE_MIN  # pagine scartate dopo l'fsync della durabilità
+        exists = self._exists(dst_abs)
+        if exists:
+            self._archive_existing(dst_pair_root, dst_rel, dst_hash)
+        # l'indice dice "non esiste": il commit non sovrascrive, così un file
+        # comparso dopo la scansione viene archiviato invece che perso
+        if not self.durable.commit(tmp, dst_abs, overwrite=exists, drop=drop):
+            self._index.added(dst_abs)
+            self._archive_existing(dst_pair_root, dst_rel)
+            self.durable.commit(tmp, dst_abs, drop=drop)
+        self._index.added(dst_abs)
+
+    def _safe_move(self, src_abs: Path, dst_abs: Path, pair_root: Path, dst_rel: str):
+        self._ensure_dir(dst_abs.parent)
+        if self._exists(dst_abs):
+            self._archive_existing(pair_root, dst_rel)
+        shutil.move(str(src_abs), str(dst_abs))
+        self._index.removed(src_abs)
+        self._index.added(dst_abs)
+        self.durable.note_dirs(src_abs.parent, dst_abs.parent)
+
+    @staticmethod
+    def _known_hash(info: dict, prev: dict, side: str) -> str:
+        # hash della scansione o, se il file non è cambiato dall'ultimo snapshot, quello memorizzato
+        if info.get("hash"):
+            return info["hash"]
+        if (prev.get(side) is not None and prev.get("size" + side) == info["size"]
+                and abs(prev[side] - info["mtime"]) <= MTIME_FUZZ):
+            return prev.get("hash" + side, "")
+        return ""
+
+    def _same_content(self, a: dict, b: dict, prev: dict) -> bool:
+        ha = self._known_hash(a, prev, "A")
+        return bool(ha) and ha == self._known_hash(b, prev, "B")
+
+    def _plan_pair(self, pair: Pair, mappingA: Dict[str, dict], mappingB: Dict[str, dict], snap: Snapshot):
+        # sottoalberi con lo stesso digest sui due lati: niente da confrontare
+        digA, digB = self._digests(mappingA), self._digests(mappingB)
+        same = {d for d, h in digA.items() if digB.get(d) == h}
+        if "" in same:
+            return []
+        plan = []  # list of tuples: (action, src_abs, dst_abs, size, human, info)
+        handled = self._plan_renames(pair, mappingA, mappingB, snap, plan)
+        planner = self.settings.get("planner", "auto")
+        if np is not None and (planner == "numpy"
+                               or (planner == "auto" and len(mappingA) + len(mappingB) >= 2 * NUMPY_PLAN_MIN)):
+            plan.extend(self._plan_paths_numpy(pair, mappingA, mappingB, snap, same, handled))
+            return plan
+        rels = mappingA.keys() | mappingB.keys()
+        if same:
+            rels = {r for r in rels if posixpath.dirname(r) not in same}
 
-        # action: "COPY_A2B", "COPY_B2A", "DELETE_A", "DELETE_B", "RENAME_A", "RENAME_B"
+        # action: "COPY_A2B", "COPY_B2A", "DELETE_A", "DELETE_B", "RENAME_A", "RENAME_B", "TOUCH_A2B", "TOUCH_B2A"
         for rel in sorted(rels):
             if rel in handled:
                 continue
@@ -345,7 +2399,7 @@ class SyncEngine:
                     unchanged_since_last = (abs(a["mtime"] - (prev.get("A") or a["mtime"])) <= MTIME_FUZZ)
                     # Se era presente in B prima e A non è cambiato da allora => B ha cancellato => elimina da A
                     if was_in_B and unchanged_since_last:
-                        plan.append(("DELETE_A", None, Path(pair.left)/rel, a["size"], rel, {}))
+                        plan.append(("DELETE_A", None, Path(pair.left)/rel, a["size"], rel, {"hash": a.get("hash", "")}))
                     else:
                         plan.append(("COPY_A2B", Path(a["abs"]), Path(pair.right)/rel, a["size"], rel, {}))
 
@@ -358,7 +2412,7 @@ class SyncEngine:
                     is_new_since_last = prev.get("B") is None
                     unchanged_since_last = (abs(b["mtime"] - (prev.get("B") or b["mtime"])) <= MTIME_FUZZ)
                     if was_in_A and unchanged_since_last:
-                        plan.append(("DELETE_B", None, Path(pair.right)/rel, b["size"], rel, {}))
+                        plan.append(("DELETE_B", None, Path(pair.right)/rel, b["size"], rel, {"hash": b.get("hash", "")}))
                     else:
                         plan.append(("COPY_B2A", Path(b["abs"]), Path(pair.left)/rel, b["size"], rel, {}))
 
@@ -368,121 +2422,1071 @@ class SyncEngine:
                 if abs(a["mtime"] - b["mtime"]) <= MTIME_FUZZ and a["size"] == b["size"]:
                     continue
                 policy = pair.conflict_policy
+                if pair.touch_identical and a["size"] == b["size"] and self._same_content(a, b, prev):
+                    # contenuto identico (touch, restore, copia senza timestamp): solo metadati
+                    if policy == "prefer_left" or (policy == "newest" and a["mtime"] > b["mtime"]):
+                        plan.append(("TOUCH_A2B", Path(a["abs"]), Path(pair.right)/rel, 0, rel, {"mtime": a["mtime"]}))
+                    else:
+                        plan.append(("TOUCH_B2A", Path(b["abs"]), Path(pair.left)/rel, 0, rel, {"mtime": b["mtime"]}))
+                    continue
                 if policy == "prefer_left":
-                    plan.append(("COPY_A2B", Path(a["abs"]), Path(pair.right)/rel, a["size"], rel, {"conflict": True}))
+                    plan.append(("COPY_A2B", Path(a["abs"]), Path(pair.right)/rel, a["size"], rel, {"conflict": True, "dst_hash": b.get("hash", "")}))
                 elif policy == "prefer_right":
-                    plan.append(("COPY_B2A", Path(b["abs"]), Path(pair.left)/rel, b["size"], rel, {"conflict": True}))
+                    plan.append(("COPY_B2A", Path(b["abs"]), Path(pair.left)/rel, b["size"], rel, {"conflict": True, "dst_hash": a.get("hash", "")}))
                 else:
                     # newest-wins
                     if (a["mtime"] - b["mtime"]) > MTIME_FUZZ:
-                        plan.append(("COPY_A2B", Path(a["abs"]), Path(pair.right)/rel, a["size"], rel, {"conflict": True}))
+                        plan.append(("COPY_A2B", Path(a["abs"]), Path(pair.right)/rel, a["size"], rel, {"conflict": True, "dst_hash": b.get("hash", "")}))
                     elif (b["mtime"] - a["mtime"]) > MTIME_FUZZ:
-                        plan.append(("COPY_B2A", Path(b["abs"]), Path(pair.left)/rel, b["size"], rel, {"conflict": True}))
+                        plan.append(("COPY_B2A", Path(b["abs"]), Path(pair.left)/rel, b["size"], rel, {"conflict": True, "dst_hash": a.get("hash", "")}))
                     else:
                         # mtime uguali ma size diversa: scegli quello più grande
                         if a["size"] >= b["size"]:
-                            plan.append(("COPY_A2B", Path(a["abs"]), Path(pair.right)/rel, a["size"], rel, {"conflict": True}))
+                            plan.append(("COPY_A2B", Path(a["abs"]), Path(pair.right)/rel, a["size"], rel, {"conflict": True, "dst_hash": b.get("hash", "")}))
                         else:
-                            plan.append(("COPY_B2A", Path(b["abs"]), Path(pair.left)/rel, b["size"], rel, {"conflict": True}))
+                            plan.append(("COPY_B2A", Path(b["abs"]), Path(pair.left)/rel, b["size"], rel, {"conflict": True, "dst_hash": a.get("hash", "")}))
+        return plan
+
+    def _plan_paths_numpy(self, pair: Pair, mappingA: Dict[str, dict], mappingB: Dict[str, dict],
+                          snap: Snapshot, same: set, handled: set) -> List[tuple]:
+        """
+        Same decisions as the per-path loop of ``_plan_pair``, taken with NumPy masks.
+        Both sides and the snapshot become arrays (presence, size, mtime) aligned on
+        the union of paths; only the paths that need an action go back to Python
+        and only those are sorted.
+        """
+        # allineamento senza ordinare: indice dei percorsi di A, poi quelli solo in B
+        kA, kB = list(mappingA), list(mappingB)
+        nA = len(kA)
+        pos = dict(zip(kA, range(nA)))
+        ib = np.fromiter(map(pos.get, kB, itertools.repeat(-1)), np.int64, len(kB))
+        only_b = np.flatnonzero(ib < 0)
+        keys = kA + [kB[j] for j in only_b]
+        n = len(keys)
+        if not n:
+            return []
+        ib[only_b] = np.arange(nA, n)
+        pos.update(zip(keys[nA:], range(nA, n)))
+
+        def column(values, count: int, dtype):
+            return np.fromiter(values, dtype, count)
+
+        inA = np.zeros(n, bool)
+        inA[:nA] = True
+        inB = np.zeros(n, bool)
+        inB[ib] = True
+        mtA, mtB = np.zeros(n), np.zeros(n)
+        szA, szB = np.zeros(n, np.int64), np.zeros(n, np.int64)
+        mtA[:nA] = column(map(operator.itemgetter("mtime"), mappingA.values()), nA, np.float64)
+        szA[:nA] = column(map(operator.itemgetter("size"), mappingA.values()), nA, np.int64)
+        mtB[ib] = column(map(operator.itemgetter("mtime"), mappingB.values()), len(kB), np.float64)
+        szB[ib] = column(map(operator.itemgetter("size"), mappingB.values()), len(kB), np.int64)
+
+        # percorsi esclusi: sottoalberi con digest uguale e rinomini già pianificati
+        keep = np.ones(n, bool)
+        if same:
+            keep &= ~column((k.rpartition("/")[0] in same for k in keys), n, bool)
+        if handled:
+            keep &= ~column(map(handled.__contains__, keys), n, bool)
+
+        # snapshot: mtime precedente per lato, NaN = assente
+        pmA = np.full(n, np.nan)
+        pmB = np.full(n, np.nan)
+        if snap.data:
+            sidx = column(map(pos.get, snap.data, itertools.repeat(-1)), len(snap.data), np.int64)
+            hit = sidx >= 0
+            entries = list(snap.data.values())
+            for out, name in ((pmA, "A"), (pmB, "B")):
+                prev = np.array(list(map(operator.methodcaller("get", name), entries)), dtype=np.float64)
+                out[sidx[hit]] = prev[hit]
+        pA, pB = ~np.isnan(pmA), ~np.isnan(pmB)
+
+        onlyA, onlyB, both = inA & ~inB, inB & ~inA, inA & inB
+        if pair.conservative:
+            delA = delB = np.zeros(n, bool)
+        else:
+            # presente prima sull'altro lato e invariato da allora: l'altro lato l'ha eliminato
+            # (mtime precedente assente o 0 = invariato, come ``prev.get(side) or mtime``)
+            delA = onlyA & pB & (~pA | (pmA == 0) | (np.abs(mtA - pmA) <= MTIME_FUZZ))
+            delB = onlyB & pA & (~pB | (pmB == 0) | (np.abs(mtB - pmB) <= MTIME_FUZZ))
+        diff = both & ~((np.abs(mtA - mtB) <= MTIME_FUZZ) & (szA == szB))
+
+        touch = np.zeros(n, bool)
+        if pair.touch_identical:
+            for i in np.flatnonzero(keep & diff & (szA == szB)):
+                rel = keys[i]
+                touch[i] = self._same_content(mappingA[rel], mappingB[rel], snap.data.get(rel, {}))
+
+        policy = pair.conflict_policy
+        conflict = diff & ~touch
+        if policy == "prefer_left":
+            a_wins = np.ones(n, bool)
+        elif policy == "prefer_right":
+            a_wins = np.zeros(n, bool)
+        else:
+            dt = mtA - mtB
+            a_wins = (dt > MTIME_FUZZ) | ((dt >= -MTIME_FUZZ) & (szA >= szB))
+        if policy == "newest":
+            touchA2B = touch & (mtA > mtB)
+        else:
+            touchA2B = touch if policy == "prefer_left" else np.zeros(n, bool)
+
+        # codici azione: 1 copia A⇒B, 2 copia B⇒A, 3 elimina A, 4 elimina B, 5/6 touch, 7/8 conflitti
+        code = np.zeros(n, np.int8)
+        code[onlyA & ~delA] = 1
+        code[onlyB & ~delB] = 2
+        code[delA] = 3
+        code[delB] = 4
+        code[touchA2B] = 5
+        code[touch & ~touchA2B] = 6
+        code[conflict & a_wins] = 7
+        code[conflict & ~a_wins] = 8
+        code[~keep] = 0
+
+        left, right = Path(pair.left), Path(pair.right)
+        plan = []
+        # solo i percorsi con un'azione vanno ordinati (stesso ordine di sorted(rels))
+        for i in sorted(np.flatnonzero(code).tolist(), key=keys.__getitem__):
+            rel, c = keys[i], code[i]
+            a, b = mappingA.get(rel), mappingB.get(rel)
+            if c == 1:
+                plan.append(("COPY_A2B", Path(a["abs"]), right / rel, a["size"], rel, {}))
+            elif c == 2:
+                plan.append(("COPY_B2A", Path(b["abs"]), left / rel, b["size"], rel, {}))
+            elif c == 3:
+                plan.append(("DELETE_A", None, left / rel, a["size"], rel, {"hash": a.get("hash", "")}))
+            elif c == 4:
+                plan.append(("DELETE_B", None, right / rel, b["size"], rel, {"hash": b.get("hash", "")}))
+            elif c == 5:
+                plan.append(("TOUCH_A2B", Path(a["abs"]), right / rel, 0, rel, {"mtime": a["mtime"]}))
+            elif c == 6:
+                plan.append(("TOUCH_B2A", Path(b["abs"]), left / rel, 0, rel, {"mtime": b["mtime"]}))
+            elif c == 7:
+                plan.append(("COPY_A2B", Path(a["abs"]), right / rel, a["size"], rel, {"conflict": True, "dst_hash": b.get("hash", "")}))
+            else:
+                plan.append(("COPY_B2A", Path(b["abs"]), left / rel, b["size"], rel, {"conflict": True, "dst_hash": a.get("hash", "")}))
         return plan
 
-    def _execute_plan(self, pair: Pair, plan: List[tuple]):
+    def _plan_renames(self, pair: Pair, mappingA: Dict[str, dict], mappingB: Dict[str, dict],
+                      snap: Snapshot, plan: List[tuple]) -> set:
+        """Append renames detected by hash among files present on one side only; return the paths handled."""
+        handled: set = set()
+        onlyA = {r: mappingA[r] for r in mappingA.keys() - mappingB.keys()}
+        onlyB = {r: mappingB[r] for r in mappingB.keys() - mappingA.keys()}
+        hashA = {info["hash"]: rel for rel, info in onlyA.items() if info.get("hash")}
+        hashB = {info["hash"]: rel for rel, info in onlyB.items() if info.get("hash")}
+        for h in set(hashA.keys()) & set(hashB.keys()):
+            relA = hashA[h]
+            relB = hashB[h]
+            prevA = snap.data.get(relA)
+            prevB = snap.data.get(relB)
+            if prevB and not prevA:
+                # rinomina in B per allinearsi ad A
+                plan.append((
+                    "RENAME_B",
+                    Path(pair.right) / relB,
+                    Path(pair.right) / relA,
+                    0,
+                    relA,
+                    {"from": relB},
+                ))
+                handled.update({relA, relB})
+            elif prevA and not prevB:
+                # rinomina in A per allinearsi a B
+                plan.append((
+                    "RENAME_A",
+                    Path(pair.left) / relA,
+                    Path(pair.left) / relB,
+                    0,
+                    relB,
+                    {"from": relA},
+                ))
+                handled.update({relA, relB})
+        return handled
+
+    def _begin_plan(self, plan: List[tuple], pair: Optional[Pair] = None,
+                    mapA: Optional[Dict[str, dict]] = None, mapB: Optional[Dict[str, dict]] = None):
+        if plan and pair is not None and mapA is not None and mapB is not None:
+            self._index.add_root(Path(pair.left), mapA)
+            self._index.add_root(Path(pair.right), mapB)
+            self._note_scanned(plan, pair, mapA, mapB)
+        if plan and pair is not None:
+            self._open_journal(pair, plan, mapA, mapB)
+            self._set_deadline(pair)
         # calcolo totali per barra/progress
         for action, src, dst, size, rel, extra in plan:
             self.bytes_total += max(0, size)
         self.actions_total += len(plan)
         self.progress(self.actions_done, self.actions_total, self.bytes_done, self.bytes_total)
 
+    def _note_scanned(self, plan: List[tuple], pair: Pair, mapA: Dict[str, dict], mapB: Dict[str, dict]):
+        # size/mtime con cui è stato calcolato l'hash dei file che il piano archivia o elimina
+        targets = {"COPY_A2B": (pair.right, mapB), "COPY_B2A": (pair.left, mapA),
+                   "DELETE_A": (pair.left, mapA), "DELETE_B": (pair.right, mapB)}
+        with self._stores_lock:
+            for action, src, dst, size, rel, extra in plan:
+                if action not in targets or not (extra.get("dst_hash") or extra.get("hash")):
+                    continue
+                root, mapping = targets[action]
+                info = mapping.get(rel)
+                if info is not None:
+                    self._scanned[os.path.normpath(os.path.join(root, rel))] = (info["size"], info["mtime"])
+
+    def _run_action(self, pair: Pair, item: tuple):
+        action, src, dst, size, rel, extra = item
         left_root = Path(pair.left)
         right_root = Path(pair.right)
+        if action == "COPY_A2B":
+            self._safe_copy(Path(src), Path(dst), right_root, rel, extra.get("dst_hash", ""))
+            self.log(f"→ A⇒B: {rel} ({human_bytes(size)})")
+        elif action == "COPY_B2A":
+            self._safe_copy(Path(src), Path(dst), left_root, rel, extra.get("dst_hash", ""))
+            self.log(f"→ B⇒A: {rel} ({human_bytes(size)})")
+        elif action == "DELETE_A":
+            self._to_trash(left_root, rel, pair.use_trash, extra.get("hash", ""))
+            self.log(f"✖ elimina in A: {rel}")
+        elif action == "DELETE_B":
+            self._to_trash(right_root, rel, pair.use_trash, extra.get("hash", ""))
+            self.log(f"✖ elimina in B: {rel}")
+        elif action == "RENAME_A":
+            self._safe_move(Path(src), Path(dst), left_root, rel)
+            self.log(f"↺ rinomina in A: {extra.get('from')} → {rel}")
+        elif action == "RENAME_B":
+            self._safe_move(Path(src), Path(dst), right_root, rel)
+            self.log(f"↺ rinomina in B: {extra.get('from')} → {rel}")
+        elif action in ("TOUCH_A2B", "TOUCH_B2A"):
+            os.utime(dst, (extra["mtime"], extra["mtime"]))
+            self.log(f"≡ {'A⇒B' if action == 'TOUCH_A2B' else 'B⇒A'}: {rel} (contenuto identico, solo mtime)")
 
-        for action, src, dst, size, rel, extra in plan:
-            if self.stop.is_set(): break
-            # Pausa
-            while self.pause.is_set() and not self.stop.is_set():
-                time.sleep(0.1)
+    def _action_done(self, size: int, count: int = 1):
+        self.actions_done += count
+        self.bytes_done += max(0, size)
+        # Aggiorna metriche
+        elapsed = max(1e-3, time.time()-self._t0)
+        rate = self.bytes_done / elapsed
+        remain = max(0, self.bytes_total - self.bytes_done)
+        eta = remain / rate if rate > 1e-3 else float("inf")
+        self.progress(self.actions_done, self.actions_total, self.bytes_done, self.bytes_total)
+        self.status(rate, eta)
+
+    def _plan_units(self, plan: List[tuple], pair: Optional[Pair] = None) -> List[List[tuple]]:
+        """Group small copies by destination directory; every other action is its own unit."""
+        limit = int(self.settings.get("small_file_limit", SMALL_FILE_LIMIT))
+        units: List[List[tuple]] = []
+        batches: Dict[Tuple[str, str, bool], List[tuple]] = {}
+        for item in plan:
+            action, src, dst, size = item[:4]
+            if action in ("COPY_A2B", "COPY_B2A") and 0 <= size <= limit:
+                # i file prioritari non finiscono nei lotti degli altri
+                key = (action, str(Path(dst).parent), pair is not None and self._flagged(pair, item[4]))
+                batch = batches.get(key)
+                if batch is None or len(batch) >= SMALL_BATCH_MAX:
+                    batch = batches[key] = []
+                    units.append(batch)
+                batch.append(item)
+            else:
+                units.append([item])
+        return units
+
+    @staticmethod
+    def _flagged(pair: Pair, rel: str) -> bool:
+        return any(glob.fnmatch.fnmatch(rel, pat) for pat in pair.priority_globs)
+
+    def _item_priority(self, pair: Pair, item: tuple, order: List[str],
+                       mapA: Optional[Dict[str, dict]], mapB: Optional[Dict[str, dict]]) -> tuple:
+        action, src, dst, size, rel, extra = item
+        if action not in ("COPY_A2B", "COPY_B2A"):
+            return (-1,)  # rinomini, eliminazioni, touch: costano poco, subito
+        key = [0]
+        for crit in order:
+            if crit == "flagged":
+                key.append(0 if self._flagged(pair, rel) else 1)
+            elif crit == "size":
+                key.append(0 if size <= SMALL_FILE_LIMIT else 1 if size < LARGE_COPY else 2)
+            elif crit == "recent":
+                info = ((mapA if action == "COPY_A2B" else mapB) or {}).get(rel)
+                key.append(-info["mtime"] if info else 0.0)
+        return tuple(key)
+
+    def _ordered_units(self, pair: Pair, plan: List[tuple],
+                       mapA: Optional[Dict[str, dict]] = None, mapB: Optional[Dict[str, dict]] = None) -> List[List[tuple]]:
+        """
+        Units in priority order (``priority_order``: flagged globs, size class,
+        recency), with large copies interleaved so they never starve the rest.
+        """
+        order = [c.strip() for c in str(self.settings.get("priority_order", PRIORITY_ORDER)).split(",") if c.strip()]
+        if not order:
+            return self._plan_units(plan, pair)
+        ranked = sorted(plan, key=lambda item: self._item_priority(pair, item, order, mapA, mapB))
+        units = self._plan_units(ranked, pair)
+
+        def group(unit: List[tuple]) -> tuple:
+            head = unit[0]
+            if head[0] not in ("COPY_A2B", "COPY_B2A"):
+                return (0,)
+            return (1, "flagged" in order and self._flagged(pair, head[4]))
+
+        out: List[List[tuple]] = []
+        for _, units_in_group in itertools.groupby(units, key=group):
+            small: List[List[tuple]] = []
+            large: List[List[tuple]] = []
+            for unit in units_in_group:
+                (large if len(unit) == 1 and unit[0][3] >= LARGE_COPY else small).append(unit)
+            since = 0
+            large.reverse()
+            for unit in small:
+                if large and since >= INTERLEAVE_BYTES:
+                    out.append(large.pop())
+                    since = 0
+                out.append(unit)
+                if unit[0][0] in ("COPY_A2B", "COPY_B2A"):
+                    since += sum(item[3] for item in unit)
+            out.extend(reversed(large))
+        return out
+
+    def copy_rate(self) -> float:
+        """Copy throughput measured in this run (bytes/s), 0 until enough was copied."""
+        copied, secs = self._measured
+        return copied / secs if copied >= RATE_MIN_BYTES and secs > 0 else 0.0
+
+    def _set_deadline(self, pair: Pair):
+        # la scadenza è la più vicina tra time_budget e l'inizio della finestra silenziosa
+        deadlines = [self.deadline] if self.deadline else []
+        entry = PairEntry(pair)
+        if entry.silent is not None and not entry.is_silent(datetime.now()):
+            deadlines.append(entry.silent_starts(datetime.now()))
+        deadline = min(deadlines) if deadlines else None
+        if deadline is not None and pair.id_hash() not in self._deadlines:
+            self.log(f"⏳ Tempo disponibile: {format_eta(deadline - time.time())}")
+        self._deadlines[pair.id_hash()] = deadline
+
+    def _unit_cost(self, unit: List[tuple]) -> float:
+        rate = self.copy_rate() or float(self.settings.get("throughput", 0) or 0) or DEFAULT_THROUGHPUT
+        copied = sum(max(0, item[3]) for item in unit if item[0] in ("COPY_A2B", "COPY_B2A"))
+        return copied / rate + ACTION_OVERHEAD * len(unit)
+
+    def _fits(self, pair: Pair, unit: List[tuple]) -> bool:
+        """False (and the unit is deferred) if its estimated cost overruns the pair deadline."""
+        deadline = self._deadlines.get(pair.id_hash())
+        if deadline is None or time.time() + self._unit_cost(unit) <= deadline:
+            return True
+        self._deferred.setdefault(pair.id_hash(), []).extend(unit)
+        # fuori dai totali: la barra arriva in fondo al lavoro che si farà davvero
+        self.actions_total -= len(unit)
+        self.bytes_total -= sum(max(0, item[3]) for item in unit)
+        return False
+
+    def _open_journal(self, pair: Pair, plan: List[tuple],
+                      mapA: Optional[Dict[str, dict]], mapB: Optional[Dict[str, dict]]):
+        if not self.settings.get("plan_journal", True):
+            return
+        journal = self._journals.get(pair.id_hash())
+        try:
+            if journal is not None:
+                journal.reopen()  # piano ripreso: si continua ad appendere allo stesso journal
+            else:
+                journal = PlanJournal(pair)
+                journal.start(plan, mapA, mapB, self.durability)
+                self._journals[pair.id_hash()] = journal
+        except OSError as e:
+            self._journals.pop(pair.id_hash(), None)
+            self.log(f"⚠️  Journal del piano non scrivibile: {e}")
+
+    def _journal_done(self, pair: Pair, item: tuple):
+        journal = self._journals.get(pair.id_hash())
+        if journal is not None:
+            journal.done(item)
+
+    def _close_journal(self, pair: Pair):
+        journal = self._journals.pop(pair.id_hash(), None)
+        if journal is not None:
+            journal.close(finished=not self.stop.is_set())
+
+    def _resume_plan(self, pair: Pair) -> Optional[List[tuple]]:
+        """Pending actions of an interrupted run whose paths still match the journal, or None."""
+        if not self.settings.get("plan_journal", True):
+            return None
+        journal = PlanJournal(pair)
+        loaded = journal.load()
+        if loaded is None:
+            return None
+        pending, stateA, stateB = loaded
+        # si verificano solo sorgenti e destinazioni delle azioni rimaste
+        valid = [item for item in pending if self._revalidate_plan(pair, [item], stateA, stateB)]
+        if not valid:
+            journal.close(finished=True)
+            return None
+        dropped = len(pending) - len(valid)
+        self.log(f"⏯️  Riprendo il piano interrotto: {len(valid)} azioni"
+                 + (f" ({dropped} scartate: file cambiati nel frattempo)" if dropped else ""))
+        self._journals[pair.id_hash()] = journal
+        return valid
 
-            t1 = time.time()
+    def _run_unit(self, pair: Pair, unit: List[tuple]) -> Tuple[int, int]:
+        """Run one unit; return the (files, bytes) actually done."""
+        t0 = time.perf_counter()
+        if len(unit) == 1:
+            self._run_action(pair, unit[0])
+            self._journal_done(pair, unit[0])
+            done = (1, unit[0][3])
+        else:
+            done = self._copy_batch(pair, unit)
+        if unit[0][0] in ("COPY_A2B", "COPY_B2A"):
+            with self._measured_lock:
+                self._measured[0] += max(0, done[1])
+                self._measured[1] += time.perf_counter() - t0
+        return done
+
+    def _copy_batch(self, pair: Pair, unit: List[tuple]) -> Tuple[int, int]:
+        # corsia veloce per file piccoli: una mkdir, esistenza dall'indice, un solo log per lotto
+        action = unit[0][0]
+        dst_root = Path(pair.right) if action == "COPY_A2B" else Path(pair.left)
+        self._ensure_dir(Path(unit[0][2]).parent)
+        copied = 0
+        copied_bytes = 0
+        for item in unit:
+            _, src, dst, size, rel, extra = item
+            if self.stop.is_set():
+                break
             try:
-                if action == "COPY_A2B":
-                    self._safe_copy(Path(src), Path(dst), right_root, rel)
-                    self.log(f"→ A⇒B: {rel} ({human_bytes(size)})")
-                elif action == "COPY_B2A":
-                    self._safe_copy(Path(src), Path(dst), left_root, rel)
-                    self.log(f"→ B⇒A: {rel} ({human_bytes(size)})")
-                elif action == "DELETE_A":
-                    self._to_trash(left_root, rel, pair.use_trash)
-                    self.log(f"✖ elimina in A: {rel}")
-                elif action == "DELETE_B":
-                    self._to_trash(right_root, rel, pair.use_trash)
-                    self.log(f"✖ elimina in B: {rel}")
-                elif action == "RENAME_A":
-                    self._safe_move(Path(src), Path(dst), left_root, rel)
-                    self.log(f"↺ rinomina in A: {extra.get('from')} → {rel}")
-                elif action == "RENAME_B":
-                    self._safe_move(Path(src), Path(dst), right_root, rel)
-                    self.log(f"↺ rinomina in B: {extra.get('from')} → {rel}")
+                self._safe_copy(Path(src), Path(dst), dst_root, rel, extra.get("dst_hash", ""), preallocate=False)
+                self._journal_done(pair, item)
+                copied += 1
+                copied_bytes += size
             except Exception as e:
                 self.log(f"❌ Errore su {rel}: {e}")
-            finally:
-                dt = max(1e-6, time.time()-t1)
-                self.actions_done += 1
-                self.bytes_done += max(0, size)
-                # Aggiorna metriche
-                elapsed = max(1e-3, time.time()-self._t0)
-                rate = self.bytes_done / elapsed
-                remain = max(0, self.bytes_total - self.bytes_done)
-                eta = remain / rate if rate > 1e-3 else float("inf")
-                self.progress(self.actions_done, self.actions_total, self.bytes_done, self.bytes_total)
-                self.status(rate, eta)
-
-        # retention cleanup
-        days = int(self.settings.get("retention_days", 30))
-        try:
-            self._cleanup_retention(left_root, ARCHIVE_DIRNAME, days)
-            self._cleanup_retention(right_root, ARCHIVE_DIRNAME, days)
-            self._cleanup_retention(left_root, TRASH_DIRNAME, days)
-            self._cleanup_retention(right_root, TRASH_DIRNAME, days)
-        except Exception:
-            pass
+        folder = posixpath.dirname(unit[0][4]) or "."
+        arrow = "A⇒B" if action == "COPY_A2B" else "B⇒A"
+        self.log(f"→ {arrow}: {copied} file in {folder}/ ({human_bytes(copied_bytes)})")
+        return copied, copied_bytes
+
+    def _prefetch(self, pair: Pair, unit: List[tuple]):
+        """Let the kernel read the head of the next copies while the current unit is written."""
+        if unit[0][0] not in ("COPY_A2B", "COPY_B2A") or not self.settings.get("copy_pipeline", True):
+            return
+        if self._io_mode(Path(pair.left if unit[0][0] == "COPY_A2B" else pair.right)) == "direct":
+            return  # O_DIRECT non usa la page cache: il readahead andrebbe sprecato
+        budget = PREFETCH_BYTES
+        for item in unit:
+            src = Path(item[1])
+            if item[3] <= 0 or (self._agents and self._agent_for(src)):
+                continue
+            prefetch(src, min(item[3], budget))
+            budget -= item[3]
+            if budget <= 0:
+                break
+
+    def _end_plan(self, pair: Optional[Pair] = None):
+        # la retention è a carico di RetentionWorker, fuori dal percorso critico
+        self.durable.sync()
+        self._flush_stores()
+        if pair is not None:
+            self._index.drop_root(Path(pair.left))
+            self._index.drop_root(Path(pair.right))
+            self._close_journal(pair)
+            deferred = self._deferred.get(pair.id_hash())
+            if deferred and not self.stop.is_set():
+                self.log(f"⏳ Tempo esaurito: {len(deferred)} azioni "
+                         f"({human_bytes(sum(max(0, i[3]) for i in deferred))}) rimandate alla prossima sync")
+
+    def _execute_plan(self, pair: Pair, plan: List[tuple],
+                      mapA: Optional[Dict[str, dict]] = None, mapB: Optional[Dict[str, dict]] = None):
+        self._begin_plan(plan, pair, mapA, mapB)
+        units = self._ordered_units(pair, plan, mapA, mapB)
+        for i, unit in enumerate(units):
+            if self.stop.is_set(): break
+            self._wait_resumed()
+            if not self._fits(pair, unit):
+                continue
+            if i + 1 < len(units):
+                self._prefetch(pair, units[i + 1])
+            try:
+                files, size = self._run_unit(pair, unit)
+            except Exception as e:
+                self.log(f"❌ Errore su {unit[0][4]}: {e}")
+                files, size = len(unit), sum(item[3] for item in unit)  # azione conclusa, con errore
+            self._action_done(size, files)
+        self._end_plan(pair)
 
     def dry_run_pair(self, pair: Pair) -> Tuple[List[tuple], Dict[str, dict], Dict[str, dict]]:
+        self._register_io(pair)
+        plan, mapA, mapB = self._scan_and_plan(pair)
+        if self.plan_cache is not None and not self.stop.is_set():
+            dirs = {str(Path(root)): self._dir_mtimes.get(str(Path(root)), {}) for root in (pair.left, pair.right)}
+            self.plan_cache.store(pair, plan, mapA, mapB, dirs)
+        return plan, mapA, mapB
+
+    def _revalidate_plan(self, pair: Pair, plan: List[tuple], mapA: Dict[str, dict], mapB: Dict[str, dict]) -> bool:
+        """Check that every path touched by ``plan`` still matches the cached scan."""
+        for action, src, dst, size, rel, extra in plan:
+            for root, mapping in ((Path(pair.left), mapA), (Path(pair.right), mapB)):
+                for r in (rel, extra.get("from")):
+                    if not r:
+                        continue
+                    info = mapping.get(r)
+                    try:
+                        st = (root / r).stat()
+                    except OSError:
+                        st = None
+                    if info is None:
+                        if st is not None:
+                            return False
+                    elif st is None or st.st_size != info["size"] or st.st_mtime != info["mtime"]:
+                        return False
+        return True
+
+    def _plan_for_run(self, pair: Pair) -> Tuple[List[tuple], Dict[str, dict], Dict[str, dict]]:
+        # piano interrotto: solo le azioni rimaste (le mappe si ricostruiscono dopo l'esecuzione)
+        resumed = self._resume_plan(pair)
+        if resumed:
+            return resumed, None, None
+        # riusa il piano dell'anteprima se ancora valido, altrimenti scansiona
+        cached = self.plan_cache.take(pair) if self.plan_cache is not None else None
+        if cached:
+            plan, mapA, mapB = cached
+            if self._revalidate_plan(pair, plan, mapA, mapB):
+                self.log(f"♻️  Riuso il piano dell'anteprima ({len(plan)} azioni)")
+                return plan, mapA, mapB
+        fast = self._fast_attach(pair)
+        if fast is not None:
+            mapA, mapB = fast
+            return self._plan_from_maps(pair, mapA, mapB), mapA, mapB
+        return self._scan_and_plan(pair)
+
+    def _removable_side(self, pair: Pair) -> Optional[str]:
+        sides = [side for side, root in (("A", Path(pair.left)), ("B", Path(pair.right)))
+                 if (root / VOLUME_ID_NAME).exists() or is_removable(root)]
+        return sides[0] if len(sides) == 1 else None
+
+    def _snapshot_meta(self, pair: Pair, mapA: Dict[str, dict], mapB: Dict[str, dict]) -> dict:
+        """Snapshot metadata: per-directory mtime and Merkle digest, removable volume id."""
+        meta: dict = {"dirs": {}}
+        for side, root, mapping in (("A", pair.left, mapA), ("B", pair.right, mapB)):
+            mtimes = self._dir_mtimes.get(str(Path(root)), {})
+            meta["dirs"][side] = {d: [mtimes.get(d), h] for d, h in self._digests(mapping).items()}
+        side = self._removable_side(pair)
+        if side is not None:
+            vid = volume_id(Path(pair.left if side == "A" else pair.right), create=True)
+            if vid:
+                meta["volume"] = {"side": side, "id": vid}
+        return meta
+
+    @staticmethod
+    def _matches_remembered(path: Path, info: Optional[dict]) -> bool:
+        try:
+            st = path.stat()
+        except OSError:
+            return info is None
+        return (info is not None and st.st_size == info["size"]
+                and abs(st.st_mtime - info["mtime"]) <= MTIME_FUZZ)
+
+    def _fast_attach(self, pair: Pair) -> Optional[Tuple[Dict[str, dict], Dict[str, dict]]]:
+        """
+        Resume a pair whose removable side is the volume seen at the last sync:
+        host-side changes are copied at once against the state remembered in the
+        snapshot, while the volume is rescanned in the background. Returns the
+        (mapA, mapB) for the follow-up full pass, None if the volume is unknown.
+        """
+        if not self.settings.get("fast_attach", True):
+            return None
+        snap = self._load_snapshot(pair)
+        vol = snap.meta.get("volume") or {}
+        side = vol.get("side")
+        if side not in ("A", "B") or not snap.data or not vol.get("id"):
+            return None
+        usb_root = Path(pair.left if side == "A" else pair.right)
+        host_root = Path(pair.right if side == "A" else pair.left)
+        if volume_id(usb_root) != vol["id"]:
+            return None
+        self.log(f"⚡ Volume riconosciuto ({usb_root}): copio subito le modifiche locali, verifico il volume in background")
+        scanner = ThreadPoolExecutor(max_workers=1)
+        usb_scan = scanner.submit(self._rel_map, usb_root, pair.include_globs, pair.exclude_globs)
+        scanner.shutdown(wait=False)
+        host_map = self._rel_map(host_root, pair.include_globs, pair.exclude_globs,
+                                 self._reuse(snap, "B" if side == "A" else "A"))
+        remembered: Dict[str, dict] = {}
+        for rel, prev in snap.side_entries(side).items():
+            if self._matches_filters(rel, pair.include_globs, pair.exclude_globs):
+                remembered[rel] = dict(prev, abs=str(usb_root / rel))
+        mapA, mapB = (remembered, host_map) if side == "A" else (host_map, remembered)
+        # solo copie verso il volume, e solo se la destinazione è ancora com'era nello snapshot
+        towards = ("COPY_B2A", "TOUCH_B2A") if side == "A" else ("COPY_A2B", "TOUCH_A2B")
+        plan = [item for item in self._plan_pair(pair, mapA, mapB, snap)
+                if item[0] in towards and self._matches_remembered(Path(item[2]), remembered.get(item[4]))]
+        if plan and not self.stop.is_set():
+            self._execute_plan(pair, plan, mapA, mapB)
+        usb_map = usb_scan.result()
+        # la scansione in background può aver visto i file prima della copia
+        for action, src, dst, size, rel, extra in plan:
+            try:
+                st = Path(dst).stat()
+            except OSError:
+                continue
+            usb_map[rel] = {"abs": str(dst), "mtime": st.st_mtime, "size": st.st_size,
+                            "hash": host_map[rel].get("hash", "") if rel in host_map else ""}
+        return (usb_map, host_map) if side == "A" else (host_map, usb_map)
+
+    def _scan_and_plan(self, pair: Pair) -> Tuple[List[tuple], Dict[str, dict], Dict[str, dict]]:
         A, B = Path(pair.left), Path(pair.right)
-        mapA = self._rel_map(A, pair.include_globs, pair.exclude_globs)
-        mapB = self._rel_map(B, pair.include_globs, pair.exclude_globs)
+        snap = self._load_snapshot(pair)
+        mapA = self._rel_map(A, pair.include_globs, pair.exclude_globs, self._reuse(snap, "A"))
+        mapB = self._rel_map(B, pair.include_globs, pair.exclude_globs, self._reuse(snap, "B"))
+        return self._plan_pair(pair, mapA, mapB, snap), mapA, mapB
+
+    def _plan_from_maps(self, pair: Pair, mapA: Dict[str, dict], mapB: Dict[str, dict]) -> List[tuple]:
+        return self._plan_pair(pair, mapA, mapB, self._load_snapshot(pair))
+
+    def _load_snapshot(self, pair: Pair) -> Snapshot:
         snap = Snapshot(pair)
         snap.load()
-        plan = self._plan_pair(pair, mapA, mapB, snap)
-        return plan, mapA, mapB
+        for p in snap.corrupt:
+            self.log(f"⚠️  Snapshot illeggibile ignorato: {p}")
+        self._snapshots[pair.id_hash()] = snap
+        return snap
 
-    def run(self):
+    def _reuse(self, snap: Snapshot, side: str) -> Optional[Tuple[Dict[str, float], Dict[str, dict]]]:
+        """Snapshot state for ``_rel_map`` when ``trust_dir_mtime`` is on (opt-in)."""
+        if not self.settings.get("trust_dir_mtime", False) or self.settings.get("verify_all", False):
+            return None
+        dirs = snap.dir_mtimes(side)
+        return (dirs, snap.side_entries(side)) if dirs else None
+
+    def _digests(self, mapping: Dict[str, dict]) -> Dict[str, str]:
+        # stessa mappa tra pianificazione e snapshot (piano vuoto): calcolo una volta sola
+        memo = self._digest_memo.get(id(mapping))
+        if memo is not None and memo[0] is mapping:
+            return memo[1]
+        digests = dir_digests(mapping)
+        self._digest_memo[id(mapping)] = (mapping, digests)
+        return digests
+
+    @staticmethod
+    def _same_digests(old: dict, new: dict) -> bool:
+        # gli mtime delle directory non contano: la radice cambia a ogni scrittura di snapshot/cache
+        def digests(meta: dict) -> dict:
+            return {side: {d: v[1] for d, v in dirs.items()} for side, dirs in (meta.get("dirs") or {}).items()}
+        return old.get("volume") == new.get("volume") and digests(old) == digests(new)
+
+    def _save_snapshot(self, pair: Pair, mapA: Dict[str, dict], mapB: Dict[str, dict], changed: bool = True):
+        """Write the snapshot, unless nothing ran and the directory digests are unchanged."""
+        prev = self._snapshots.pop(pair.id_hash(), None)
+        deferred = self._deferred.pop(pair.id_hash(), None)
+        self._deadlines.pop(pair.id_hash(), None)
+        if self.stop.is_set():
+            return  # mappe incomplete: meglio lo snapshot precedente
+        if deferred:
+            if prev is None:
+                prev = Snapshot(pair)
+                prev.load()
+            mapA, mapB, dirs = self._keep_pending(prev, mapA, mapB, deferred)
+        meta = self._snapshot_meta(pair, mapA, mapB)
+        self._digest_memo.clear()
+        if deferred:
+            # cartelle con lavoro rimandato: mtime non affidabile per trust_dir_mtime
+            for side in ("A", "B"):
+                for d in dirs:
+                    if d in meta["dirs"][side]:
+                        meta["dirs"][side][d][0] = None
+        elif not changed and prev is not None and self._same_digests(prev.meta, meta):
+            return
+        Snapshot(pair).save(mapA, mapB, self.durability, meta)
+
+    @staticmethod
+    def _keep_pending(prev: Snapshot, mapA: Dict[str, dict], mapB: Dict[str, dict],
+                      deferred: List[tuple]) -> Tuple[Dict[str, dict], Dict[str, dict], set]:
+        """
+        Snapshot maps with the paths of deferred actions reverted to their previous
+        snapshot state, so the next run plans them again exactly as this one did.
+        """
+        rels = {rel for item in deferred for rel in (item[4], item[5].get("from")) if rel}
+        out = []
+        for side, mapping in (("A", mapA), ("B", mapB)):
+            old = prev.side_entries(side)
+            mapping = dict(mapping)
+            for rel in rels:
+                if rel in old:
+                    mapping[rel] = old[rel]
+                else:
+                    mapping.pop(rel, None)
+            out.append(mapping)
+        return out[0], out[1], {posixpath.dirname(rel) for rel in rels}
+
+    @staticmethod
+    def _unchanged_since(info: dict, prev: Optional[list]) -> bool:
+        return prev is not None and info["size"] == prev[1] and abs(info["mtime"] - prev[0]) <= MTIME_FUZZ
+
+    @staticmethod
+    def _group_winner(group: SyncGroup, infos: List[Optional[dict]]) -> int:
+        present = [i for i, info in enumerate(infos) if info]
+        if group.conflict_policy == "prefer_first":
+            return present[0]
+        # più recente; a pari merito (±fuzz) il più grande, poi l'ordine delle radici
+        best = present[0]
+        for i in present[1:]:
+            a, b = infos[i], infos[best]
+            if a["mtime"] - b["mtime"] > MTIME_FUZZ or (abs(a["mtime"] - b["mtime"]) <= MTIME_FUZZ and a["size"] > b["size"]):
+                best = i
+        return best
+
+    def _plan_group(self, group: SyncGroup, maps: List[Dict[str, dict]], snap: GroupSnapshot) -> List[tuple]:
+        """
+        N-way plan: for every path pick the winning copy and fan it out, in a
+        single action, to all roots that lack it or hold a different version.
+        Renames are not detected across N roots (they become copy + delete).
+        """
+        # action: "FANOUT", "DELETE_N", "TOUCH_N"
+        n = len(maps)
+        keys = [group.root_key(i) for i in range(n)]
+        digests = [self._digests(m) for m in maps]
+        same = {d for d, h in digests[0].items() if all(dg.get(d) == h for dg in digests[1:])}
+        if "" in same:
+            return []
+        plan = []
+        for rel in sorted(set().union(*maps)):
+            if posixpath.dirname(rel) in same:
+                continue
+            if self.stop.is_set():
+                break
+            infos = [m.get(rel) for m in maps]
+            prev = snap.data.get(rel, {})
+            present = [i for i in range(n) if infos[i]]
+            if not group.conservative:
+                # sparito da qualche radice e invariato altrove: eliminazione da propagare
+                gone = [i for i in range(n) if infos[i] is None and keys[i] in prev]
+                if gone and all(self._unchanged_since(infos[i], prev.get(keys[i])) for i in present):
+                    for i in present:
+                        plan.append(("DELETE_N", None, Path(group.roots[i]) / rel, infos[i]["size"], rel,
+                                     {"root": i, "hash": infos[i].get("hash", "")}))
+                    continue
+            win = self._group_winner(group, infos)
+            w = infos[win]
+            targets, hashes = [], []
+            for i, info in enumerate(infos):
+                if i == win:
+                    continue
+                if info is not None and info["size"] == w["size"]:
+                    if abs(info["mtime"] - w["mtime"]) <= MTIME_FUZZ:
+                        continue
+                    if group.touch_identical and w.get("hash") and info.get("hash") == w["hash"]:
+                        plan.append(("TOUCH_N", Path(w["abs"]), Path(group.roots[i]) / rel, 0, rel,
+                                     {"mtime": w["mtime"], "root": i}))
+                        continue
+                targets.append(i)
+                hashes.append(info.get("hash", "") if info else "")
+            if targets:
+                plan.append(("FANOUT", Path(w["abs"]), [Path(group.roots[i]) / rel for i in targets],
+                             w["size"] * len(targets), rel,
+                             {"from": win, "roots": targets, "dst_hash": hashes, "size": w["size"]}))
+        return plan
+
+    def _run_group_action(self, group: SyncGroup, item: tuple):
+        action, src, dst, size, rel, extra = item
+        if action == "FANOUT":
+            targets = [(Path(d), Path(group.roots[i]), rel, h) for d, i, h in zip(dst, extra["roots"], extra["dst_hash"])]
+            self._safe_fanout(Path(src), targets)
+            dests = ",".join(str(i + 1) for i in extra["roots"])
+            self.log(f"→ {extra['from'] + 1}⇒{dests}: {rel} ({human_bytes(extra['size'])})")
+        elif action == "DELETE_N":
+            self._to_trash(Path(group.roots[extra["root"]]), rel, group.use_trash, extra.get("hash", ""))
+            self.log(f"✖ elimina in {extra['root'] + 1}: {rel}")
+        elif action == "TOUCH_N":
+            os.utime(dst, (extra["mtime"], extra["mtime"]))
+            self.log(f"≡ {extra['root'] + 1}: {rel} (contenuto identico, solo mtime)")
+
+    def _sync_group(self, group: SyncGroup):
+        roots = [Path(r) for r in group.roots]
+        missing = [str(r) for r in roots if not r.exists()]
+        if len(roots) < 2 or missing:
+            self.log(f"❌ Gruppo {group.label()}: percorsi non validi {missing}. Salto.")
+            return
+        t0 = time.time()
+        self._register_io(group)
+        self.log(f"🔁 Gruppo {group.label()} ({len(roots)} radici, conservativa={'sì' if group.conservative else 'no'}, conflitti={group.conflict_policy})")
+        snap = GroupSnapshot(group)
+        snap.load()
+        for p in snap.corrupt:
+            self.log(f"⚠️  Snapshot illeggibile ignorato: {p}")
+        # una scansione per radice, anche per l'hub condiviso da tutte le altre
+        maps = [self._rel_map(root, group.include_globs, group.exclude_globs) for root in roots]
+        plan = self._plan_group(group, maps, snap)
+        self._begin_plan(plan)
+        for item in plan:
+            if self.stop.is_set():
+                break
+            self._wait_resumed()
+            try:
+                self._run_group_action(group, item)
+            except Exception as e:
+                self.log(f"❌ Errore su {item[4]}: {e}")
+            finally:
+                self._action_done(item[3])
+        self._end_plan()
+        if self.stop.is_set():
+            return
+        # si riscansionano solo le radici toccate dal piano
+        touched = {i for item in plan for i in (item[5]["roots"] if item[0] == "FANOUT" else [item[5]["root"]])}
+        for i in touched:
+            maps[i] = self._rel_map(roots[i], group.include_globs, group.exclude_globs)
+        self._digest_memo.clear()
+        GroupSnapshot(group).save(maps, self.durability)
+        self._note_pair(group, len(plan), t0)
+
+    def request_stop(self):
+        """Ask the running sync to stop (callable from any thread)."""
+        self.stop.set()
+
+    def set_paused(self, paused: bool):
+        """Pause or resume the running sync (callable from any thread)."""
+        if paused:
+            self.pause.set()
+        else:
+            self.pause.clear()
+
+    def _wait_resumed(self):
+        # Pausa
+        while self.pause.is_set() and not self.stop.is_set():
+            time.sleep(0.1)
+
+    def _note_pair(self, pair: "Pair | SyncGroup", actions: int, t0: float):
+        """Record what a completed pair sync did, for the adaptive scheduler."""
+        self.pair_stats[pair.id_hash()] = (actions, time.time() - t0)
+
+    def _reset_run(self):
         self._t0 = time.time()
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._stores = {}
+        self._scanned = {}
         self.actions_total = self.actions_done = 0
         self.bytes_total = self.bytes_done = 0
+        budget = float(self.settings.get("time_budget", 0) or 0)
+        self.deadline = time.time() + budget if budget > 0 else None
         self.progress(0, 1, 0, 1)
 
+    def _start_pair(self, pair: Pair) -> bool:
+        A, B = Path(pair.left), Path(pair.right)
+        if not A.exists() or not B.exists():
+            self.log(f"❌ Percorsi non validi: {A} / {B}. Salto.")
+            return False
+        self._register_io(pair)
+        self.log(f"🔁 {A} ↔ {B}  (conservativa={'sì' if pair.conservative else 'no'}, conflitti={pair.conflict_policy})")
+        return True
+
+    def run(self):
+        self._reset_run()
+
         for pair in self.pairs:
             if self.stop.is_set(): break
-            A, B = Path(pair.left), Path(pair.right)
-            if not A.exists() or not B.exists():
-                self.log(f"❌ Percorsi non validi: {A} / {B}. Salto.")
+            t0 = time.time()
+            if not self._start_pair(pair):
                 continue
-
-            self.log(f"🔁 {A} ↔ {B}  (conservativa={'sì' if pair.conservative else 'no'}, conflitti={pair.conflict_policy})")
-            plan, _, _ = self.dry_run_pair(pair)
+            A, B = Path(pair.left), Path(pair.right)
+            plan, mapA, mapB = self._plan_for_run(pair)
 
             # Esecuzione
-            self._execute_plan(pair, plan)
+            self._execute_plan(pair, plan, mapA, mapB)
+            if mapA is None and not self.stop.is_set():
+                # piano ripreso dal journal: il resto dell'albero (modifiche fatte mentre l'app
+                # era chiusa) si pianifica contro lo snapshot precedente prima di salvarne uno nuovo
+                plan, mapA, mapB = self._scan_and_plan(pair)
+                self._execute_plan(pair, plan, mapA, mapB)
 
-            # ricostruisci mapping dopo le azioni (rinomini, copie, ecc.)
-            mapA = self._rel_map(A, pair.include_globs, pair.exclude_globs)
-            mapB = self._rel_map(B, pair.include_globs, pair.exclude_globs)
+            # ricostruisci mapping dopo le azioni (rinomini, copie, ecc.); piano vuoto: le mappe sono già attuali
+            if plan:
+                mapA = self._rel_map(A, pair.include_globs, pair.exclude_globs)
+                mapB = self._rel_map(B, pair.include_globs, pair.exclude_globs)
 
             # Aggiorna snapshot
-            snap = Snapshot(pair)
-            snap.save(mapA, mapB)
+            self._save_snapshot(pair, mapA, mapB, changed=bool(plan))
+            if not self.stop.is_set():
+                self._note_pair(pair, len(plan), t0)
+
+        for group in self.groups:
+            if self.stop.is_set(): break
+            self._sync_group(group)
+        self._close_agents()
         self.log("✅ Sincronizzazione completata.")
 
+class AsyncSyncEngine(SyncEngine):
+    """
+    Variante asyncio di SyncEngine. Scansione, hashing e copie girano in un pool di
+    thread come task; tra pianificazione ed esecuzione c'è una coda limitata
+    (``async_queue``) consumata da ``async_workers`` task, e più coppie possono
+    procedere in parallelo (``async_pairs``) se non condividono radici.
+    Solo pianificazione -> esecuzione è in pipeline: la scansione produce le mappe
+    complete delle due radici e ``_plan_pair`` le pianifica in una chiamata sola
+    (le eliminazioni si decidono solo a scansione finita).
+    Stop e pausa arrivano dalla GUI con ``request_stop()``/``set_paused()``, che
+    svegliano il loop (``call_soon_threadsafe``): cancellano o sospendono i task
+    senza polling. ``run()`` resta una facciata sincrona; ``run_async()`` si può
+    attendere da un event loop già esistente (es. un servizio).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.workers = max(1, int(self.settings.get("async_workers", 4)))
+        self.queue_size = max(1, int(self.settings.get("async_queue", 64)))
+        self.parallel_pairs = max(1, int(self.settings.get("async_pairs", 2)))
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._resume: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._main: Optional["asyncio.Task"] = None
+        self._controls = threading.Lock()  # protegge _loop/_main tra GUI e loop
+
+    def run(self):
+        asyncio.run(self.run_async())
+
+    def _push(self, *callbacks):
+        # dal thread della GUI al loop; se il run non è (più) attivo bastano gli Event
+        with self._controls:
+            if self._loop is None:
+                return
+            for callback in callbacks:
+                self._loop.call_soon_threadsafe(callback)
+
+    def request_stop(self):
+        super().request_stop()
+        with self._controls:
+            main = self._main
+        if main is not None:
+            # anche chi aspetta la ripresa va svegliato: vede lo stop ed esce
+            self._push(main.cancel, self._resume.set)
+
+    def set_paused(self, paused: bool):
+        super().set_paused(paused)
+        if self._resume is not None:
+            self._push(self._resume.clear if paused else self._resume.set)
+
+    def _wait_resumed(self):
+        # thread del pool (gruppi): attende lo stesso Event del loop
+        with self._controls:
+            loop = self._loop
+        if loop is not None and self.pause.is_set() and not self.stop.is_set():
+            asyncio.run_coroutine_threadsafe(self._resume.wait(), loop).result()
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def run_async(self):
+        self._reset_run()
+        # scansioni (2 per coppia) + copie devono poter procedere insieme
+        self._executor = ThreadPoolExecutor(max_workers=self.workers + 2 * self.parallel_pairs)
+        self._resume = asyncio.Event()
+        with self._controls:
+            self._loop, self._main = asyncio.get_running_loop(), asyncio.current_task()
+        # richieste arrivate prima che il loop fosse registrato
+        if not self.pause.is_set():
+            self._resume.set()
+        sem = asyncio.Semaphore(self.parallel_pairs)
+        root_locks: Dict[str, asyncio.Lock] = {}
+        cancelled = False
+        try:
+            if self.stop.is_set():
+                raise asyncio.CancelledError
+            await asyncio.gather(*(self._sync_pair_async(p, sem, root_locks) for p in self.pairs))
+            for group in self.groups:  # dopo le coppie: le radici possono essere in comune
+                if self.stop.is_set():
+                    break
+                await self._call(self._sync_group, group)
+        except asyncio.CancelledError:
+            cancelled = True
+            self.log("⏹️ Sincronizzazione interrotta.")
+        finally:
+            with self._controls:
+                self._loop = self._main = None
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._close_agents()
+        if not cancelled:
+            self.log("✅ Sincronizzazione completata.")
+
+    async def _sync_pair_async(self, pair: Pair, sem: asyncio.Semaphore, root_locks: Dict[str, asyncio.Lock]):
+        keys = sorted({os.path.normcase(str(Path(pair.left).resolve())), os.path.normcase(str(Path(pair.right).resolve()))})
+        locks = [root_locks.setdefault(k, asyncio.Lock()) for k in keys]
+        async with sem:
+            for lock in locks:  # ordine fisso: niente deadlock tra coppie con radici in comune
+                await lock.acquire()
+            try:
+                t0 = time.time()
+                if not self._start_pair(pair):
+                    return
+                plan, mapA, mapB = await self._plan_for_run_async(pair)
+                await self._execute_plan_async(pair, plan, mapA, mapB)
+                if mapA is None and not self.stop.is_set():
+                    # piano ripreso dal journal: ora il resto dell'albero, contro lo snapshot precedente
+                    plan, mapA, mapB = await self._scan_and_plan_async(pair)
+                    await self._execute_plan_async(pair, plan, mapA, mapB)
+                if self.stop.is_set():
+                    return
+                if plan:
+                    mapA, mapB = await self._scan_async(pair)
+                await self._call(self._save_snapshot, pair, mapA, mapB, bool(plan))
+                self._note_pair(pair, len(plan), t0)
+            finally:
+                for lock in locks:
+                    lock.release()
+
+    async def _scan_async(self, pair: Pair, snap: Optional[Snapshot] = None) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+        # le due radici stanno spesso su dischi diversi: scansione in parallelo
+        reuseA = self._reuse(snap, "A") if snap is not None else None
+        reuseB = self._reuse(snap, "B") if snap is not None else None
+        mapA, mapB = await asyncio.gather(
+            self._call(self._rel_map, Path(pair.left), pair.include_globs, pair.exclude_globs, reuseA),
+            self._call(self._rel_map, Path(pair.right), pair.include_globs, pair.exclude_globs, reuseB),
+        )
+        return mapA, mapB
+
+    async def _plan_for_run_async(self, pair: Pair) -> Tuple[List[tuple], Dict[str, dict], Dict[str, dict]]:
+        resumed = await self._call(self._resume_plan, pair)
+        if resumed:
+            return resumed, None, None
+        cached = self.plan_cache.take(pair) if self.plan_cache is not None else None
+        if cached:
+            plan, mapA, mapB = cached
+            if await self._call(self._revalidate_plan, pair, plan, mapA, mapB):
+                self.log(f"♻️  Riuso il piano dell'anteprima ({len(plan)} azioni)")
+                return plan, mapA, mapB
+        fast = await self._call(self._fast_attach, pair)
+        if fast is not None:
+            mapA, mapB = fast
+            return await self._call(self._plan_from_maps, pair, mapA, mapB), mapA, mapB
+        return await self._scan_and_plan_async(pair)
+
+    async def _scan_and_plan_async(self, pair: Pair) -> Tuple[List[tuple], Dict[str, dict], Dict[str, dict]]:
+        snap = await self._call(self._load_snapshot, pair)
+        mapA, mapB = await self._scan_async(pair, snap)
+        return await self._call(self._plan_pair, pair, mapA, mapB, snap), mapA, mapB
+
+    async def _execute_plan_async(self, pair: Pair, plan: List[tuple],
+                                  mapA: Optional[Dict[str, dict]] = None, mapB: Optional[Dict[str, dict]] = None):
+        self._begin_plan(plan, pair, mapA, mapB)
+        actions: "asyncio.Queue[Optional[List[tuple]]]" = asyncio.Queue(maxsize=self.queue_size)
+
+        async def producer():
+            for unit in self._ordered_units(pair, plan, mapA, mapB):
+                await actions.put(unit)  # si blocca se i worker sono indietro
+            for _ in range(self.workers):
+                await actions.put(None)
+
+        async def worker():
+            while True:
+                unit = await actions.get()
+                if unit is None:
+                    return
+                await self._resume.wait()
+                if not self._fits(pair, unit):
+                    continue
+                try:
+                    files, size = await self._call(self._run_unit, pair, unit)
+                except Exception as e:
+                    self.log(f"❌ Errore su {unit[0][4]}: {e}")
+                    files, size = len(unit), sum(item[3] for item in unit)  # azione conclusa, con errore
+                self._action_done(size, files)
+
+        try:
+            await asyncio.gather(producer(), *(worker() for _ in range(self.workers)))
+        finally:
+            # anche se annullata: fsync in sospeso e indice archivio vanno scritti
+            await self._call(self._end_plan, pair)
+
 # ---------------------------- GUI ---------------------------------
 
 class PairEditor(tk.Toplevel):
@@ -504,6 +3508,9 @@ class PairEditor(tk.Toplevel):
         self.notes_var = tk.StringVar(value=pair.notes if pair else "")
         self.interval_var = tk.IntVar(value=pair.sync_interval if pair else 0)
         self.silent_var = tk.StringVar(value=pair.silent_hours if pair else "")
+        self.touch_var = tk.BooleanVar(value=pair.touch_identical if pair else True)
+        self.io_var = tk.StringVar(value=(pair.io_mode if pair else "") or "default")
+        self.priority_var = tk.StringVar(value=",".join(pair.priority_globs) if pair and pair.priority_globs else "")
 
         pad = {"padx": 8, "pady": 6}
         frame = ttk.Frame(self)
@@ -530,6 +3537,7 @@ class PairEditor(tk.Toplevel):
         optf.grid(row=3, column=0, columnspan=3, sticky="we", pady=(4,4))
         ttk.Checkbutton(optf, text="Modalità conservativa (ripristina file mancanti)", variable=self.cons_var).grid(row=0, column=0, sticky="w", padx=6)
         ttk.Checkbutton(optf, text="Se propaghi, usa cestino (.sync_trash)", variable=self.trash_var).grid(row=0, column=1, sticky="w", padx=6)
+        ttk.Checkbutton(optf, text="Contenuto identico: allinea solo la data (niente copia)", variable=self.touch_var).grid(row=1, column=0, columnspan=2, sticky="w", padx=6)
 
         # Filters
         filt = ttk.LabelFrame(frame, text="Filtri (glob separati da virgola)")
@@ -538,6 +3546,8 @@ class PairEditor(tk.Toplevel):
         ttk.Entry(filt, textvariable=self.include_var, width=60).grid(row=0, column=1, sticky="we")
         ttk.Label(filt, text="Exclude").grid(row=1, column=0, sticky="e")
         ttk.Entry(filt, textvariable=self.exclude_var, width=60).grid(row=1, column=1, sticky="we")
+        ttk.Label(filt, text="Priorità").grid(row=2, column=0, sticky="e")
+        ttk.Entry(filt, textvariable=self.priority_var, width=60).grid(row=2, column=1, sticky="we")
 
         # Schedule
         sched = ttk.LabelFrame(frame, text="Pianificazione")
@@ -546,6 +3556,8 @@ class PairEditor(tk.Toplevel):
         ttk.Spinbox(sched, from_=0, to=86400, textvariable=self.interval_var, width=8).grid(row=0, column=1, sticky="w")
         ttk.Label(sched, text="Finestra silenziosa HH:MM-HH:MM").grid(row=1, column=0, sticky="e")
         ttk.Entry(sched, textvariable=self.silent_var, width=20).grid(row=1, column=1, sticky="w")
+        ttk.Label(sched, text="Page cache (I/O)").grid(row=2, column=0, sticky="e")
+        ttk.Combobox(sched, values=("default",) + IO_MODES, textvariable=self.io_var, width=10, state="readonly").grid(row=2, column=1, sticky="w")
 
         # Notes
         ttk.Label(frame, text="Note").grid(row=6, column=0, sticky="ne")
@@ -580,19 +3592,25 @@ class PairEditor(tk.Toplevel):
             return None
         inc = [s.strip() for s in self.include_var.get().split(",") if s.strip()]
         exc = [s.strip() for s in self.exclude_var.get().split(",") if s.strip()]
+        prio = [s.strip() for s in self.priority_var.get().split(",") if s.strip()]
         return Pair(
             left=a, right=b, conservative=self.cons_var.get(), use_trash=self.trash_var.get(),
             conflict_policy=self.policy_var.get(), include_globs=inc, exclude_globs=exc,
             notes=self.notes_var.get(), sync_interval=int(self.interval_var.get()),
-            silent_hours=self.silent_var.get().strip()
+            silent_hours=self.silent_var.get().strip(), touch_identical=self.touch_var.get(),
+            io_mode="" if self.io_var.get() == "default" else self.io_var.get(),
+            priority_globs=prio
         )
 
     def _preview(self):
         p = self._collect()
         if not p: return
-        # Dry run veloce (usa engine)
+        # Dry run veloce (usa engine): stesse impostazioni della sync, il piano può finire nella cache condivisa
+        engine_settings = getattr(self.master, "_engine_settings", None)
         engine = SyncEngine([p], lambda m: None, lambda *a: None, lambda *a: None,
-                            threading.Event(), threading.Event(), {"retention_days": 30})
+                            threading.Event(), threading.Event(),
+                            engine_settings() if engine_settings else {"retention_days": 30},
+                            plan_cache=getattr(self.master, "plan_cache", None) if engine_settings else None)
         plan, _, _ = engine.dry_run_pair(p)
         dlg = tk.Toplevel(self); dlg.title("Anteprima"); dlg.geometry("800x400")
         tv = ttk.Treeview(dlg, columns=("azione","rel","size"), show="headings")
@@ -613,6 +3631,10 @@ class PairEditor(tk.Toplevel):
                 a = "Rinomina in A"
             elif action == "RENAME_B":
                 a = "Rinomina in B"
+            elif action == "TOUCH_A2B":
+                a = "Allinea mtime A→B"
+            elif action == "TOUCH_B2A":
+                a = "Allinea mtime B→A"
             else:
                 a = action
             tv.insert("", "end", values=(a, rel, human_bytes(size)))
@@ -652,17 +3674,31 @@ class App(tk.Tk):
         self.log_path = app_dir() / LOG_NAME
         self.state = {
             "pairs": [],        # list of Pair as dict
+            "groups": [],       # list of SyncGroup as dict (sync N-way)
             "monitor": False,
             "interval": 10,     # sec
-            "retention_days": 30
+            "retention_days": 30,
+            "retention_max_mb": 0,   # quota per archivio/cestino, 0 = nessun limite
+            "retention_rate": 200,   # file eliminati al secondo dalla manutenzione
+            "durability": "batch",   # "none" | "batch" | "strict" (fsync di copie e snapshot)
+            "verify": "off",         # "off" | "trust" | "reread" (verifica delle copie)
+            "engine": "thread",      # "thread" | "async" (AsyncSyncEngine)
         }
 
         # threads & comms
         self.stop_event = threading.Event()
         self.pause_event = threading.Event()
+        self._engines: List[SyncEngine] = []  # sync in corso, per stop/pausa
         self.log_queue = queue.Queue()
         self.tray_icon = None
         self.last_run: Dict[str, float] = {}
+        self.config = ConfigModel()
+        self.scheduler = PairScheduler()
+        self._sched_interval = None
+        self._config_mtime = None
+        self.maintenance = RetentionWorker(self._log)
+        self.plan_cache = PlanCache()
+        self.maintenance.start()
         self._build_ui()
         self._load_config()
         if start_hidden:
@@ -689,18 +3725,30 @@ class App(tk.Tk):
         self.monitor_var = tk.BooleanVar(value=False)
         self.interval_var = tk.IntVar(value=10)
         self.retention_var = tk.IntVar(value=30)
+        self.quota_var = tk.IntVar(value=0)
+        self.durability_var = tk.StringVar(value="batch")
+        self.verify_var = tk.StringVar(value="off")
+        self.budget_var = tk.IntVar(value=0)
         ttk.Checkbutton(settings, text="Monitora continuamente", variable=self.monitor_var, command=self._toggle_monitor).pack(side="left")
         ttk.Label(settings, text="Intervallo (s):").pack(side="left", padx=(10,4))
         ttk.Spinbox(settings, from_=5, to=7200, textvariable=self.interval_var, width=6).pack(side="left")
         ttk.Label(settings, text="Retention (giorni) archivio/cestino:").pack(side="left", padx=(10,4))
         ttk.Spinbox(settings, from_=0, to=3650, textvariable=self.retention_var, width=6).pack(side="left")
+        ttk.Label(settings, text="Quota (MB, 0=∞):").pack(side="left", padx=(10,4))
+        ttk.Spinbox(settings, from_=0, to=10_000_000, textvariable=self.quota_var, width=8).pack(side="left")
+        ttk.Label(settings, text="Durabilità:").pack(side="left", padx=(10,4))
+        ttk.Combobox(settings, values=DURABILITY_MODES, textvariable=self.durability_var, width=7, state="readonly").pack(side="left")
+        ttk.Label(settings, text="Verifica:").pack(side="left", padx=(10,4))
+        ttk.Combobox(settings, values=VERIFY_MODES, textvariable=self.verify_var, width=7, state="readonly").pack(side="left")
+        ttk.Label(settings, text="Tempo max (min, 0=∞):").pack(side="left", padx=(10,4))
+        ttk.Spinbox(settings, from_=0, to=1440, textvariable=self.budget_var, width=5).pack(side="left")
 
         # Middle: pairs + log
         mid = ttk.Panedwindow(self, orient="horizontal"); mid.pack(fill="both", expand=True, **pad)
 
         leftpane = ttk.Frame(mid); mid.add(leftpane, weight=1)
         ttk.Label(leftpane, text="Coppie configurate").pack(anchor="w")
-        cols = ("A","B","cons","policy","filters","sched","notes")
+        cols = ("A","B","cons","policy","filters","sched","next","notes")
         self.pairs_tv = ttk.Treeview(leftpane, columns=cols, show="headings", height=8)
         self.pairs_tv.heading("A", text="Cartella A")
         self.pairs_tv.heading("B", text="Cartella B")
@@ -708,6 +3756,7 @@ class App(tk.Tk):
         self.pairs_tv.heading("policy", text="Conflitti")
         self.pairs_tv.heading("filters", text="Filtri")
         self.pairs_tv.heading("sched", text="Pianifica")
+        self.pairs_tv.heading("next", text="Prossima sync")
         self.pairs_tv.heading("notes", text="Note")
         self.pairs_tv.pack(fill="both", expand=True, pady=(4,6))
 
@@ -744,13 +3793,46 @@ class App(tk.Tk):
 
     # ---------- pairs CRUD ----------
     def _pairs_from_state(self) -> List[Pair]:
-        out = []
-        for p in self.state.get("pairs", []):
-            try:
-                out.append(Pair(**p))
-            except Exception:
-                pass
-        return out
+        return self.config.pairs
+
+    def _config_changed(self):
+        """Rebuild the cached pair model after the config changed (UI or disk)."""
+        self.config.load(self.state.get("pairs", []), self.state.get("groups", []))
+        self._reschedule()
+        self._refresh_pairs_list()
+
+    def _reschedule(self):
+        self._sched_interval = int(self.interval_var.get())
+        self.scheduler.rebuild(self.config.entries, self._sched_interval, self.last_run,
+                               bool(self.state.get("adaptive_interval", True)))
+        self.after(0, self._refresh_next_runs)
+
+    def _next_interval(self, pid: str, pair: "Pair | SyncGroup", engine: SyncEngine) -> float:
+        """Interval before the next run of ``pair``: fixed, or adapted to what its last run did."""
+        base = pair.sync_interval or int(self.interval_var.get())
+        if not self.state.get("adaptive_interval", True):
+            return base
+        stats = engine.pair_stats.get(pair.id_hash())
+        if stats is None:  # saltata o interrotta: resta l'intervallo corrente
+            return self.scheduler.interval(pid, base)
+        lo = float(self.state.get("interval_min", 5))
+        hi = float(self.state.get("interval_max", 3600))
+        return self.scheduler.adapt(pid, base, stats[0], stats[1], lo, hi)
+
+    def _next_run_label(self, pid: str) -> str:
+        if self.scheduler.is_running(pid):
+            return "in corso"
+        due = self.scheduler.due_at(pid) if self.monitor_var.get() else None
+        if due is None:
+            return ""
+        entry = self.config.by_pid.get(pid)
+        base = (entry.pair.sync_interval if entry else 0) or int(self.interval_var.get())
+        return f"{datetime.fromtimestamp(due):%H:%M:%S} (ogni {format_eta(self.scheduler.interval(pid, base))})"
+
+    def _refresh_next_runs(self):
+        """Update only the next-run column, keeping the selection."""
+        for iid, p in zip(self.pairs_tv.get_children(), self._pairs_from_state()):
+            self.pairs_tv.set(iid, "next", self._next_run_label(self.config.pair_id(p)))
 
     def _refresh_pairs_list(self):
         for i in self.pairs_tv.get_children():
@@ -765,13 +3847,14 @@ class App(tk.Tk):
             if getattr(p, "silent_hours", ""):
                 if sched: sched += " "
                 sched += f"sil:{p.silent_hours}"
-            self.pairs_tv.insert("", "end", values=(p.left, p.right, "sì" if p.conservative else "no", p.conflict_policy, filters.strip(), sched.strip(), p.notes))
+            self.pairs_tv.insert("", "end", values=(p.left, p.right, "sì" if p.conservative else "no", p.conflict_policy, filters.strip(), sched.strip(),
+                                                    self._next_run_label(self.config.pair_id(p)), p.notes))
 
     def _add_pair(self):
         def on_save(pair: Pair):
             d = asdict(pair)
             self.state["pairs"].append(d)
-            self._refresh_pairs_list()
+            self._config_changed()
             self._save_config()
         PairEditor(self, None, on_save)
 
@@ -784,7 +3867,7 @@ class App(tk.Tk):
         p = Pair(**self.state["pairs"][index])
         def on_save(pair: Pair):
             self.state["pairs"][index] = asdict(pair)
-            self._refresh_pairs_list()
+            self._config_changed()
             self._save_config()
         PairEditor(self, p, on_save)
 
@@ -793,7 +3876,7 @@ class App(tk.Tk):
         if not sel: return
         index = self.pairs_tv.index(sel[0])
         del self.state["pairs"][index]
-        self._refresh_pairs_list()
+        self._config_changed()
         self._save_config()
 
     # ---------- config ----------
@@ -801,15 +3884,26 @@ class App(tk.Tk):
         self.state["monitor"] = bool(self.monitor_var.get())
         self.state["interval"] = int(self.interval_var.get())
         self.state["retention_days"] = int(self.retention_var.get())
+        self.state["retention_max_mb"] = int(self.quota_var.get())
+        self.state["durability"] = self.durability_var.get()
+        self.state["verify"] = self.verify_var.get()
+        self.state["time_budget"] = int(self.budget_var.get()) * 60
         try:
             with open(self.config_path, "w", encoding="utf-8") as f:
                 json.dump(self.state, f, ensure_ascii=False, indent=2)
+            self._config_mtime = self._config_file_mtime()
             self._log("💾 Configurazione salvata.")
             self._set_status_message("Configurazione salvata", "#4CAF50")
         except Exception as e:
             self._log(f"❌ Errore salvataggio config: {e}")
             self._set_status_message("Errore salvataggio config", "#F44336")
 
+    def _config_file_mtime(self) -> Optional[int]:
+        try:
+            return self.config_path.stat().st_mtime_ns
+        except OSError:
+            return None
+
     def _load_config(self):
         try:
             if self.config_path.exists():
@@ -818,7 +3912,12 @@ class App(tk.Tk):
             self.monitor_var.set(bool(self.state.get("monitor", False)))
             self.interval_var.set(int(self.state.get("interval", 10)))
             self.retention_var.set(int(self.state.get("retention_days", 30)))
-            self._refresh_pairs_list()
+            self.quota_var.set(int(self.state.get("retention_max_mb", 0)))
+            self.durability_var.set(self.state.get("durability", "batch"))
+            self.verify_var.set(self.state.get("verify", "off"))
+            self.budget_var.set(int(self.state.get("time_budget", 0)) // 60)
+            self._config_mtime = self._config_file_mtime()
+            self._config_changed()
             self._set_status_message("Configurazione caricata", "#4CAF50")
         except Exception as e:
             self._log(f"⚠️  Impossibile leggere la config: {e}")
@@ -890,9 +3989,9 @@ class App(tk.Tk):
         )
 
     # ---------- sync ----------
-    def start_sync(self, pairs: Optional[List[Pair]] = None):
+    def start_sync(self, pairs: Optional[List["Pair | SyncGroup"]] = None):
         if pairs is None:
-            pairs = self._pairs_from_state()
+            pairs = self._pairs_from_state() + self.config.groups
         if not pairs:
             self._log("ℹ️  Nessuna coppia configurata.")
             return
@@ -904,39 +4003,65 @@ class App(tk.Tk):
         t = threading.Thread(target=self._run_sync_thread, args=(pairs,), daemon=True)
         t.start()
 
-    def _run_sync_thread(self, pairs: List[Pair]):
-        engine = SyncEngine(
+    def _engine_settings(self) -> dict:
+        """Settings dict handed to SyncEngine/RetentionWorker (UI values override the config)."""
+        return {
+            "retention_days": int(self.retention_var.get()),
+            "retention_max_mb": int(self.quota_var.get()),
+            "retention_rate": int(self.state.get("retention_rate", 200)),
+            "durability": self.durability_var.get(),
+            "verify": self.verify_var.get(),
+            "time_budget": int(self.budget_var.get()) * 60,
+            "throughput": float(self.state.get("measured_throughput", 0)),
+            "io_mode": self.state.get("io_mode", "nocache"),
+            "priority_order": self.state.get("priority_order", PRIORITY_ORDER),
+            "async_workers": int(self.state.get("async_workers", 4)),
+            "async_pairs": int(self.state.get("async_pairs", 2)),
+            "hash_workers": int(self.state.get("hash_workers", 0)),
+            "verify_all": bool(self.state.get("verify_all", False)),
+            "preallocate": bool(self.state.get("preallocate", True)),
+            "fast_attach": bool(self.state.get("fast_attach", True)),
+            "trust_dir_mtime": bool(self.state.get("trust_dir_mtime", False)),
+            "agents": dict(self.state.get("agents", {})),
+            "agent_token": self.state.get("agent_token", ""),
+            "async_queue": int(self.state.get("async_queue", 64)),
+            "small_file_limit": int(self.state.get("small_file_limit", SMALL_FILE_LIMIT)),
+            "plan_journal": bool(self.state.get("plan_journal", True)),
+            "planner": self.state.get("planner", "auto"),
+            "copy_pipeline": bool(self.state.get("copy_pipeline", True)),
+        }
+
+    def _run_sync_thread(self, pairs: List["Pair | SyncGroup"]):
+        engine_cls = AsyncSyncEngine if self.state.get("engine") == "async" else SyncEngine
+        engine = engine_cls(
             pairs=pairs,
             log_cb=self._log,
             progress_cb=self._update_progress_bars,
             status_cb=self._update_transfer_status,
             stop_event=self.stop_event,
             pause_event=self.pause_event,
-            settings={"retention_days": int(self.retention_var.get())}
+            settings=self._engine_settings(),
+            plan_cache=self.plan_cache,
         )
-        engine.run()
+        self._engines.append(engine)
+        try:
+            engine.run()
+        finally:
+            self._engines.remove(engine)
+        if engine.copy_rate():
+            self.state["measured_throughput"] = int(engine.copy_rate())  # stima per le prossime scadenze
         now = time.time()
-        for p in pairs:
-            self.last_run[p.id_hash()] = now
+        pids = [self.config.pair_id(p) for p in pairs]
+        for pid, p in zip(pids, pairs):
+            self.last_run[pid] = now
+            self.scheduler.schedule(pid, now + self._next_interval(pid, p, engine))
+        self.scheduler.finished(pids)
+        self.after(0, self._refresh_next_runs)
+        roots = [r for p in pairs for r in (p.roots if isinstance(p, SyncGroup) else (p.left, p.right))]
+        self.maintenance.schedule(roots, self._engine_settings())
         self._notify("Sincronizzazione", "Completata")
         self._set_status_message("Sincronizzazione completata", "#4CAF50")
 
-    def _is_silent(self, p: Pair) -> bool:
-        sh = getattr(p, "silent_hours", "")
-        if not sh:
-            return False
-        try:
-            start_s, end_s = sh.split("-")
-            now = datetime.now().time()
-            t0 = datetime.strptime(start_s.strip(), "%H:%M").time()
-            t1 = datetime.strptime(end_s.strip(), "%H:%M").time()
-            if t0 < t1:
-                return t0 <= now < t1
-            else:
-                return now >= t0 or now < t1
-        except Exception:
-            return False
-
     def _toggle_monitor(self):
         enable = self.monitor_var.get()
         self._save_config()
@@ -946,38 +4071,57 @@ class App(tk.Tk):
             t.start()
         else:
             self._log("🕒 Monitoraggio continuo disattivato.")
+            self._refresh_next_runs()
 
     def _monitor_loop(self):
+        self._reschedule()
         while self.monitor_var.get():
-            due: List[Pair] = []
-            now = time.time()
-            for p in self._pairs_from_state():
-                interval = getattr(p, "sync_interval", 0) or int(self.interval_var.get())
-                last = self.last_run.get(p.id_hash(), 0)
-                if now - last < interval:
+            # config modificata su disco da fuori: ricarica nel thread della UI
+            mtime = self._config_file_mtime()
+            if mtime != self._config_mtime:
+                self._config_mtime = mtime
+                self.after(0, self._load_config)
+            if int(self.interval_var.get()) != self._sched_interval:
+                self._reschedule()
+            due: List[PairEntry] = []
+            now = datetime.now()
+            for pid in self.scheduler.pop_due(now.timestamp()):
+                entry = self.config.by_pid.get(pid)
+                if entry is None:
                     continue
-                if self._is_silent(p):
+                if entry.is_silent(now):
+                    self.scheduler.schedule(pid, entry.silent_until(now))
                     continue
-                due.append(p)
+                due.append(entry)
             if due:
                 if self.stop_event.is_set():
                     self.stop_event.clear()
-                self.start_sync(due)
+                self.scheduler.started([e.pid for e in due])
+                self.after(0, self._refresh_next_runs)
+                self.start_sync([e.pair for e in due])
             for _ in range(10):
                 if not self.monitor_var.get():
                     return
                 time.sleep(0.1)
 
     def _toggle_pause(self):
-        if self.pause_event.is_set():
-            self.pause_event.clear()
-            self._log("⏯️ Riprendi")
-        else:
+        paused = not self.pause_event.is_set()
+        if paused:
             self.pause_event.set()
             self._log("⏸️ Pausa")
+        else:
+            self.pause_event.clear()
+            self._log("⏯️ Riprendi")
+        for engine in list(self._engines):
+            engine.set_paused(paused)
 
-    def _stop_sync(self):
+    def _request_stop(self):
         self.stop_event.set()
+        for engine in list(self._engines):
+            engine.request_stop()
+
+    def _stop_sync(self):
+        self._request_stop()
         self._log("⏹️ Stop richiesto")
 
     def _preview_all(self):
@@ -993,7 +4137,8 @@ class App(tk.Tk):
         tv.heading("size", text="Dimensione")
         tv.pack(fill="both", expand=True)
         engine = SyncEngine(pairs, lambda m: None, lambda *a: None, lambda *a: None,
-                            threading.Event(), threading.Event(), {"retention_days": int(self.retention_var.get())})
+                            threading.Event(), threading.Event(), self._engine_settings(),
+                            plan_cache=self.plan_cache)
         total_size = 0
         total_actions = 0
         for p in pairs:
@@ -1011,6 +4156,10 @@ class App(tk.Tk):
                     a = "Rinomina A"
                 elif action == "RENAME_B":
                     a = "Rinomina B"
+                elif action == "TOUCH_A2B":
+                    a = "mtime A→B"
+                elif action == "TOUCH_B2A":
+                    a = "mtime B→A"
                 else:
                     a = action
                 tv.insert("", "end", values=(f"{p.left} ↔ {p.right}", a, rel, human_bytes(size)))
@@ -1033,7 +4182,8 @@ class App(tk.Tk):
             messagebox.showerror(APP_NAME, f"Errore esportazione log: {e}")
 
     def on_close(self):
-        self.stop_event.set()
+        self._request_stop()
+        self.maintenance.shutdown()
         if self.tray_icon:
             try:
                 self.tray_icon.stop()
@@ -1042,6 +4192,7 @@ class App(tk.Tk):
         self.destroy()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # pool di hashing nell'eseguibile PyInstaller
     parser = argparse.ArgumentParser(description=APP_NAME)
     parser.add_argument("--tray", action="store_true", help="Avvia minimizzato nella tray")
     args = parser.parse_args()
@@ -0,0 +1,88 @@
+import random
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+pytest.importorskip("numpy")
+bp = pytest.importorskip("bisync_plus")  # richiede le dipendenze della GUI (PIL, pystray, plyer)
+
+FUZZ = bp.MTIME_FUZZ
+# scarti di mtime attorno alla tolleranza, dove i due planner potrebbero divergere
+DELTAS = [0.0, FUZZ / 2, FUZZ, FUZZ + 0.25, 3 * FUZZ, -FUZZ / 2, -FUZZ, -FUZZ - 0.25, -3 * FUZZ]
+
+
+def _entry(root: str, rel: str, size: int, mtime: float, rng: random.Random) -> dict:
+    # pochi hash distinti: contenuti uguali (touch) e rinomini capitano spesso
+    h = rng.choice(["", "", "h1", "h2", "h3", f"u-{rel}"])
+    return {"abs": f"{root}/{rel}", "size": size, "mtime": mtime, "hash": h}
+
+
+def _random_tree(seed: int):
+    """Maps of A and B plus a snapshot, with paths in every presence/change combination."""
+    rng = random.Random(seed)
+    mapA, mapB, data = {}, {}, {}
+    dirs = ["", "d1", "d1/sub", "d2", "same"]
+    for i in range(rng.randint(40, 120)):
+        d = rng.choice(dirs)
+        rel = f"{d}/f{i}.txt" if d else f"f{i}.txt"
+        base = 1_700_000_000 + rng.randint(0, 50)
+        size = rng.choice([0, 10, 10, 20])
+        where = rng.choice(["A", "B", "AB", "AB", "AB"])
+        if "A" in where:
+            mapA[rel] = _entry("/a", rel, size, base, rng)
+        if "B" in where:
+            sizeB = size if rng.random() < 0.7 else max(0, size + rng.choice([-5, 5]))
+            mapB[rel] = _entry("/b", rel, sizeB, base + rng.choice(DELTAS), rng)
+            if "A" in where and rng.random() < 0.3:
+                mapB[rel]["hash"] = mapA[rel]["hash"]
+        if rng.random() < 0.7:
+            # snapshot: lato assente (None), mtime 0, invariato o cambiato
+            prev = {}
+            for side, m in (("A", mapA), ("B", mapB)):
+                info = m.get(rel)
+                ref = (info or mapA.get(rel) or mapB[rel])["mtime"]
+                choice = rng.choice(["none", "zero", "same", "shift"])
+                prev[side] = {"none": None, "zero": 0, "same": ref, "shift": ref + rng.choice(DELTAS)}[choice]
+                prev["size" + side] = info["size"] if info else 0
+                prev["hash" + side] = rng.choice(["", "h1", "h2"])
+            data[rel] = prev
+    # sottoalbero identico sui due lati: escluso dal confronto via digest
+    for i in range(5):
+        rel = f"same/g{i}.txt"
+        mapA[rel] = {"abs": f"/a/{rel}", "size": 7, "mtime": 1_700_000_100.0, "hash": f"g{i}"}
+        mapB[rel] = dict(mapA[rel], abs=f"/b/{rel}")
+    for i in range(rng.randint(0, 5)):
+        data[f"gone/x{i}.txt"] = {"A": 1.0, "B": None, "sizeA": 1, "sizeB": 0, "hashA": "", "hashB": ""}
+    return mapA, mapB, data
+
+
+def _plan(planner: str, pair, mapA, mapB, data):
+    engine = bp.SyncEngine([], lambda *a: None, lambda *a: None, lambda *a: None,
+                           threading.Event(), threading.Event(), {"planner": planner})
+    snap = bp.Snapshot(pair)
+    snap.data = data
+    return engine._plan_pair(pair, mapA, mapB, snap)
+
+
+@pytest.mark.parametrize("policy", ["newest", "prefer_left", "prefer_right"])
+@pytest.mark.parametrize("conservative", [True, False])
+@pytest.mark.parametrize("touch", [True, False])
+def test_numpy_planner_matches_python(policy, conservative, touch):
+    pair = bp.Pair(left="/a", right="/b", conservative=conservative,
+                   conflict_policy=policy, touch_identical=touch)
+    actions = set()
+    for seed in range(40):
+        mapA, mapB, data = _random_tree(seed)
+        expected = _plan("python", pair, mapA, mapB, data)
+        assert _plan("numpy", pair, mapA, mapB, data) == expected, f"seed {seed}"
+        actions.update(item[0] for item in expected)
+    # gli alberi casuali devono esercitare i rami della combinazione
+    assert {"COPY_A2B", "COPY_B2A"} <= actions
+    if not conservative:
+        assert {"DELETE_A", "DELETE_B"} <= actions
+    if touch:
+        assert actions & {"TOUCH_A2B", "TOUCH_B2A"}
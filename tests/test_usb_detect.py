@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import usb_detect  # noqa: E402
+
+
+class FakePopen:
+    """Stands in for ``subprocess.Popen``: records the launch, reports ``pid``."""
+
+    launches: list[list[str]] = []
+    pid = 0
+
+    def __init__(self, args, **kwargs):
+        FakePopen.launches.append(list(args))
+        self.pid = FakePopen.pid
+
+
+def _wait_for(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    drive = tmp_path / "usb"
+    exe = drive / "app" / "BiSyncPlus"
+    exe.parent.mkdir(parents=True)
+    monkeypatch.setattr(usb_detect, "RELATIVE_EXE_PATH", "app/BiSyncPlus")
+    monkeypatch.setattr(usb_detect, "PID_FILE", tmp_path / "app.pid")
+    monkeypatch.setattr(usb_detect, "LOCK_FILE", tmp_path / "detect.lock")
+    monkeypatch.setattr(usb_detect.subprocess, "Popen", FakePopen)
+    FakePopen.launches = []
+    FakePopen.pid = os.getpid()
+    return drive, exe
+
+
+def _run_main(watcher):
+    stop = threading.Event()
+    t = threading.Thread(target=usb_detect.main, kwargs={"watcher": watcher, "stop_event": stop})
+    t.start()
+    return stop, t
+
+
+def _replug(watcher, drive):
+    watcher.set_volumes({})
+    assert _wait_for(lambda: watcher.lookup(usb_detect.USB_LABEL) is None)
+    time.sleep(0.1)
+    watcher.set_volumes({usb_detect.USB_LABEL: str(drive)})
+
+
+def test_main_launches_on_plug(env):
+    drive, exe = env
+    exe.write_text("fake")
+    watcher = usb_detect.FakeVolumeWatcher()
+    stop, t = _run_main(watcher)
+    try:
+        time.sleep(0.1)
+        assert FakePopen.launches == []
+        watcher.set_volumes({usb_detect.USB_LABEL: str(drive)})
+        assert _wait_for(lambda: len(FakePopen.launches) == 1)
+        assert json.loads(usb_detect.PID_FILE.read_text())["pid"] == os.getpid()
+    finally:
+        stop.set()
+        t.join(5)
+    assert not t.is_alive()
+
+
+def test_recycled_pid_does_not_block_launch(env):
+    # il PID registrato è vivo (questo processo) ma non è l'applicazione
+    drive, exe = env
+    exe.write_text("fake")
+    watcher = usb_detect.FakeVolumeWatcher({usb_detect.USB_LABEL: str(drive)})
+    stop, t = _run_main(watcher)
+    try:
+        assert _wait_for(lambda: len(FakePopen.launches) == 1)
+        _replug(watcher, drive)
+        assert _wait_for(lambda: len(FakePopen.launches) == 2)
+    finally:
+        stop.set()
+        t.join(5)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="usa /proc")
+def test_running_app_is_not_relaunched(env):
+    # l'"applicazione" è l'interprete corrente: il PID registrato la esegue davvero
+    drive, exe = env
+    exe.symlink_to(os.path.realpath(sys.executable))
+    watcher = usb_detect.FakeVolumeWatcher({usb_detect.USB_LABEL: str(drive)})
+    stop, t = _run_main(watcher)
+    try:
+        assert _wait_for(lambda: len(FakePopen.launches) == 1)
+        _replug(watcher, drive)
+        time.sleep(1.0)
+        assert len(FakePopen.launches) == 1
+    finally:
+        stop.set()
+        t.join(5)
@@ -1,11 +1,15 @@
-from __future__ import annotations
-
 """Utility to detect a USB drive and launch the sync application."""
 
+from __future__ import annotations
+
 import json
 import logging
 import os
+import re
+import select
 import subprocess
+import sys
+import threading
 import time
 from pathlib import Path
 
@@ -36,79 +40,418 @@ USB_LABEL = CONFIG["label"]
 RELATIVE_EXE_PATH = CONFIG["relative_exe"]
 LOG = Path(os.environ.get("LOCALAPPDATA", str(Path.home()))) / "BiSyncPlus" / "usb-detect.log"
 LOG.parent.mkdir(parents=True, exist_ok=True)
+PID_FILE = LOG.parent / "bisyncplus.pid"
+LOCK_FILE = LOG.parent / "usb-detect.lock"
+POLL_FALLBACK = 30.0  # rilettura di sicurezza anche senza eventi
 logging.basicConfig(filename=str(LOG), level=logging.INFO,
                     format="%(asctime)s %(message)s")
 
 
+class VolumeWatcher:
+    """
+    Base for volume watchers: ``wait`` blocks until the set of mounted volumes
+    may have changed, ``lookup`` maps a label to its mount point. Lookups are
+    cached until the next change event.
+    """
+
+    def __init__(self) -> None:
+        self._cache: dict[str, str | None] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, label: str) -> str | None:
+        with self._lock:
+            if label in self._cache:
+                return self._cache[label]
+        mount = self._find(label)
+        with self._lock:
+            self._cache[label] = mount
+        return mount
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until a change (True) or ``timeout`` (False); the cache is dropped either way."""
+        changed = self._wait(timeout)
+        self.invalidate()
+        return changed
+
+    def close(self) -> None:
+        pass
+
+    def _find(self, label: str) -> str | None:
+        raise NotImplementedError
+
+    def _wait(self, timeout: float | None) -> bool:
+        raise NotImplementedError
+
+
+class WindowsVolumeWatcher(VolumeWatcher):
+    """
+    Etichette lette via ``GetVolumeInformationW`` (nessun processo esterno);
+    gli eventi arrivano da un solo PowerShell persistente iscritto a
+    ``Win32_VolumeChangeEvent``. Se non parte si ricade sul polling.
+    """
+
+    EVENT_SCRIPT = (
+        "Register-WmiEvent -Class Win32_VolumeChangeEvent -SourceIdentifier bisync_vol | Out-Null; "
+        "while ($true) { $e = Wait-Event -SourceIdentifier bisync_vol; "
+        "Remove-Event -SourceIdentifier bisync_vol; "
+        "[Console]::Out.WriteLine($e.SourceEventArgs.NewEvent.EventType); [Console]::Out.Flush() }"
+    )
+
+    def __init__(self, poll_interval: float = 2.0) -> None:
+        super().__init__()
+        import ctypes
+        self._ctypes = ctypes
+        self._k32 = ctypes.windll.kernel32
+        self._k32.SetErrorMode(0x0001)  # SEM_FAILCRITICALERRORS: niente popup per lettori vuoti
+        self._event = threading.Event()
+        self._poll_interval = poll_interval
+        self._proc: subprocess.Popen | None = None
+        try:
+            self._proc = subprocess.Popen(
+                ["powershell", "-NoProfile", "-Command", self.EVENT_SCRIPT],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                creationflags=0x08000000,
+            )
+            threading.Thread(target=self._reader, daemon=True).start()
+        except Exception as e:
+            logging.info("Eventi volume non disponibili, uso polling: %s", e)
+            self._proc = None
+
+    def _reader(self) -> None:
+        assert self._proc is not None and self._proc.stdout is not None
+        for _line in self._proc.stdout:
+            self._event.set()
+        self._proc = None
+        self._event.set()
+
+    def _find(self, label: str) -> str | None:
+        buf = self._ctypes.create_unicode_buffer(261)
+        mask = self._k32.GetLogicalDrives()
+        for i in range(26):
+            if not mask & (1 << i):
+                continue
+            root = f"{chr(65 + i)}:\\"
+            if self._k32.GetVolumeInformationW(root, buf, len(buf), None, None, None, None, 0):
+                if buf.value.lower() == label.lower():
+                    return root[:2]
+        return None
+
+    def _wait(self, timeout: float | None) -> bool:
+        if self._proc is None:
+            timeout = self._poll_interval if timeout is None else min(timeout, self._poll_interval)
+            time.sleep(timeout)
+            return True
+        changed = self._event.wait(timeout)
+        self._event.clear()
+        return changed
+
+    def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            proc.terminate()
+
+
+def _unescape_mount(field: str) -> str:
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+class LinuxVolumeWatcher(VolumeWatcher):
+    """
+    ``/proc/self/mountinfo`` segnala ogni mount/umount con POLLPRI: il thread
+    resta fermo in ``poll`` senza costo. Etichette risolte via
+    ``/dev/disk/by-label`` o, in mancanza, dal nome della cartella di mount.
+    """
+
+    def __init__(self, mountinfo: str = "/proc/self/mountinfo",
+                 by_label: str = "/dev/disk/by-label") -> None:
+        super().__init__()
+        self._by_label = Path(by_label)
+        self._file = open(mountinfo, "rb")
+        self._poll = select.poll()
+        self._poll.register(self._file, select.POLLPRI | select.POLLERR)
+        self._mounts = self._read_mounts()
+
+    def _read_mounts(self) -> list[tuple[str, str]]:
+        """Return ``(source, mount_point)`` for each mounted filesystem (re-arms the poll)."""
+        self._file.seek(0)
+        out = []
+        for line in self._file.read().decode("utf-8", "replace").splitlines():
+            left, _, right = line.partition(" - ")
+            fields, tail = left.split(), right.split()
+            if len(fields) >= 5 and len(tail) >= 2:
+                out.append((tail[1], _unescape_mount(fields[4])))
+        return out
+
+    def _find(self, label: str) -> str | None:
+        dev = self._by_label / label.replace(" ", "\\x20")
+        source = os.path.realpath(dev) if dev.exists() else None
+        for src, mount in self._mounts:
+            if source is not None and os.path.realpath(src) == source:
+                return mount
+        for src, mount in self._mounts:
+            if src.startswith("/dev/") and os.path.basename(mount) == label:
+                return mount
+        return None
+
+    def _wait(self, timeout: float | None) -> bool:
+        events = self._poll.poll(None if timeout is None else int(timeout * 1000))
+        self._mounts = self._read_mounts()
+        return bool(events)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class FakeVolumeWatcher(VolumeWatcher):
+    """In-memory watcher for tests: ``set_volumes`` mimics a plug/unplug."""
+
+    def __init__(self, volumes: dict[str, str] | None = None) -> None:
+        super().__init__()
+        self._volumes = dict(volumes or {})
+        self._event = threading.Event()
+        self.lookups = 0
+
+    def set_volumes(self, volumes: dict[str, str]) -> None:
+        self._volumes = dict(volumes)
+        self._event.set()
+
+    def _find(self, label: str) -> str | None:
+        self.lookups += 1
+        return self._volumes.get(label)
+
+    def _wait(self, timeout: float | None) -> bool:
+        changed = self._event.wait(timeout)
+        self._event.clear()
+        return changed
+
+
+class PollingVolumeWatcher(VolumeWatcher):
+    """Fallback for platforms without an event source: re-list ``root`` periodically."""
+
+    def __init__(self, root: str = "/Volumes", interval: float = 2.0) -> None:
+        super().__init__()
+        self._root = Path(root)
+        self._interval = interval
+
+    def _find(self, label: str) -> str | None:
+        path = self._root / label
+        return str(path) if path.is_dir() else None
+
+    def _wait(self, timeout: float | None) -> bool:
+        time.sleep(self._interval if timeout is None else min(timeout, self._interval))
+        return True
+
+
+def make_watcher() -> VolumeWatcher:
+    """Pick the watcher backend for the current platform."""
+    if os.name == "nt":
+        return WindowsVolumeWatcher()
+    if sys.platform.startswith("linux") and os.path.exists("/proc/self/mountinfo"):
+        try:
+            return LinuxVolumeWatcher()
+        except OSError as e:
+            logging.info("mountinfo non disponibile, uso polling: %s", e)
+    return PollingVolumeWatcher()
+
+
+_WATCHER: VolumeWatcher | None = None
+
+
 def find_labeled_drive() -> str | None:
-    """Return drive letter (e.g. ``'E:'``) if the labelled USB is present."""
+    """Return the mount (e.g. ``'E:'``) of the labelled USB, if present."""
+    global _WATCHER
+    if _WATCHER is None:
+        _WATCHER = make_watcher()
+    return _WATCHER.lookup(USB_LABEL)
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        import ctypes
+        k32 = ctypes.windll.kernel32
+        handle = k32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            return bool(k32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259  # STILL_ACTIVE
+        finally:
+            k32.CloseHandle(handle)
     try:
-        out = subprocess.check_output(
-            [
-                "powershell",
-                "-NoProfile",
-                "-Command",
-                f"(Get-Volume -FileSystemLabel '{USB_LABEL}' -ErrorAction SilentlyContinue).DriveLetter",
-            ],
-            text=True,
-            stderr=subprocess.DEVNULL,
-        ).strip()
-        if out:
-            return f"{out}:"
-    except Exception:
-        pass
-    return None
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
 
 
-def is_application_running(full_path: str) -> bool:
-    """Check if the application at ``full_path`` is already running."""
-    name = Path(full_path).stem
+def _pid_image(pid: int) -> str | None:
+    """Executable (or script) path of ``pid``; ``None`` if it cannot be read."""
+    if os.name == "nt":
+        import ctypes
+        k32 = ctypes.windll.kernel32
+        handle = k32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return None
+        try:
+            buf = ctypes.create_unicode_buffer(32768)
+            size = ctypes.c_ulong(len(buf))
+            if k32.QueryFullProcessImageNameW(handle, 0, buf, ctypes.byref(size)):
+                return buf.value
+            return None
+        finally:
+            k32.CloseHandle(handle)
     try:
+        return os.readlink(f"/proc/{pid}/exe")
+    except OSError:
+        return None
+
+
+def _same_path(a: str, b: str) -> bool:
+    if os.name == "nt":
+        return os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b))
+    return os.path.realpath(a) == os.path.realpath(b)
+
+
+def _pid_is_app(pid: int, full_path: str) -> bool:
+    """True if ``pid`` is alive and runs ``full_path`` (a recycled PID does not count)."""
+    if pid <= 0 or not _pid_alive(pid):
+        return False
+    image = _pid_image(pid)
+    if image is not None and _same_path(image, full_path):
+        return True
+    if os.name != "nt":
+        # eseguibili lanciati tramite interprete: il percorso è in argv
+        try:
+            argv = Path(f"/proc/{pid}/cmdline").read_bytes().split(b"\0")[:2]
+        except OSError:
+            return False
+        return any(a and _same_path(os.fsdecode(a), full_path) for a in argv)
+    return False
+
+
+def _process_running(full_path: str) -> bool:
+    """Look for ``full_path`` among all running processes (also ones we did not launch)."""
+    if os.name == "nt":
+        quoted = full_path.replace("'", "''")
         cmd = [
             "powershell",
             "-NoProfile",
             "-Command",
             (
                 "Get-Process -Name '{name}' -ErrorAction SilentlyContinue | "
-                "Where-Object { $_.Path -ieq '{full_path}' } | Select-Object -First 1"
-            ).format(name=name, full_path=full_path),
+                "Where-Object {{ $_.Path -ieq '{full_path}' }} | Select-Object -First 1"
+            ).format(name=Path(full_path).stem.replace("'", "''"), full_path=quoted),
         ]
-        out = subprocess.check_output(cmd, text=True, stderr=subprocess.DEVNULL)
-        return bool(out.strip())
-    except Exception:
+        try:
+            out = subprocess.check_output(cmd, text=True, stderr=subprocess.DEVNULL,
+                                          creationflags=0x08000000)
+            return bool(out.strip())
+        except Exception:
+            return False
+    try:
+        pids = [int(d) for d in os.listdir("/proc") if d.isdigit()]
+    except OSError:
         return False
+    return any(pid != os.getpid() and _pid_is_app(pid, full_path) for pid in pids)
 
 
-def launch_app(drive: str) -> None:
+def is_application_running(full_path: str, pid_file: Path | None = None) -> bool:
+    """
+    Check if the application at ``full_path`` is already running: first the
+    PID recorded at launch, then a scan of the running processes.
+    """
+    try:
+        data = json.loads((pid_file or PID_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        data = None
+    if isinstance(data, dict) and os.path.normcase(str(data.get("exe", ""))) == os.path.normcase(full_path):
+        try:
+            if _pid_is_app(int(data.get("pid", 0)), full_path):
+                return True
+        except (TypeError, ValueError):
+            pass
+    return _process_running(full_path)
+
+
+def launch_app(drive: str, pid_file: Path | None = None) -> None:
     """Launch the configured application from ``drive`` if possible."""
-    exe = os.path.join(drive, RELATIVE_EXE_PATH)
+    pid_file = pid_file or PID_FILE
+    exe = os.path.join(drive + os.sep, *re.split(r"[\\/]+", RELATIVE_EXE_PATH.strip("\\/")))
     logging.info("Check EXE: %s", exe)
     if not os.path.exists(exe):
         logging.info("EXE non trovato: %s", exe)
         return
-    if is_application_running(exe):
+    if is_application_running(exe, pid_file):
         logging.info("Già in esecuzione: %s", exe)
         return
     try:
-        subprocess.Popen(
-            [exe, "--tray"], cwd=os.path.dirname(exe), creationflags=0x08000000
-        )
+        flags = 0x08000000 if os.name == "nt" else 0
+        proc = subprocess.Popen([exe, "--tray"], cwd=os.path.dirname(exe), creationflags=flags)
+        pid_file.write_text(json.dumps({"pid": proc.pid, "exe": exe}), encoding="utf-8")
         logging.info("Avviato: %s", exe)
     except Exception as e:
         logging.error("Errore avvio: %s", e)
 
 
-def main() -> None:
-    """Main loop that waits for the USB drive and launches the app."""
-    while True:
-        drive = find_labeled_drive()
-        if drive:
-            logging.info("Volume presente: %s", drive)
-            launch_app(drive)
-            while find_labeled_drive():
-                time.sleep(1)
-            logging.info("Volume scollegato")
-        time.sleep(1)
+class InstanceLock:
+    """Exclusive lock file so only one detector runs per user."""
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path or LOCK_FILE
+        self._fh = None
+
+    def acquire(self) -> bool:
+        fh = open(self.path, "a+")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return False
+        self._fh = fh
+        return True
+
+    def release(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def main(watcher: VolumeWatcher | None = None,
+         stop_event: threading.Event | None = None) -> None:
+    """Wait for volume change events and launch the app when the USB appears."""
+    global _WATCHER
+    lock = InstanceLock()
+    if not lock.acquire():
+        logging.info("USBDetect già in esecuzione")
+        return
+    watcher = watcher or make_watcher()
+    _WATCHER = watcher
+    present: str | None = None
+    try:
+        while stop_event is None or not stop_event.is_set():
+            drive = watcher.lookup(USB_LABEL)
+            if drive and drive != present:
+                logging.info("Volume presente: %s", drive)
+                launch_app(drive)
+            elif present and not drive:
+                logging.info("Volume scollegato")
+            present = drive
+            watcher.wait(POLL_FALLBACK if stop_event is None else 0.5)
+    finally:
+        watcher.close()
+        lock.release()
 
 
 if __name__ == "__main__":